@@ -0,0 +1,61 @@
+"""One-off migration: rewrite legacy order lines in the compact format.
+
+Orders used to store whatever the client posted as ``items``, typically
+whole cart items with the product or blend copied into ``details``. This
+reduces every line to the ``OrderLine`` fields (ids, name, quantity, unit
+price, line total) in both ``orders`` and ``orders_archive``, in bounded
+batches. It is safe to run more than once.
+
+    cd backend && python compact_orders.py [--dry-run] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from server import ORDER_LINE_FIELDS, close_mongo, compact_order_line, connect_mongo
+
+# Lines carrying anything but OrderLine fields, or missing a name
+LEGACY_LINE = {"$elemMatch": {"$or": [
+    {"details": {"$exists": True}},
+    {"type": {"$exists": True}},
+    {"id": {"$exists": True}},
+    {"name": {"$exists": False}},
+]}}
+
+
+async def compact_collection(collection, batch_size, dry_run):
+    compacted = 0
+    bytes_saved = 0
+    batch = []
+    async for order in collection.find({"items": LEGACY_LINE}, {"_id": 1, "items": 1}):
+        items = [compact_order_line(line) for line in order["items"]]
+        bytes_saved += len(repr(order["items"])) - len(repr(items))
+        batch.append(UpdateOne({"_id": order["_id"], "items": order["items"]}, {"$set": {"items": items}}))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                await collection.bulk_write(batch, ordered=False)
+            compacted += len(batch)
+            batch = []
+    if batch:
+        if not dry_run:
+            await collection.bulk_write(batch, ordered=False)
+        compacted += len(batch)
+    return compacted, bytes_saved
+
+
+async def main(batch_size, dry_run):
+    db = connect_mongo()
+    for name in ("orders", "orders_archive"):
+        compacted, bytes_saved = await compact_collection(db[name], batch_size, dry_run)
+        action = "would compact" if dry_run else "compacted"
+        print(f"{name}: {action} {compacted} orders, ~{bytes_saved} bytes of line data saved")
+    close_mongo()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Reduce order lines to {', '.join(sorted(ORDER_LINE_FIELDS))}")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
@@ -0,0 +1,88 @@
+"""One-off migration: fold per-line cart documents into one cart per user.
+
+Carts used to be a ``cart`` collection with one document per line. They
+now live in ``carts``, one document per user with the lines embedded
+under ``lines.<product|blend>:<id>``. This adds every legacy line to its
+user's cart (summing quantities with anything already there) and then
+drops the old ``cart`` collection, so running it twice does not double
+any quantity. Lines that cannot be keyed (no user, no product or blend id,
+or no positive quantity) are copied to ``cart_unmigrated`` first, so
+nothing is lost with the old collection.
+
+    cd backend && python migrate_carts.py [--dry-run] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from server import CART_ID_PATTERN, cart_add_update, close_mongo, connect_mongo, parse_datetime
+
+
+def legacy_line(doc):
+    """(key, line) of a legacy cart document, or None if it cannot be keyed."""
+    if doc.get("product_id"):
+        kind, field = "product", "product_id"
+    elif doc.get("custom_blend_id"):
+        kind, field = "blend", "custom_blend_id"
+    else:
+        return None
+    if not CART_ID_PATTERN.match(doc[field]) or int(doc.get("quantity") or 0) < 1:
+        return None
+    created_at = doc.get("created_at")
+    if isinstance(created_at, str):
+        created_at = parse_datetime(created_at)
+    line = {field: doc[field], "quantity": int(doc["quantity"])}
+    if created_at:
+        line["created_at"] = created_at
+    return f"{kind}:{doc[field]}", line
+
+
+async def main(batch_size, dry_run):
+    db = connect_mongo()
+    carts = {}
+    skipped = []
+    async for doc in db.cart.find({}, {"_id": 0}):
+        keyed = legacy_line(doc) if doc.get("user_id") else None
+        if keyed is None:
+            skipped.append(doc)
+            continue
+        key, line = keyed
+        lines = carts.setdefault(doc["user_id"], {})
+        if key in lines:
+            lines[key]["quantity"] += line["quantity"]
+        else:
+            lines[key] = line
+
+    now = datetime.now(timezone.utc)
+    batch = []
+    for user_id, lines in carts.items():
+        update = cart_add_update(lines, now)
+        update["$set"]["updated_at"] = now
+        update["$setOnInsert"] = {"user_id": user_id}
+        batch.append(UpdateOne({"id": f"user:{user_id}"}, update, upsert=True))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                await db.carts.bulk_write(batch, ordered=False)
+            batch = []
+    if batch and not dry_run:
+        await db.carts.bulk_write(batch, ordered=False)
+    if not dry_run:
+        for start in range(0, len(skipped), batch_size):
+            await db.cart_unmigrated.insert_many(skipped[start:start + batch_size])
+        await db.cart.drop()
+
+    action = "would merge" if dry_run else "merged"
+    kept = "would keep" if dry_run else "kept"
+    print(f"cart: {action} {sum(len(lines) for lines in carts.values())} lines into {len(carts)} carts, "
+          f"{kept} {len(skipped)} unkeyed lines in cart_unmigrated")
+    close_mongo()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold per-line cart documents into one cart per user")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
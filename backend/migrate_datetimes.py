@@ -0,0 +1,58 @@
+"""One-off migration: convert ISO-string timestamps to native BSON dates.
+
+Older documents stored ``created_at``/``updated_at`` (and friends) as
+``datetime.isoformat()`` strings. The repository layer now writes real
+dates, so this rewrites the remaining string values in place, in bounded
+batches. It is safe to run more than once.
+
+    cd backend && python migrate_datetimes.py [--dry-run] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from server import REPOSITORIES, close_mongo, connect_mongo, parse_datetime
+
+
+async def migrate_field(collection, field, batch_size, dry_run):
+    converted = 0
+    failed = 0
+    batch = []
+    cursor = collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1})
+    async for doc in cursor:
+        try:
+            value = parse_datetime(doc[field])
+        except ValueError:
+            failed += 1
+            continue
+        batch.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                await collection.bulk_write(batch, ordered=False)
+            converted += len(batch)
+            batch = []
+    if batch:
+        if not dry_run:
+            await collection.bulk_write(batch, ordered=False)
+        converted += len(batch)
+    return converted, failed
+
+
+async def main(batch_size, dry_run):
+    db = connect_mongo()
+    for repo in REPOSITORIES:
+        collection = db[repo.collection_name]
+        for field in repo.datetime_fields:
+            converted, failed = await migrate_field(collection, field, batch_size, dry_run)
+            action = "would convert" if dry_run else "converted"
+            print(f"{repo.collection_name}.{field}: {action} {converted}, unparseable {failed}")
+    close_mongo()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert string timestamps to BSON dates")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
@@ -0,0 +1,32 @@
+"""Rebuild the admin dashboard sales rollups from the live and archived orders.
+
+Rollups are maintained incrementally as orders are written; run this after
+bulk data fixes, a restore, or to backfill orders placed before rollups
+existed. Also run it once when upgrading from rollups that kept per-product
+and per-blend counters inside the single ``units`` document: it moves them
+to one document per item.
+
+Stop the API workers (or otherwise halt order writes) first: the rebuild
+swaps in a fresh collection, and any counter increments made while it
+runs would be lost or double-counted.
+
+    cd backend && python rebuild_rollups.py [--batch-size 1000]
+"""
+import argparse
+import asyncio
+
+from server import close_mongo, connect_mongo, sales_rollups
+
+
+async def main(batch_size):
+    connect_mongo()
+    result = await sales_rollups.rebuild(batch_size=batch_size)
+    print(f"Rebuilt {result['buckets']} rollup buckets from {result['orders']} orders in {result['seconds']}s")
+    close_mongo()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild sales rollups from scratch")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -1,40 +1,542 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Header, Query
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, DeleteOne, IndexModel, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure, BulkWriteError
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, TypeAdapter, conint, field_validator
+from typing import List, Optional, Dict, Any, get_args, get_origin
+from collections import OrderedDict, deque
 import uuid
+import time
+import json
+import re
+import unicodedata
+import base64
+import gzip
+import hashlib
+import csv
+import io
+import codecs
+import asyncio
+import bisect
+import random
+import math
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
 import jwt
-from passlib.context import CryptContext
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import numpy as np
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    orjson = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Query plan audit (test mode): "true" reports COLLSCANs, "strict" also fails shutdown
+QUERY_PLAN_AUDIT = os.environ.get('QUERY_PLAN_AUDIT', 'false').lower()
+
+class QueryPlanAuditor(monitoring.CommandListener):
+    """Records every read/write query the app issues so it can be explained later."""
+
+    AUDITED_COMMANDS = {"find", "count", "distinct", "aggregate", "findAndModify", "update", "delete"}
+    DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit",
+                     "startTransaction", "readConcern", "writeConcern", "comment", "ordered"}
+
+    def __init__(self):
+        self.commands: Dict[str, tuple] = {}
+
+    @staticmethod
+    def _shape(value):
+        if isinstance(value, dict):
+            return {k: QueryPlanAuditor._shape(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [QueryPlanAuditor._shape(v) for v in value[:1]]
+        return "?"
+
+    def started(self, event):
+        if event.command_name not in self.AUDITED_COMMANDS:
+            return
+        command = {k: v for k, v in event.command.items() if k not in self.DRIVER_FIELDS}
+        shape = json.dumps(self._shape(command), sort_keys=True)
+        self.commands.setdefault(shape, (event.database_name, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    @staticmethod
+    def _has_collscan(plan) -> bool:
+        if isinstance(plan, dict):
+            if plan.get("stage") == "COLLSCAN":
+                return True
+            return any(QueryPlanAuditor._has_collscan(v) for v in plan.values())
+        if isinstance(plan, list):
+            return any(QueryPlanAuditor._has_collscan(v) for v in plan)
+        return False
+
+    @staticmethod
+    def _is_full_scan(command: dict) -> bool:
+        # Listing a whole collection without ordering is a scan by design
+        query = command.get("filter", command.get("query"))
+        return command.get("find") is not None and not query and not command.get("sort")
+
+    async def audit(self, mongo_client) -> List[dict]:
+        violations = []
+        for shape, (database_name, command) in list(self.commands.items()):
+            if self._is_full_scan(command):
+                continue
+            try:
+                explained = await mongo_client[database_name].command(
+                    {"explain": command, "verbosity": "queryPlanner"}
+                )
+            except OperationFailure as e:
+                violations.append({"command": shape, "error": str(e)})
+                continue
+            if self._has_collscan(explained.get("queryPlanner", explained)):
+                violations.append({"command": shape, "stage": "COLLSCAN"})
+        return violations
+
+query_auditor = QueryPlanAuditor()
+
+# Metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# Bearer token required to scrape /api/metrics; open when unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Log requests slower than this (ms) with their Mongo command breakdown; 0 disables
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+class MetricFamily:
+    """One Prometheus metric (counter, gauge or histogram) keyed by label values."""
+
+    def __init__(self, name: str, kind: str, help_text: str, labels: tuple = (), buckets: tuple = ()):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self.values[label_values] = value
+
+    def observe(self, *label_values, value: float):
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                # per-bucket counts (last one is +Inf), then sum and count
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _label_text(self, label_values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, [list(value[0]), value[1], value[2]] if self.kind == "histogram" else value)
+                     for key, value in self.values.items()]
+        for label_values, value in sorted(items):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{self._label_text(label_values)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                bucket_labels = self._label_text(label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(label_values)} {total}")
+            lines.append(f"{self.name}_count{self._label_text(label_values)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families: Dict[str, MetricFamily] = {}
+
+    def _family(self, name, kind, help_text, labels, buckets=()) -> MetricFamily:
+        if name not in self.families:
+            self.families[name] = MetricFamily(name, kind, help_text, tuple(labels), tuple(buckets))
+        return self.families[name]
+
+    def counter(self, name: str, help_text: str, labels=()) -> MetricFamily:
+        return self._family(name, "counter", help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels=()) -> MetricFamily:
+        return self._family(name, "gauge", help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS) -> MetricFamily:
+        return self._family(name, "histogram", help_text, labels, buckets)
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+class RequestTrace:
+    """Mongo commands issued while serving one request."""
+
+    def __init__(self):
+        self.commands: List[tuple] = []
+
+    def breakdown(self) -> Dict[tuple, list]:
+        grouped: Dict[tuple, list] = {}
+        for command, collection, seconds in self.commands:
+            entry = grouped.setdefault((command, collection), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        return grouped
+
+# Motor copies the context into its executor threads, so the listener sees this
+request_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar('request_trace', default=None)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every Mongo command and attributes it to the request that issued it."""
+
+    IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue"}
+
+    def __init__(self):
+        self._pending: Dict[tuple, tuple] = {}
+        self.duration = metrics.histogram(
+            "mongo_command_duration_seconds", "Mongo command round-trip time", ("command", "collection"))
+        self.failures = metrics.counter("mongo_command_failures_total", "Mongo commands that failed", ("command", "collection"))
+
+    def started(self, event):
+        if event.command_name in self.IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else "-"
+        self._pending[(event.connection_id, event.request_id)] = (collection, request_trace.get())
+
+    def _finish(self, event, failed: bool):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        collection, trace = pending
+        seconds = event.duration_micros / 1e6
+        self.duration.observe(event.command_name, collection, value=seconds)
+        if failed:
+            self.failures.inc(event.command_name, collection)
+        if trace is not None:
+            trace.commands.append((event.command_name, collection, seconds))
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+mongo_metrics = MongoCommandMetrics()
+
+class MongoReadRouting(monitoring.CommandListener, monitoring.ServerListener):
+    """Counts reads by the read preference they asked for and the kind of member that served them."""
+
+    # getMore is left out: a cursor's later batches come from the member that ran its query
+    READ_COMMANDS = {"find", "aggregate", "count", "distinct"}
+    ROLES = {"RSPrimary": "primary", "RSSecondary": "secondary", "Standalone": "standalone", "Mongos": "mongos"}
+
+    def __init__(self):
+        # server address -> role, kept current by the driver's topology monitoring
+        self.members: Dict[tuple, str] = {}
+        self.reads = metrics.counter(
+            "mongo_reads_total", "Mongo reads by requested read preference and the member that served them",
+            ("collection", "read_preference", "served_by"))
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        self.members[event.server_address] = self.ROLES.get(event.new_description.server_type_name, "other")
+
+    def closed(self, event):
+        self.members.pop(event.server_address, None)
+
+    def started(self, event):
+        if event.command_name not in self.READ_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else "-"
+        # The driver omits $readPreference for primary reads
+        mode = (event.command.get("$readPreference") or {}).get("mode", "primary")
+        self.reads.inc(collection, mode, self.members.get(event.connection_id, "unknown"))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        by_route: Dict[str, int] = {}
+        with self.reads._lock:
+            series = list(self.reads.values.items())
+        for (collection, mode, served_by), count in series:
+            key = f"{mode}->{served_by}"
+            by_route[key] = by_route.get(key, 0) + count
+        return {
+            "members": {f"{host}:{port}": role for (host, port), role in self.members.items()},
+            "reads": by_route,
+            "by_collection": {"/".join(labels): count for labels, count in sorted(series)},
+        }
+
+read_routing = MongoReadRouting()
+
+MONGO_LISTENERS = []
+if METRICS_ENABLED:
+    MONGO_LISTENERS.extend([mongo_metrics, read_routing])
+if QUERY_PLAN_AUDIT in ('true', 'strict'):
+    MONGO_LISTENERS.append(query_auditor)
+
+# MongoDB connection (created in the lifespan, see connect_mongo)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+# Connections opened up front so the first requests don't pay for the handshakes
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get('MONGO_WARMUP_CONNECTIONS', str(max(1, MONGO_MIN_POOL_SIZE))))
+MONGO_READY_TIMEOUT = float(os.environ.get('MONGO_READY_TIMEOUT', '2'))
+# Catalog and analytics reads use this read preference (see secondary_db); everything else reads the primary
+MONGO_SECONDARY_READ_PREFERENCE = os.environ.get('MONGO_SECONDARY_READ_PREFERENCE', 'secondaryPreferred')
+# How far behind the primary a member may be to serve them; MongoDB's minimum is 90, -1 means no limit
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90'))
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
 
+# Password hashing pool
+PASSWORD_POOL_KIND = os.environ.get('PASSWORD_POOL_KIND', 'thread')
+PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_MAX_CONCURRENCY = int(os.environ.get('PASSWORD_MAX_CONCURRENCY', str(PASSWORD_POOL_WORKERS)))
+# Password work beyond this many queued requests, or queued longer than the timeout, is shed with a 503
+PASSWORD_MAX_QUEUE = int(os.environ.get('PASSWORD_MAX_QUEUE', str(PASSWORD_MAX_CONCURRENCY * 8)))
+PASSWORD_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_QUEUE_TIMEOUT', '2'))
+
+# Auth rate limiting (token buckets per client IP and per email)
+AUTH_RATE_LIMIT_ENABLED = os.environ.get('AUTH_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+AUTH_IP_RATE_PER_MINUTE = float(os.environ.get('AUTH_IP_RATE_PER_MINUTE', '30'))
+AUTH_IP_BURST = int(os.environ.get('AUTH_IP_BURST', '10'))
+AUTH_EMAIL_RATE_PER_MINUTE = float(os.environ.get('AUTH_EMAIL_RATE_PER_MINUTE', '6'))
+AUTH_EMAIL_BURST = int(os.environ.get('AUTH_EMAIL_BURST', '5'))
+# Proxies in front of the app that append to X-Forwarded-For (the ingress is one). The client
+# address is the hop the outermost of them appended; 0 uses the socket address and ignores the header.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+# User cache
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_BY_TOKEN = os.environ.get('USER_CACHE_BY_TOKEN', 'true').lower() == 'true'
+
+# Email outbox
+EMAIL_OUTBOX_ENABLED = os.environ.get('EMAIL_OUTBOX_ENABLED', 'true').lower() == 'true'
+EMAIL_POLL_INTERVAL = float(os.environ.get('EMAIL_POLL_INTERVAL', '5'))
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '20'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+EMAIL_DIGEST_INTERVAL = float(os.environ.get('EMAIL_DIGEST_INTERVAL', '900'))
+EMAIL_LEASE_SECONDS = float(os.environ.get('EMAIL_LEASE_SECONDS', '120'))
+# Sent and failed messages are kept this long, then removed by a TTL index
+EMAIL_RETENTION_DAYS = float(os.environ.get('EMAIL_RETENTION_DAYS', '14'))
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', '2'))
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', '60'))
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+# Send credentials without STARTTLS; only for the local stand-in (smtp_standin.py)
+SMTP_ALLOW_PLAINTEXT = os.environ.get('SMTP_ALLOW_PLAINTEXT', 'false').lower() == 'true'
+ADMIN_SETTINGS_CACHE_TTL = float(os.environ.get('ADMIN_SETTINGS_CACHE_TTL', '3600'))
+
+# Cross-worker cache invalidation
+CACHE_BUS_ENABLED = os.environ.get('CACHE_BUS_ENABLED', 'true').lower() == 'true'
+CACHE_BUS_POLL_INTERVAL = float(os.environ.get('CACHE_BUS_POLL_INTERVAL', '1'))
+CACHE_BUS_HISTORY = int(os.environ.get('CACHE_BUS_HISTORY', '200'))
+
+# Subscription scheduler
+SUBSCRIPTION_SCHEDULER_ENABLED = os.environ.get('SUBSCRIPTION_SCHEDULER_ENABLED', 'true').lower() == 'true'
+SUBSCRIPTION_SCHEDULER_INTERVAL = float(os.environ.get('SUBSCRIPTION_SCHEDULER_INTERVAL', '60'))
+SUBSCRIPTION_BATCH_SIZE = int(os.environ.get('SUBSCRIPTION_BATCH_SIZE', '500'))
+SUBSCRIPTION_LEASE_SECONDS = float(os.environ.get('SUBSCRIPTION_LEASE_SECONDS', '300'))
+
+# Order history: pages and the archive of old fulfilled orders
+ORDER_PAGE_SIZE = int(os.environ.get('ORDER_PAGE_SIZE', '20'))
+ORDER_PAGE_MAX = int(os.environ.get('ORDER_PAGE_MAX', '100'))
+ORDER_ARCHIVE_ENABLED = os.environ.get('ORDER_ARCHIVE_ENABLED', 'true').lower() == 'true'
+ORDER_ARCHIVE_AFTER_DAYS = float(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '180'))
+ORDER_ARCHIVE_INTERVAL = float(os.environ.get('ORDER_ARCHIVE_INTERVAL', '3600'))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.environ.get('ORDER_ARCHIVE_BATCH_SIZE', '500'))
+
+# Stock reservations: held at order creation until paid, failed or expired
+STOCK_RESERVATION_TTL = float(os.environ.get('STOCK_RESERVATION_TTL', '1800'))
+STOCK_SWEEPER_ENABLED = os.environ.get('STOCK_SWEEPER_ENABLED', 'true').lower() == 'true'
+STOCK_SWEEP_INTERVAL = float(os.environ.get('STOCK_SWEEP_INTERVAL', '30'))
+STOCK_SWEEP_BATCH_SIZE = int(os.environ.get('STOCK_SWEEP_BATCH_SIZE', '200'))
+# How stale product search may be about which products have sold out
+SEARCH_STOCK_TTL = float(os.environ.get('SEARCH_STOCK_TTL', '1'))
+
+# Carts: guests are identified by a cookie until they sign in
+CART_COOKIE_NAME = os.environ.get('CART_COOKIE_NAME', 'cart_id')
+CART_GUEST_TTL_DAYS = float(os.environ.get('CART_GUEST_TTL_DAYS', '30'))
+CART_MERGE_LEASE_SECONDS = 30
+CART_COOKIE_SECURE = os.environ.get('CART_COOKIE_SECURE', 'false').lower() == 'true'
+CART_COOKIE_SAMESITE = os.environ.get('CART_COOKIE_SAMESITE', 'lax')
+
+# Serialize responses straight to bytes and skip re-validating trusted DB reads
+FAST_SERIALIZATION = os.environ.get('FAST_SERIALIZATION', 'false').lower() == 'true'
+
 # Stripe
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', 'sk_test_emergent')
+# Point the Stripe client at a local stand-in (see stripe_standin.py) for offline load tests
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+PAYMENT_STATUS_CACHE_TTL = float(os.environ.get('PAYMENT_STATUS_CACHE_TTL', '5'))
+PAYMENT_STATUS_STALE_SECONDS = float(os.environ.get('PAYMENT_STATUS_STALE_SECONDS', '10'))
+STRIPE_MAX_CONCURRENT_CALLS = int(os.environ.get('STRIPE_MAX_CONCURRENT_CALLS', '4'))
+STRIPE_CALL_WAIT_SECONDS = float(os.environ.get('STRIPE_CALL_WAIT_SECONDS', '0.5'))
+PAYMENT_USE_TRANSACTIONS = os.environ.get('PAYMENT_USE_TRANSACTIONS', 'false').lower() == 'true'
+
+# Product image derivatives (resized variants of each product's image_url)
+IMAGE_CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_MB', '512')) * 1024 * 1024
+# Relative image_url values are read from here instead of fetched
+IMAGE_SOURCE_DIR = Path(os.environ.get('IMAGE_SOURCE_DIR', str(ROOT_DIR / 'static')))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get('IMAGE_FETCH_TIMEOUT', '10'))
+IMAGE_MAX_SOURCE_BYTES = int(os.environ.get('IMAGE_MAX_SOURCE_MB', '20')) * 1024 * 1024
+# Requested widths are rounded up to one of these so the cache stays small
+IMAGE_WIDTHS = tuple(sorted(int(w) for w in os.environ.get('IMAGE_WIDTHS', '160,320,480,640,960,1280,1920').split(',')))
+IMAGE_MAX_CONCURRENT_RESIZES = int(os.environ.get('IMAGE_MAX_CONCURRENT_RESIZES', str(os.cpu_count() or 2)))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def connect_mongo():
+    """Create the shared client on first use. Scripts call this; the app does it in the lifespan."""
+    global client, db
+    if client is None:
+        client = AsyncIOMotorClient(
+            mongo_url,
+            tz_aware=True,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            appname="rtw-roastery",
+            event_listeners=MONGO_LISTENERS,
+        )
+        db = client[os.environ['DB_NAME']]
+    return db
+
+def close_mongo():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+_secondary_handle: tuple = (None, None)
+
+def secondary_db():
+    """``db`` reading with MONGO_SECONDARY_READ_PREFERENCE, for catalog and analytics reads.
+
+    Only for reads that tolerate MONGO_MAX_STALENESS_SECONDS of replication
+    lag. Auth, carts, orders and anything read back right after a write go
+    through ``db``, which reads the primary.
+    """
+    global _secondary_handle
+    primary_db, handle = _secondary_handle
+    if primary_db is not db:
+        mode = read_pref_mode_from_name(MONGO_SECONDARY_READ_PREFERENCE)
+        if mode == 0:
+            # "primary" turns routing off
+            handle = db
+        else:
+            max_staleness = MONGO_MAX_STALENESS_SECONDS if MONGO_MAX_STALENESS_SECONDS < 0 else max(90, MONGO_MAX_STALENESS_SECONDS)
+            handle = db.with_options(read_preference=make_read_preference(mode, None, max_staleness))
+        _secondary_handle = (db, handle)
+    return handle
+
+startup_state = {"started_at": time.time(), "ready_at": None, "warmup_ms": None}
+
+async def warm_up_mongo():
+    """Select a server and open MONGO_WARMUP_CONNECTIONS pooled connections."""
+    started = time.perf_counter()
+    # Concurrent pings each need their own connection, so the pool grows to match
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(MONGO_WARMUP_CONNECTIONS)))
+    startup_state["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect_mongo()
+    # Fails start-up on a bad MONGO_SECONDARY_READ_PREFERENCE rather than the first catalog read
+    secondary_db()
+    try:
+        await warm_up_mongo()
+    except Exception as e:
+        # Keep starting; /api/health/ready reports unready until Mongo answers
+        logger.error(f"Mongo warmup failed: {str(e)}")
+    await ensure_indexes()
+    await cache_bus.start()
+    if EMAIL_OUTBOX_ENABLED:
+        email_outbox.start()
+    if SUBSCRIPTION_SCHEDULER_ENABLED:
+        subscription_scheduler.start()
+    if ORDER_ARCHIVE_ENABLED:
+        order_archiver.start()
+    if STOCK_SWEEPER_ENABLED:
+        stock_ledger.start()
+    startup_state["ready_at"] = time.time()
+    yield
+    await stock_ledger.stop()
+    await order_archiver.stop()
+    await subscription_scheduler.stop()
+    await email_outbox.stop()
+    await cache_bus.stop()
+    if QUERY_PLAN_AUDIT in ('true', 'strict'):
+        violations = await query_auditor.audit(client)
+        for violation in violations:
+            logger.error(f"Query plan audit: {violation}")
+        if violations and QUERY_PLAN_AUDIT == 'strict':
+            raise RuntimeError(f"{len(violations)} queries ran without an index")
+    password_pool.shutdown()
+    close_mongo()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # ============ MODELS ============
@@ -70,6 +572,8 @@ class Product(BaseModel):
     image_url: str
     available: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Set by every admin write; None on products not saved since it was added
+    updated_at: Optional[datetime] = None
 
 class ProductCreate(BaseModel):
     name: str
@@ -79,6 +583,9 @@ class ProductCreate(BaseModel):
     image_url: str
     available: bool = True
 
+class ProductImportRow(ProductCreate):
+    id: Optional[str] = None
+
 class CustomBlend(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -93,47 +600,77 @@ class CustomBlend(BaseModel):
     price: float
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+def check_blend_components(components: Dict[str, int]) -> Dict[str, int]:
+    if components and not any(components.values()):
+        raise ValueError("A blend needs at least one component with a non-zero share")
+    return components
+
 class CustomBlendCreate(BaseModel):
     name: str
     brewing_method: str
     origin: str
     roast_level: str
     grind_size: str
-    blend_components: Dict[str, int]
-    quantity: int
+    blend_components: Dict[str, conint(ge=0)]
+    quantity: int = Field(ge=1)
+
+    _check_components = field_validator("blend_components")(check_blend_components)
 
 class CartItem(BaseModel):
+    """One cart line; ``id`` is its key in the cart document (``product:<id>`` or ``blend:<id>``)."""
     model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
+    id: str
     product_id: Optional[str] = None
     custom_blend_id: Optional[str] = None
     quantity: int = 1
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class Cart(BaseModel):
+    items: List[CartItem]
+    item_count: int
+
 class CartItemCreate(BaseModel):
     product_id: Optional[str] = None
     custom_blend_id: Optional[str] = None
-    quantity: int = 1
+    quantity: int = Field(1, ge=1)
+
+class CartItemUpdate(BaseModel):
+    quantity: int = Field(ge=0)
+
+class OrderLine(BaseModel):
+    """One priced line as stored on an order; name and price are frozen at checkout."""
+    model_config = ConfigDict(extra="ignore")
+    product_id: Optional[str] = None
+    custom_blend_id: Optional[str] = None
+    name: str
+    quantity: int
+    price: float
+    line_total: float
 
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
-    items: List[Dict]
+    items: List[OrderLine]
+    subtotal: Optional[float] = None
+    shipping_cost: float = 0.0
     total_amount: float
     status: str = "pending"
     payment_status: str = "pending"
     payment_method: Optional[str] = None
     shipping_address: Dict
     session_id: Optional[str] = None
+    subscription_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class OrderCreate(BaseModel):
-    items: List[Dict]
-    total_amount: float
+    # Only ids and quantities are read; anything else the client sends is dropped
+    items: List[CartItemCreate]
+    # Client-computed totals are ignored; orders are re-priced server-side
+    total_amount: Optional[float] = None
     shipping_address: Dict
+    shipping_rate_id: Optional[str] = None
     guest_email: Optional[str] = None
 
 class Subscription(BaseModel):
@@ -142,6 +679,8 @@ class Subscription(BaseModel):
     user_id: str
     custom_blend_id: str
     frequency: str
+    # None until set; the scheduler then ships to the user's most recent order address
+    shipping_address: Optional[Dict] = None
     status: str = "active"
     next_delivery: datetime
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -149,6 +688,7 @@ class Subscription(BaseModel):
 class SubscriptionCreate(BaseModel):
     custom_blend_id: str
     frequency: str
+    shipping_address: Optional[Dict] = None
 
 class PaymentTransaction(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -202,161 +742,3728 @@ class AdminSettingsUpdate(BaseModel):
     smtp_username: Optional[str] = None
     smtp_password: Optional[str] = None
 
+class InventoryUpdate(BaseModel):
+    # Available (unreserved) units; None stops tracking stock for the product
+    stock: Optional[int] = Field(None, ge=0)
+    shards: int = Field(1, ge=1, le=64)
+
 class CheckoutRequest(BaseModel):
     order_id: str
     origin_url: str
     payment_method: str = "stripe"
 
-# ============ HELPERS ============
+class CheckoutStatus(BaseModel):
+    session_id: str
+    status: str
+    payment_status: str
+    amount_total: Optional[float] = None
+    currency: Optional[str] = None
+    source: str
 
-async def send_email_notification(subject: str, body: str):
-    try:
-        settings_data = await db.admin_settings.find_one({"id": "admin_settings"}, {"_id": 0})
-        if not settings_data or not settings_data.get('notification_email'):
+class CartLine(BaseModel):
+    id: Optional[str] = None
+    product_id: Optional[str] = None
+    custom_blend_id: Optional[str] = None
+    quantity: int
+    type: str
+    name: str
+    price: float
+    line_total: float
+    available: bool = True
+
+class CartSummary(BaseModel):
+    items: List[CartLine]
+    item_count: int
+    subtotal: float
+    shipping_rates: List[ShippingRate]
+
+class BlendQuoteInput(BaseModel):
+    origin: str
+    roast_level: str
+    grind_size: str
+    blend_components: Dict[str, conint(ge=0)]
+    quantity: int = Field(1, ge=1)
+
+    _check_components = field_validator("blend_components")(check_blend_components)
+
+class QuoteRequest(BaseModel):
+    blends: List[BlendQuoteInput] = []
+    carts: List[List[CartItemCreate]] = []
+
+class CartQuote(BaseModel):
+    items: List[CartLine]
+    subtotal: float
+
+class QuoteResponse(BaseModel):
+    blends: List[float]
+    carts: List[CartQuote]
+
+class GuestCartItem(CartItemCreate):
+    id: Optional[str] = None
+
+class CartSummaryRequest(BaseModel):
+    items: List[GuestCartItem]
+
+class SearchFacets(BaseModel):
+    origin: Dict[str, int]
+    available: Dict[str, int]
+
+class PriceRange(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class ProductSearchResponse(BaseModel):
+    items: List[Product]
+    total: int
+    limit: int
+    offset: int
+    facets: SearchFacets
+    price_range: PriceRange
+
+# ============ BACKGROUND TASKS ============
+
+class BackgroundLoop:
+    """Runs ``step`` in a task every ``interval`` seconds until stopped.
+
+    A failing step is logged (and passed to ``on_error``) and the loop
+    carries on. ``wake()`` cuts the current wait short; ``delay_first``
+    waits one interval before the first step.
+    """
+
+    def __init__(self, name: str, step, interval: float, delay_first: bool = False, on_error=None):
+        self.name = name
+        self.step = step
+        self.interval = interval
+        self.delay_first = delay_first
+        self.on_error = on_error
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _wait(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run(self):
+        if self.delay_first:
+            await self._wait()
+        while True:
+            try:
+                await self.step()
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                logger.error(f"{self.name} failed: {str(e)}")
+            await self._wait()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# ============ CACHING ============
+
+class TTLCache:
+    """Bounded in-process cache with per-entry TTL and LRU eviction."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Any) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
             return
-        
-        smtp_host = settings_data.get('smtp_host', 'smtp.gmail.com')
-        smtp_port = settings_data.get('smtp_port', 587)
-        smtp_user = settings_data.get('smtp_username')
-        smtp_pass = settings_data.get('smtp_password')
-        
-        if not smtp_user or not smtp_pass:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Any):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+class CacheInvalidationBus:
+    """Tells every worker process which cached entries a write made stale.
+
+    Each namespace ("users", "products", ...) has a document in
+    ``cache_versions``. ``publish`` drops the entry locally, then bumps the
+    version and appends the key to a bounded ``recent`` list in one atomic
+    update. Every worker polls the versions every ``CACHE_BUS_POLL_INTERVAL``
+    seconds and replays the keys it has not seen yet; a worker that fell
+    further behind than the history flushes the whole namespace instead.
+    Polling works on a standalone mongod, where change streams are not
+    available. Subscribers get the key, or ``None`` for "drop everything".
+    """
+
+    def __init__(self, history: int, poll_interval: float = CACHE_BUS_POLL_INTERVAL):
+        self.history = history
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, list] = {}
+        self.versions: Dict[str, int] = {}
+        self._loop = BackgroundLoop("Cache invalidation poll", self.poll_once, poll_interval,
+                                    delay_first=True, on_error=self._count_error)
+        self.published = 0
+        self.applied = 0
+        self.flushes = 0
+        self.polls = 0
+        self.errors = 0
+        self.lag = metrics.histogram(
+            "cache_invalidation_lag_seconds", "Time from a write in another worker to the invalidation here", ("namespace",))
+
+    @property
+    def collection(self):
+        return db.cache_versions
+
+    def subscribe(self, namespace: str, handler):
+        self.handlers.setdefault(namespace, []).append(handler)
+
+    def _apply(self, namespace: str, key: Optional[str]):
+        for handler in self.handlers.get(namespace, []):
+            handler(key)
+
+    async def publish(self, namespace: str, key: Optional[str] = None):
+        self._apply(namespace, key)
+        self.published += 1
+        if not CACHE_BUS_ENABLED:
+            return
+        entry = {"key": key, "origin": self.worker_id, "at": datetime.now(timezone.utc)}
+        try:
+            await self.collection.update_one(
+                {"_id": namespace},
+                {"$inc": {"version": 1}, "$push": {"recent": {"$each": [entry], "$slice": -self.history}}},
+                upsert=True,
+            )
+        except Exception as e:
+            # Other workers catch up when their cache TTLs expire
+            self.errors += 1
+            logger.error(f"Failed to publish cache invalidation for {namespace}: {str(e)}")
+
+    async def poll_once(self):
+        self.polls += 1
+        versions = {doc['_id']: doc['version'] async for doc in self.collection.find({}, {"version": 1})}
+        behind = {namespace: self.versions.get(namespace, 0) for namespace, version in versions.items()
+                  if version > self.versions.get(namespace, 0)}
+        if not behind:
             return
         
-        msg = MIMEMultipart()
-        msg['From'] = smtp_user
-        msg['To'] = settings_data['notification_email']
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'html'))
-        
-        server = smtplib.SMTP(smtp_host, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_pass)
-        server.send_message(msg)
-        server.quit()
-        
-        logger.info(f"Email sent to {settings_data['notification_email']}")
-    except Exception as e:
-        logger.error(f"Failed to send email: {str(e)}")
+        now = datetime.now(timezone.utc)
+        async for doc in self.collection.find({"_id": {"$in": list(behind)}}):
+            namespace, version, recent = doc['_id'], doc['version'], doc.get('recent', [])
+            missed = version - behind[namespace]
+            if missed > len(recent):
+                self._apply(namespace, None)
+                self.flushes += 1
+            else:
+                for entry in recent[len(recent) - missed:]:
+                    if entry.get('origin') == self.worker_id:
+                        continue
+                    self._apply(namespace, entry.get('key'))
+                    self.applied += 1
+                    self.lag.observe(namespace, value=max(0.0, (now - parse_datetime(entry['at'])).total_seconds()))
+            self.versions[namespace] = version
 
-# ============ AUTH HELPERS ============
+    async def start(self):
+        if not CACHE_BUS_ENABLED or self._loop.running:
+            return
+        # Anything published before this worker started is already reflected in its empty caches
+        self.versions = {doc['_id']: doc['version'] async for doc in self.collection.find({}, {"version": 1})}
+        self._loop.start()
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    def _count_error(self, error: Exception):
+        self.errors += 1
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    async def stop(self):
+        await self._loop.stop()
 
-def create_access_token(data: dict) -> str:
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(days=30)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    return encoded_jwt
+    def stats(self) -> dict:
+        return {
+            "enabled": CACHE_BUS_ENABLED,
+            "worker_id": self.worker_id,
+            "poll_interval": self.poll_interval,
+            "versions": dict(self.versions),
+            "published": self.published,
+            "applied": self.applied,
+            "flushes": self.flushes,
+            "polls": self.polls,
+            "errors": self.errors,
+        }
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+cache_bus = CacheInvalidationBus(CACHE_BUS_HISTORY)
+
+# user id -> User, and verified token -> (user id, token exp)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+token_cache = TTLCache(USER_CACHE_SIZE if USER_CACHE_BY_TOKEN else 0, USER_CACHE_TTL)
+cache_bus.subscribe("users", lambda user_id: user_cache.clear() if user_id is None else user_cache.pop(user_id))
+
+async def invalidate_user(user_id: str):
+    """Drop a cached user in every worker; call whenever a user document is written."""
+    await cache_bus.publish("users", user_id)
+
+# ============ HELPERS ============
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default)
+    return json.dumps(data, default=json_default, separators=(",", ":")).encode()
+
+_list_adapters: Dict[type, TypeAdapter] = {}
+
+def list_adapter(model) -> TypeAdapter:
+    adapter = _list_adapters.get(model)
+    if adapter is None:
+        adapter = _list_adapters[model] = TypeAdapter(List[model])
+    return adapter
+
+def fast_response(value):
+    """Encode a route result to JSON bytes directly when FAST_SERIALIZATION is on.
+
+    Returning a ``Response`` makes FastAPI skip the ``response_model``
+    validation pass; models are dumped with their compiled pydantic-core
+    serializer and plain dicts/lists go through ``dumps_json``.
+    """
+    if not FAST_SERIALIZATION:
+        return value
+    if isinstance(value, BaseModel):
+        body = value.__pydantic_serializer__.to_json(value)
+    elif isinstance(value, list) and value and isinstance(value[0], BaseModel):
+        body = list_adapter(type(value[0])).dump_json(value)
+    else:
+        body = dumps_json(value)
+    return Response(content=body, media_type="application/json")
+
+def encode_cursor(created_at, item_id: str) -> str:
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, item_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user_data = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user_data is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if isinstance(user_data.get('created_at'), str):
-            user_data['created_at'] = datetime.fromisoformat(user_data['created_at'])
-        
-        return User(**user_data)
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        return parse_datetime(created_at), item_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    return current_user
+def keyset_filter(cursor: Optional[str], descending: bool = False) -> dict:
+    """Filter for documents strictly after the cursor in (created_at, id) order (or its reverse)."""
+    if not cursor:
+        return {}
+    created_at, item_id = decode_cursor(cursor)
+    after = "$lt" if descending else "$gt"
+    return {"$or": [
+        {"created_at": {after: created_at}},
+        {"created_at": created_at, "id": {after: item_id}},
+    ]}
 
-# ============ AUTH ROUTES ============
+def model_projection(model, fields: Optional[str], required=("id", "created_at")) -> dict:
+    """Build a Mongo projection limited to the model's fields (or a requested subset)."""
+    known = list(model.model_fields)
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in known]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        known = list(dict.fromkeys([*required, *requested]))
+    projection = {"_id": 0}
+    projection.update({f: 1 for f in known})
+    return projection
 
-@api_router.post("/auth/register", response_model=TokenResponse)
-async def register(user_input: UserCreate):
-    existing_user = await db.users.find_one({"email": user_input.email}, {"_id": 0})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    user = User(email=user_input.email, name=user_input.name)
-    user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    user_dict['password_hash'] = hash_password(user_input.password)
-    
-    await db.users.insert_one(user_dict)
-    
-    token = create_access_token({"sub": user.id})
-    return TokenResponse(token=token, user=user)
+# ============ REPOSITORIES ============
 
-@api_router.post("/auth/login", response_model=TokenResponse)
-async def login(user_input: UserLogin):
-    user_data = await db.users.find_one({"email": user_input.email}, {"_id": 0})
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    if not verify_password(user_input.password, user_data.get('password_hash', '')):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    if isinstance(user_data.get('created_at'), str):
-        user_data['created_at'] = datetime.fromisoformat(user_data['created_at'])
-    
-    user_data.pop('password_hash', None)
-    user = User(**user_data)
-    
-    token = create_access_token({"sub": user.id})
-    return TokenResponse(token=token, user=user)
+def parse_datetime(value):
+    """Accept native BSON dates and legacy ISO strings alike."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
 
-@api_router.get("/auth/me", response_model=User)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+def construction_plan(model) -> Optional[Dict[str, tuple]]:
+    """Fields of ``model`` holding models, as name -> (model, is_list, plan).
 
-# ============ PRODUCT ROUTES ============
+    None when some field nests models in a shape ``construct_model`` does
+    not build (Optional, Dict, ...); such models are always validated.
+    """
+    plan = {}
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        args = get_args(annotation)
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            nested, is_list = annotation, False
+        elif get_origin(annotation) is list and args and isinstance(args[0], type) and issubclass(args[0], BaseModel):
+            nested, is_list = args[0], True
+        elif any(isinstance(arg, type) and issubclass(arg, BaseModel) for arg in args):
+            return None
+        else:
+            continue
+        nested_plan = construction_plan(nested)
+        if nested_plan is None:
+            return None
+        plan[name] = (nested, is_list, nested_plan)
+    return plan
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products():
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
-    return products
+def construct_model(model, plan: Dict[str, tuple], data: dict):
+    """``model_construct`` that also builds the nested models named in ``plan``."""
+    for name, (nested, is_list, nested_plan) in plan.items():
+        value = data.get(name)
+        if is_list and isinstance(value, list):
+            data[name] = [construct_model(nested, nested_plan, item) if isinstance(item, dict) else item for item in value]
+        elif isinstance(value, dict):
+            data[name] = construct_model(nested, nested_plan, value)
+    return model.model_construct(**data)
 
-@api_router.post("/products", response_model=Product)
-async def create_product(product_input: ProductCreate, admin_user: User = Depends(get_admin_user)):
-    product = Product(**product_input.model_dump())
-    product_dict = product.model_dump()
-    product_dict['created_at'] = product_dict['created_at'].isoformat()
-    await db.products.insert_one(product_dict)
-    return product
+class Repository:
+    """Thin codec + query layer over one collection.
 
-@api_router.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: str, product_input: ProductCreate, admin_user: User = Depends(get_admin_user)):
-    existing = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    update_data = product_input.model_dump()
-    await db.products.update_one({"id": product_id}, {"$set": update_data})
-    
-    updated = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
-    return Product(**updated)
+    Documents are stored with native BSON dates. Reads still accept legacy
+    ISO-string timestamps until ``migrate_datetimes.py`` has been run.
+    """
 
-@api_router.delete("/products/{product_id}")
-async def delete_product(product_id: str, admin_user: User = Depends(get_admin_user)):
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return {"message": "Product deleted"}
+    def __init__(self, collection_name: str, model):
+        self.collection_name = collection_name
+        self.model = model
+        self.datetime_fields = tuple(
+            name for name, field in model.model_fields.items()
+            if field.annotation in (datetime, Optional[datetime])
+        )
+        self.projection = model_projection(model, None)
+        self.construction_plan = construction_plan(model)
+
+    @property
+    def collection(self):
+        return db[self.collection_name]
+
+    def encode(self, item: BaseModel, **extra) -> dict:
+        doc = item.model_dump()
+        doc.update(extra)
+        return doc
+
+    def decode(self, doc: dict) -> dict:
+        for field in self.datetime_fields:
+            if field in doc:
+                doc[field] = parse_datetime(doc[field])
+        return doc
+
+    def to_model(self, doc: dict):
+        if FAST_SERIALIZATION and self.construction_plan is not None:
+            # Documents we wrote ourselves were validated on the way in
+            return construct_model(self.model, self.construction_plan, self.decode(doc))
+        return self.model(**self.decode(doc))
+
+    async def insert(self, item: BaseModel, **extra):
+        await self.collection.insert_one(self.encode(item, **extra))
+        return item
+
+    async def get(self, query: dict):
+        doc = await self.collection.find_one(query, self.projection)
+        return self.to_model(doc) if doc is not None else None
+
+    async def find(self, query: dict, sort=None, limit: int = 0) -> list:
+        cursor = self.collection.find(query, self.projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return [self.to_model(doc) async for doc in cursor]
+
+    async def update(self, query: dict, changes: dict):
+        """Apply ``$set`` and return the updated model in one round trip."""
+        doc = await self.collection.find_one_and_update(
+            query,
+            {"$set": changes},
+            projection=self.projection,
+            return_document=ReturnDocument.AFTER,
+        )
+        return self.to_model(doc) if doc is not None else None
+
+    async def delete(self, query: dict) -> bool:
+        result = await self.collection.delete_one(query)
+        return result.deleted_count > 0
+
+ORDER_LINE_FIELDS = set(OrderLine.model_fields)
+
+def compact_order_line(item: dict) -> dict:
+    """Reduce a stored order line to the OrderLine fields.
+
+    Older orders kept whatever the client posted: whole cart items, with the
+    product or blend copied into ``details``. Unset ids are left out.
+    """
+    details = item.get('details') or {}
+    quantity = int(item.get('quantity', 1))
+    price = float(item.get('price', details.get('price', 0)))
+    line = {
+        "product_id": item.get('product_id'),
+        "custom_blend_id": item.get('custom_blend_id'),
+        "name": item.get('name') or details.get('name') or "Unknown Item",
+        "quantity": quantity,
+        "price": price,
+        "line_total": round(float(item.get('line_total', price * quantity)), 2),
+    }
+    return {key: value for key, value in line.items() if value is not None}
+
+class OrderRepository(Repository):
+    """Orders store compact lines; legacy lines are compacted on read until ``compact_orders.py`` has run."""
+
+    def encode(self, item: BaseModel, **extra) -> dict:
+        doc = super().encode(item, **extra)
+        doc['items'] = [{key: value for key, value in line.items() if value is not None} for line in doc['items']]
+        return doc
+
+    def decode(self, doc: dict) -> dict:
+        if 'items' in doc:
+            doc['items'] = [
+                line if line.keys() <= ORDER_LINE_FIELDS and 'name' in line else compact_order_line(line)
+                for line in doc['items']
+            ]
+        return super().decode(doc)
+
+users_repo = Repository("users", User)
+products_repo = Repository("products", Product)
+custom_blends_repo = Repository("custom_blends", CustomBlend)
+orders_repo = OrderRepository("orders", Order)
+payment_transactions_repo = Repository("payment_transactions", PaymentTransaction)
+subscriptions_repo = Repository("subscriptions", Subscription)
+
+REPOSITORIES = [
+    users_repo,
+    products_repo,
+    custom_blends_repo,
+    orders_repo,
+    payment_transactions_repo,
+    subscriptions_repo,
+]
+
+# ============ INDEXES ============
+
+# Order lists page newest-first on (created_at, id), per user, per status or overall
+ORDER_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_created_at_id"),
+    IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+    IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+]
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+    ],
+    "custom_blends": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+    ],
+    "carts": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Only guest carts carry expires_at
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="guest_expiry"),
+    ],
+    "orders": ORDER_INDEXES,
+    "orders_archive": ORDER_INDEXES,
+    "subscriptions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("status", ASCENDING), ("next_delivery", ASCENDING)], name="status_next_delivery"),
+        IndexModel([("lease_token", ASCENDING)], name="lease_token", sparse=True),
+    ],
+    "payment_transactions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        IndexModel([("order_id", ASCENDING)], name="order_id"),
+    ],
+    "inventory": [
+        IndexModel([("product_id", ASCENDING), ("shard", ASCENDING)], unique=True, name="product_shard"),
+    ],
+    "stock_reservations": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("order_id", ASCENDING)], unique=True, name="order_id_unique"),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        IndexModel([("lines.product_id", ASCENDING)], name="lines_product_id"),
+    ],
+    "shipping_rates": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "admin_settings": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "sales_rollups": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("kind", ASCENDING), ("bucket", ASCENDING)], name="kind_bucket"),
+        # Top products and blends for the dashboard
+        IndexModel([("kind", ASCENDING), ("units", DESCENDING)], name="kind_units"),
+        IndexModel([("kind", ASCENDING), ("revenue", DESCENDING)], name="kind_revenue"),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("status", ASCENDING), ("digest", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_digest_next_attempt"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease"),
+        # Sent and failed messages get purge_at; pending ones never expire
+        IndexModel([("purge_at", ASCENDING)], expireAfterSeconds=0, name="purge_expiry"),
+    ],
+}
+
+# Superseded by the indexes above; dropped so they stop costing writes
+OBSOLETE_INDEXES = {
+    "orders": ["user_created_at", "created_at"],
+}
+
+async def ensure_indexes():
+    """Create every index the app's queries rely on. Safe to run on each startup."""
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        existing = {index['name'] async for index in db[collection_name].list_indexes()}
+        for name in existing & set(names):
+            await db[collection_name].drop_index(name)
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate emails left over from before the unique index existed
+            logger.error(f"Could not create indexes on {collection_name}: {str(e)}")
+
+# ============ ADMIN SETTINGS ============
+
+admin_settings_cache = TTLCache(1, ADMIN_SETTINGS_CACHE_TTL)
+
+async def get_admin_settings() -> dict:
+    """Admin settings, cached until they are updated through the settings route."""
+    settings_data = admin_settings_cache.get("admin_settings")
+    if settings_data is None:
+        settings_data = await db.admin_settings.find_one({"id": "admin_settings"}, {"_id": 0}) or {}
+        admin_settings_cache.set("admin_settings", settings_data)
+    return settings_data
+
+cache_bus.subscribe("admin_settings", lambda _: admin_settings_cache.clear())
+
+async def invalidate_admin_settings():
+    await cache_bus.publish("admin_settings")
+
+# ============ EMAIL OUTBOX ============
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP connections open between sends.
+
+    Connections are used from worker threads, so the idle list is guarded by
+    a lock. A connection is only handed out again after a successful NOOP.
+    """
+
+    def __init__(self, size: int, idle_timeout: float):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle: List[tuple] = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    @staticmethod
+    def key(settings_data: dict) -> tuple:
+        return (
+            settings_data.get('smtp_host') or 'smtp.gmail.com',
+            settings_data.get('smtp_port') or 587,
+            settings_data.get('smtp_username'),
+            hashlib.sha1((settings_data.get('smtp_password') or '').encode()).hexdigest(),
+        )
+
+    def _connect(self, settings_data: dict) -> "smtplib.SMTP":
+        import smtplib  # only workers that actually send mail pay for the import
+        host, port, _, _ = self.key(settings_data)
+        server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+        server.ehlo()
+        if server.has_extn('starttls'):
+            server.starttls()
+            server.ehlo()
+        elif not SMTP_ALLOW_PLAINTEXT:
+            # Never log in in the clear: a missing STARTTLS may have been stripped on the way
+            server.close()
+            raise smtplib.SMTPNotSupportedError(f"{host}:{port} does not offer STARTTLS; refusing to send credentials")
+        server.login(settings_data['smtp_username'], settings_data['smtp_password'])
+        self.opened += 1
+        return server
+
+    @staticmethod
+    def _close(server: "smtplib.SMTP"):
+        try:
+            server.quit()
+        except OSError:  # smtplib.SMTPException is an OSError
+            server.close()
+
+    def acquire(self, settings_data: dict) -> "smtplib.SMTP":
+        key = self.key(settings_data)
+        while True:
+            with self._lock:
+                candidate = None
+                for index, (idle_key, server, last_used) in enumerate(self._idle):
+                    if idle_key == key:
+                        candidate = self._idle.pop(index)
+                        break
+            if candidate is None:
+                return self._connect(settings_data)
+            _, server, last_used = candidate
+            if time.monotonic() - last_used < self.idle_timeout:
+                try:
+                    if server.noop()[0] == 250:
+                        self.reused += 1
+                        return server
+                except OSError:
+                    pass
+            self._close(server)
+
+    def release(self, settings_data: dict, server: "smtplib.SMTP"):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((self.key(settings_data), server, time.monotonic()))
+                return
+        self._close(server)
+
+    def discard(self, server: "smtplib.SMTP"):
+        self._close(server)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, server, _ in idle:
+            self._close(server)
+
+    def stats(self) -> dict:
+        return {"idle": len(self._idle), "opened": self.opened, "reused": self.reused}
+
+smtp_pool = SMTPConnectionPool(SMTP_POOL_SIZE, SMTP_IDLE_TIMEOUT)
+
+def deliverable(settings_data: dict) -> bool:
+    return bool(
+        settings_data.get('notification_email')
+        and settings_data.get('smtp_username')
+        and settings_data.get('smtp_password')
+    )
+
+class EmailOutbox:
+    """Persistent outbox drained by a background task.
+
+    Messages are claimed with a lease so a crashed sender's work is picked up
+    again, retried with exponential backoff, and digest messages are folded
+    into a single email every ``EMAIL_DIGEST_INTERVAL`` seconds.
+    """
+
+    def __init__(self):
+        self._loop = BackgroundLoop("Email outbox iteration", self._step, EMAIL_POLL_INTERVAL)
+        self._backfilled = False
+        self._last_digest = time.monotonic()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def collection(self):
+        return db.email_outbox
+
+    async def enqueue(self, subject: str, body: str, digest: bool = False):
+        now = datetime.now(timezone.utc)
+        await self.collection.insert_one({
+            "id": str(uuid.uuid4()),
+            "subject": subject,
+            "body": body,
+            "digest": digest,
+            "status": "pending",
+            "attempts": 0,
+            "last_error": None,
+            "next_attempt_at": now,
+            "lease_until": None,
+            "created_at": now,
+        })
+        if not digest:
+            self._loop.wake()
+
+    async def _claim(self, digest: bool) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "digest": digest, "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "digest": digest, "lease_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": "sending", "lease_until": now + timedelta(seconds=EMAIL_LEASE_SECONDS)}},
+            projection={"_id": 0},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    @staticmethod
+    def _deliver(settings_data: dict, subject: str, body: str):
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        
+        msg = MIMEMultipart()
+        msg['From'] = settings_data['smtp_username']
+        msg['To'] = settings_data['notification_email']
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'html'))
+        
+        server = smtp_pool.acquire(settings_data)
+        try:
+            server.send_message(msg)
+        except Exception:
+            smtp_pool.discard(server)
+            raise
+        smtp_pool.release(settings_data, server)
+
+    async def _send(self, settings_data: dict, docs: List[dict], subject: str, body: str):
+        try:
+            await asyncio.to_thread(self._deliver, settings_data, subject, body)
+        except Exception as e:
+            logger.error(f"Failed to send email: {str(e)}")
+            for doc in docs:
+                attempts = doc.get('attempts', 0) + 1
+                if attempts >= EMAIL_MAX_ATTEMPTS:
+                    changes = {"status": "failed", "purge_at": datetime.now(timezone.utc) + timedelta(days=EMAIL_RETENTION_DAYS)}
+                    self.failed += 1
+                else:
+                    delay = EMAIL_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+                    changes = {"status": "pending", "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay)}
+                    self.retried += 1
+                changes.update({"attempts": attempts, "last_error": str(e), "lease_until": None})
+                await self.collection.update_one({"id": doc['id']}, {"$set": changes})
+            return
+        sent_at = datetime.now(timezone.utc)
+        await self.collection.update_many(
+            {"id": {"$in": [doc['id'] for doc in docs]}},
+            {"$set": {"status": "sent", "sent_at": sent_at, "lease_until": None,
+                      "purge_at": sent_at + timedelta(days=EMAIL_RETENTION_DAYS)}},
+        )
+        self.sent += len(docs)
+        logger.info(f"Email sent to {settings_data['notification_email']}")
+
+    async def run_once(self) -> int:
+        settings_data = await get_admin_settings()
+        if not deliverable(settings_data):
+            return 0
+        
+        processed = 0
+        for _ in range(EMAIL_BATCH_SIZE):
+            doc = await self._claim(digest=False)
+            if doc is None:
+                break
+            await self._send(settings_data, [doc], doc['subject'], doc['body'])
+            processed += 1
+        
+        if time.monotonic() - self._last_digest >= EMAIL_DIGEST_INTERVAL:
+            self._last_digest = time.monotonic()
+            docs = []
+            while len(docs) < EMAIL_BATCH_SIZE * 10:
+                doc = await self._claim(digest=True)
+                if doc is None:
+                    break
+                docs.append(doc)
+            if docs:
+                subject = f"RTW Roastery digest: {len(docs)} notification{'s' if len(docs) != 1 else ''}"
+                body = "<hr>".join(f"<h3>{doc['subject']}</h3>{doc['body']}" for doc in docs)
+                await self._send(settings_data, docs, subject, body)
+                processed += len(docs)
+        return processed
+
+    async def expire_finished(self) -> int:
+        """Give sent and failed messages from before the retention TTL a purge date."""
+        result = await self.collection.update_many(
+            {"status": {"$in": ["sent", "failed"]}, "purge_at": {"$exists": False}},
+            {"$set": {"purge_at": datetime.now(timezone.utc) + timedelta(days=EMAIL_RETENTION_DAYS)}},
+        )
+        return result.modified_count
+
+    async def _step(self):
+        if not self._backfilled:
+            self._backfilled = True
+            await self.expire_finished()
+        await self.run_once()
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+        await asyncio.to_thread(smtp_pool.close_all)
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "smtp": smtp_pool.stats()}
+
+email_outbox = EmailOutbox()
+
+async def send_email_notification(subject: str, body: str, digest: bool = False):
+    """Queue an admin notification; delivery happens in the outbox sender."""
+    try:
+        settings_data = await get_admin_settings()
+        if not settings_data.get('notification_email'):
+            return
+        await email_outbox.enqueue(subject, body, digest=digest)
+    except Exception as e:
+        logger.error(f"Failed to queue email: {str(e)}")
+
+# ============ AUTH HELPERS ============
+
+_pwd_context = None
+
+def get_pwd_context():
+    """passlib/bcrypt load on the first password operation, not at import."""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+def hash_password(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+class PasswordPoolBusy(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class PasswordHasherPool:
+    """Runs bcrypt work on a bounded executor so it never blocks the event loop.
+
+    Admission is bounded too: once ``max_queue`` callers are waiting, or a
+    caller has waited ``queue_timeout`` seconds, ``run`` raises
+    ``PasswordPoolBusy`` instead of letting the queue grow without limit.
+    """
+
+    def __init__(self, kind: str, workers: int, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.kind = kind
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.shed = 0
+        self.max_waiting = 0
+        self.total_wait_seconds = 0.0
+        self.total_work_seconds = 0.0
+        self.shed_counter = metrics.counter("password_work_shed_total", "Password hash/verify calls rejected", ("reason",))
+        self.queue_gauge = metrics.gauge("password_pool_waiting", "Password hash/verify calls waiting for a worker")
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue should have drained."""
+        per_call = self.total_work_seconds / self.completed if self.completed else 0.25
+        return max(1, math.ceil(per_call * (self.waiting + self.in_flight) / self.max_concurrency))
+
+    def _reject(self, reason: str):
+        self.shed += 1
+        self.shed_counter.inc(reason)
+        raise PasswordPoolBusy(reason, self.retry_after())
+
+    async def run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.waiting >= self.max_queue:
+            self._reject("queue_full")
+        queued_at = time.monotonic()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        self.queue_gauge.set(value=self.waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+        finally:
+            self.waiting -= 1
+            self.queue_gauge.set(value=self.waiting)
+        started = time.monotonic()
+        self.total_wait_seconds += started - queued_at
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_work_seconds += time.monotonic() - started
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "shed": self.shed,
+            "max_queue": self.max_queue,
+            "max_waiting": self.max_waiting,
+            "avg_wait_seconds": self.total_wait_seconds / self.completed if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_pool = PasswordHasherPool(
+    PASSWORD_POOL_KIND, PASSWORD_POOL_WORKERS, PASSWORD_MAX_CONCURRENCY, PASSWORD_MAX_QUEUE, PASSWORD_QUEUE_TIMEOUT
+)
+
+async def run_password_work(fn, *args):
+    try:
+        return await password_pool.run(fn, *args)
+    except PasswordPoolBusy as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Authentication is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+async def hash_password_async(password: str) -> str:
+    return await run_password_work(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_work(verify_password, plain_password, hashed_password)
+
+class TokenBucketLimiter:
+    """In-memory token buckets, one per key, holding at most ``max_keys`` buckets.
+
+    Each bucket refills at ``rate_per_minute`` up to ``burst`` tokens.
+    ``acquire`` spends a token and returns 0, or returns the seconds until
+    one is available. Buckets are per process, so the effective limit scales
+    with the number of workers.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int, max_keys: int = 100000):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key: str) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = float(self.burst)
+        else:
+            tokens, updated = bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+            self.allowed += 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            # The least recently seen key has refilled the most
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "allowed": self.allowed, "limited": self.limited,
+                "rate_per_minute": self.rate * 60, "burst": self.burst}
+
+auth_ip_limiter = TokenBucketLimiter("ip", AUTH_IP_RATE_PER_MINUTE, AUTH_IP_BURST)
+auth_email_limiter = TokenBucketLimiter("email", AUTH_EMAIL_RATE_PER_MINUTE, AUTH_EMAIL_BURST)
+auth_rate_limited = metrics.counter("auth_rate_limited_total", "Auth requests rejected by the rate limiter", ("route", "scope"))
+
+def client_ip(request: Request) -> str:
+    if TRUSTED_PROXY_HOPS > 0:
+        # Hops left of the ones our proxies appended are whatever the client sent
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def enforce_auth_rate_limit(request: Request, route: str, email: str):
+    """Reject with 429 before any bcrypt work when the client IP or the email is over its budget."""
+    if not AUTH_RATE_LIMIT_ENABLED:
+        return
+    for limiter, key in ((auth_ip_limiter, client_ip(request)), (auth_email_limiter, email.lower())):
+        wait = limiter.acquire(key)
+        if wait:
+            auth_rate_limited.inc(route, limiter.name)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, please retry later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+def create_access_token(data: dict) -> str:
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(days=30)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return encoded_jwt
+
+def decode_token_subject(token: str) -> Optional[str]:
+    cached = token_cache.get(token)
+    if cached is not None:
+        user_id, exp = cached
+        if exp is None or exp > time.time():
+            return user_id
+        token_cache.pop(token)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    
+    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    user_id = payload.get("sub")
+    if user_id is not None:
+        token_cache.set(token, (user_id, payload.get("exp")))
+    return user_id
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    try:
+        token = credentials.credentials
+        user_id = decode_token_subject(token)
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+        
+        user = await users_repo.get({"id": user_id})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        
+        user_cache.set(user_id, user)
+        return user
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except Exception as e:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)) -> Optional[User]:
+    if credentials is None:
+        return None
+    return await get_current_user(credentials)
+
+# ============ AUTH ROUTES ============
+
+@api_router.post("/auth/register", response_model=TokenResponse)
+async def register(user_input: UserCreate, request: Request):
+    enforce_auth_rate_limit(request, "register", user_input.email)
+    user = User(email=user_input.email, name=user_input.name)
+    password_hash = await hash_password_async(user_input.password)
+    
+    # The unique index on users.email rejects duplicates atomically
+    try:
+        await users_repo.insert(user, password_hash=password_hash)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await merge_guest_cart(request, user.id)
+    
+    token = create_access_token({"sub": user.id})
+    return fast_response(TokenResponse(token=token, user=user))
+
+@api_router.post("/auth/login", response_model=TokenResponse)
+async def login(user_input: UserLogin, request: Request):
+    enforce_auth_rate_limit(request, "login", user_input.email)
+    user_data = await db.users.find_one({"email": user_input.email}, {"_id": 0})
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    if not await verify_password_async(user_input.password, user_data.get('password_hash', '')):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    user_data.pop('password_hash', None)
+    user = users_repo.to_model(user_data)
+    user_cache.set(user.id, user)
+    await merge_guest_cart(request, user.id)
+    
+    token = create_access_token({"sub": user.id})
+    return fast_response(TokenResponse(token=token, user=user))
+
+@api_router.get("/auth/me", response_model=User)
+async def get_me(current_user: User = Depends(get_current_user)):
+    return fast_response(current_user)
+
+# ============ CATALOG SNAPSHOT ============
+
+def image_version(product: dict) -> Optional[str]:
+    """Changes whenever the product is saved, so an image replaced at the same URL is fetched again."""
+    updated_at = product.get('updated_at')
+    return parse_datetime(updated_at).isoformat() if updated_at else None
+
+class CatalogSnapshot:
+    """Versioned, pre-serialized and pre-compressed copy of the product list.
+
+    The catalog only changes through the admin product routes, which call
+    ``invalidate()``. The next read rebuilds the snapshot once; every other
+    read is served from memory.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._built_version = -1
+        self._lock = asyncio.Lock()
+        self.etag: Optional[str] = None
+        self.bodies: Dict[str, bytes] = {}
+        self.products: List[dict] = []
+        # product id -> (image_url, image version)
+        self.images: Dict[str, tuple] = {}
+        self.builds = 0
+
+    def invalidate(self):
+        self.version += 1
+
+    async def get(self) -> "CatalogSnapshot":
+        if self._built_version == self.version:
+            return self
+        async with self._lock:
+            if self._built_version != self.version:
+                await self._build()
+        return self
+
+    async def _build(self):
+        version = self.version
+        # Read from the primary: a lagging secondary would cache the pre-write catalog until the next write
+        products = await db.products.find({}, model_projection(Product, None)).sort(
+            [("created_at", 1), ("id", 1)]
+        ).to_list(None)
+        body = dumps_json(products)
+        bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, quality=11)
+        self.bodies = bodies
+        self.products = products
+        self.images = {
+            product['id']: (product['image_url'], image_version(product)) for product in products if product.get('image_url')
+        }
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.builds += 1
+        # A write that landed mid-build leaves the snapshot marked stale
+        self._built_version = version
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or self.etag in [t.strip() for t in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+        
+        accepted = request.headers.get("accept-encoding", "")
+        encoding = "identity"
+        if "br" in accepted and "br" in self.bodies:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.bodies[encoding], media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "built_version": self._built_version,
+            "builds": self.builds,
+            "etag": self.etag,
+            "sizes": {encoding: len(body) for encoding, body in self.bodies.items()},
+        }
+
+catalog_snapshot = CatalogSnapshot()
+cache_bus.subscribe("products", lambda _: catalog_snapshot.invalidate())
+
+# ============ PRODUCT ROUTES ============
+
+PRODUCT_PAGE_MAX = int(os.environ.get('PRODUCT_PAGE_MAX', '500'))
+
+@api_router.get("/products", response_model=List[Product])
+async def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+):
+    """List products in (created_at, id) order.
+
+    Without ``limit`` the whole catalog is returned. With ``limit`` a single
+    page is returned and the cursor for the next page is sent in the
+    ``X-Next-Cursor`` header. ``fields`` restricts the projection (``id`` and
+    ``created_at`` are always included) and ``format=ndjson`` streams one
+    document per line straight from the Mongo cursor.
+    
+    The plain full listing is served from the in-memory catalog snapshot
+    and honours ``If-None-Match``.
+    """
+    if limit is None and cursor is None and fields is None and format is None:
+        return (await catalog_snapshot.get()).response(request)
+    
+    if limit is not None:
+        limit = min(limit, PRODUCT_PAGE_MAX)
+    query = keyset_filter(cursor)
+    projection = model_projection(Product, fields)
+    mongo_cursor = secondary_db().products.find(query, projection).sort([("created_at", 1), ("id", 1)])
+    if limit is not None:
+        # One extra document tells us whether there is a next page
+        mongo_cursor = mongo_cursor.limit(limit + 1)
+    
+    if format == "ndjson":
+        async def stream_products():
+            sent = 0
+            last = None
+            async for product in mongo_cursor:
+                if limit is not None and sent == limit:
+                    yield dumps_json({"next_cursor": encode_cursor(last['created_at'], last['id'])}) + b"\n"
+                    return
+                yield dumps_json(product) + b"\n"
+                sent += 1
+                last = product
+        return StreamingResponse(stream_products(), media_type="application/x-ndjson")
+    
+    products = [product async for product in mongo_cursor]
+    headers = {}
+    if limit is not None and len(products) > limit:
+        products = products[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(products[-1]['created_at'], products[-1]['id'])
+    return Response(content=dumps_json(products), media_type="application/json", headers=headers)
+
+@api_router.post("/products", response_model=Product)
+async def create_product(product_input: ProductCreate, admin_user: User = Depends(get_admin_user)):
+    product = Product(**product_input.model_dump(), updated_at=datetime.now(timezone.utc))
+    await products_repo.insert(product)
+    await cache_bus.publish("products", product.id)
+    return fast_response(product)
+
+@api_router.put("/products/{product_id}", response_model=Product)
+async def update_product(product_id: str, product_input: ProductCreate, admin_user: User = Depends(get_admin_user)):
+    updated = await products_repo.update({"id": product_id}, {**product_input.model_dump(), "updated_at": datetime.now(timezone.utc)})
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    await cache_bus.publish("products", product_id)
+    return fast_response(updated)
+
+@api_router.delete("/products/{product_id}")
+async def delete_product(product_id: str, admin_user: User = Depends(get_admin_user)):
+    deleted = await products_repo.delete({"id": product_id})
+    await db.inventory.delete_many({"product_id": product_id})
+    await cache_bus.publish("products", product_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return {"message": "Product deleted"}
+
+# ============ PRODUCT SEARCH ============
+
+SEARCH_SORTS = ("relevance", "price_asc", "price_desc", "name", "newest")
+SEARCH_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def search_tokens(text: Optional[str]) -> List[str]:
+    folded = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return SEARCH_TOKEN_PATTERN.findall(folded)
+
+class CatalogSearchIndex:
+    """Inverted index and facet columns built from the catalog snapshot.
+
+    Name and description tokens map to numpy arrays of product positions,
+    and origin, price and availability are numpy columns. A query is a few
+    vectorized mask operations plus one sort of the matches, so latency
+    stays flat as the catalog grows. The index is rebuilt (off the event
+    loop) whenever the snapshot is, i.e. after any catalog write.
+
+    A product is available when it is listed (``available``) and, if it is
+    stock-tracked, not sold out. Stock changes with every checkout, so
+    instead of rebuilding the index the sold-out set is re-read from
+    ``StockLedger`` at most every ``SEARCH_STOCK_TTL`` seconds, and at once
+    after this worker sets a product's stock.
+    """
+
+    def __init__(self):
+        self._built_from = -1
+        self._lock = asyncio.Lock()
+        self.products: List[dict] = []
+        self.vocabulary: List[str] = []
+        self.name_postings: Dict[str, np.ndarray] = {}
+        self.description_postings: Dict[str, np.ndarray] = {}
+        self.origins: List[str] = []
+        self.origin_lookup: Dict[str, int] = {}
+        self.origin_codes = np.zeros(0, dtype=np.int32)
+        self.prices = np.zeros(0)
+        self.positions: Dict[str, int] = {}
+        self.listed = np.zeros(0, dtype=bool)
+        self.available = np.zeros(0, dtype=bool)
+        self.name_rank = np.zeros(0, dtype=np.int64)
+        self.builds = 0
+        self.sold_out = 0
+        self._stock_version: Optional[int] = None
+        self._stock_checked_at = 0.0
+
+    async def get(self) -> "CatalogSearchIndex":
+        snapshot = await catalog_snapshot.get()
+        if self._built_from != snapshot.builds:
+            async with self._lock:
+                if self._built_from != snapshot.builds:
+                    builds, products = snapshot.builds, snapshot.products
+                    await asyncio.to_thread(self._build, products)
+                    self._built_from = builds
+                    self._stock_version = None
+        if self._stock_stale():
+            async with self._lock:
+                if self._stock_stale():
+                    await self._refresh_stock()
+        return self
+
+    def _stock_stale(self) -> bool:
+        return (self._stock_version != stock_ledger.version
+                or time.monotonic() - self._stock_checked_at > SEARCH_STOCK_TTL)
+
+    async def _refresh_stock(self):
+        version = stock_ledger.version
+        sold_out = np.zeros(len(self.products), dtype=bool)
+        for product_id in await stock_ledger.sold_out():
+            position = self.positions.get(product_id)
+            if position is not None:
+                sold_out[position] = True
+        self.available = self.listed & ~sold_out
+        self.sold_out = int(np.count_nonzero(sold_out))
+        self._stock_version = version
+        self._stock_checked_at = time.monotonic()
+
+    def _build(self, products: List[dict]):
+        name_postings: Dict[str, list] = {}
+        description_postings: Dict[str, list] = {}
+        for position, product in enumerate(products):
+            for token in set(search_tokens(product.get('name'))):
+                name_postings.setdefault(token, []).append(position)
+            for token in set(search_tokens(product.get('description'))):
+                description_postings.setdefault(token, []).append(position)
+        origins = sorted({product.get('origin') or "" for product in products})
+        origin_lookup = {origin: code for code, origin in enumerate(origins)}
+        
+        self.name_postings = {token: np.array(p, dtype=np.int32) for token, p in name_postings.items()}
+        self.description_postings = {token: np.array(p, dtype=np.int32) for token, p in description_postings.items()}
+        self.vocabulary = sorted(name_postings.keys() | description_postings.keys())
+        self.origins = origins
+        self.origin_lookup = {origin.lower(): code for origin, code in origin_lookup.items()}
+        self.origin_codes = np.array([origin_lookup[product.get('origin') or ""] for product in products], dtype=np.int32)
+        self.prices = np.array([float(product.get('price') or 0) for product in products], dtype=np.float64)
+        self.positions = {product['id']: position for position, product in enumerate(products)}
+        self.listed = np.array([bool(product.get('available', True)) for product in products], dtype=bool)
+        # Until the stock is read, listed products count as available
+        self.available = self.listed
+        self.name_rank = np.argsort(np.argsort([(product.get('name') or "").lower() for product in products], kind="stable"))
+        self.products = products
+        self.builds += 1
+
+    def _term_scores(self, term: str) -> np.ndarray:
+        """Score every product for one term, prefix-matched; name hits outweigh description hits."""
+        scores = np.zeros(len(self.products), dtype=np.float32)
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_left(self.vocabulary, term + "\x7f")
+        for token in self.vocabulary[start:end]:
+            weight = 1.0 if token == term else 0.5
+            for postings, field_weight in ((self.name_postings.get(token), 2.0), (self.description_postings.get(token), 1.0)):
+                if postings is not None:
+                    scores[postings] = np.maximum(scores[postings], weight * field_weight)
+        return scores
+
+    def search(self, q: Optional[str], origins: List[str], available: Optional[bool], min_price: Optional[float],
+               max_price: Optional[float], sort: str, limit: int, offset: int) -> dict:
+        count = len(self.products)
+        text_match = np.ones(count, dtype=bool)
+        scores = np.zeros(count, dtype=np.float32)
+        for term in search_tokens(q):
+            term_scores = self._term_scores(term)
+            text_match &= term_scores > 0
+            scores += term_scores
+        
+        price_match = np.ones(count, dtype=bool)
+        if min_price is not None:
+            price_match &= self.prices >= min_price
+        if max_price is not None:
+            price_match &= self.prices <= max_price
+        origin_match = np.ones(count, dtype=bool)
+        if origins:
+            codes = [self.origin_lookup[o.lower()] for o in origins if o.lower() in self.origin_lookup]
+            origin_match = np.isin(self.origin_codes, codes)
+        available_match = np.ones(count, dtype=bool) if available is None else self.available == available
+        
+        # Each facet is counted with every filter applied except its own
+        base = text_match & price_match
+        origin_counts = np.bincount(self.origin_codes[base & available_match], minlength=len(self.origins))
+        in_stock = int(np.count_nonzero(base & origin_match & self.available))
+        not_in_stock = int(np.count_nonzero(base & origin_match & ~self.available))
+        priced = self.prices[text_match & origin_match & available_match]
+        
+        matches = np.flatnonzero(base & origin_match & available_match)
+        if sort == "relevance" and q:
+            matches = matches[np.argsort(-scores[matches], kind="stable")]
+        elif sort == "price_asc":
+            matches = matches[np.argsort(self.prices[matches], kind="stable")]
+        elif sort == "price_desc":
+            matches = matches[np.argsort(-self.prices[matches], kind="stable")]
+        elif sort == "name":
+            matches = matches[np.argsort(self.name_rank[matches])]
+        elif sort == "newest":
+            # Products are held in (created_at, id) order
+            matches = matches[::-1]
+        
+        return {
+            "items": [{**self.products[position], "available": bool(self.available[position])}
+                      for position in matches[offset:offset + limit]],
+            "total": int(len(matches)),
+            "limit": limit,
+            "offset": offset,
+            "facets": {
+                "origin": {origin: int(n) for origin, n in zip(self.origins, origin_counts) if n},
+                "available": {"true": in_stock, "false": not_in_stock},
+            },
+            "price_range": {
+                "min": float(priced.min()) if len(priced) else None,
+                "max": float(priced.max()) if len(priced) else None,
+            },
+        }
+
+    def stats(self) -> dict:
+        return {"builds": self.builds, "products": len(self.products), "terms": len(self.vocabulary),
+                "sold_out": self.sold_out}
+
+catalog_search = CatalogSearchIndex()
+
+@api_router.get("/products/search", response_model=ProductSearchResponse)
+async def search_products(
+    q: Optional[str] = Query(None, max_length=200),
+    origin: List[str] = Query([]),
+    available: Optional[bool] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    sort: str = Query("relevance", pattern=f"^({'|'.join(SEARCH_SORTS)})$"),
+    limit: int = Query(24, ge=1),
+    offset: int = Query(0, ge=0),
+):
+    """Full-text search over name/description with origin, availability and price filters.
+
+    Terms are ANDed and prefix-matched, so partial words work for
+    search-as-you-type. ``facets`` holds the counts for each origin and for
+    in/out of stock under the other active filters.
+    """
+    index = await catalog_search.get()
+    result = index.search(q, origin, available, min_price, max_price, sort, min(limit, PRODUCT_PAGE_MAX), offset)
+    return Response(content=dumps_json(result), media_type="application/json")
+
+# ============ PRODUCT IMAGES ============
+
+# format -> (Pillow format, media type, save options)
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"optimize": True, "progressive": True}),
+    "png": ("PNG", "image/png", {"optimize": True}),
+}
+
+def render_image_variant(source: bytes, width: int, image_format: str, quality: int) -> bytes:
+    """Downscale an original to ``width`` pixels wide and re-encode it. CPU-bound; run in a thread."""
+    from PIL import Image, ImageOps
+
+    pil_format, _, options = IMAGE_FORMATS[image_format]
+    with Image.open(io.BytesIO(source)) as original:
+        if original.format == "JPEG" and original.width > width:
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full size
+            original.draft("RGB", (width, max(1, original.height * width // original.width)))
+        image = ImageOps.exif_transpose(original)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        if pil_format == "PNG":
+            image.save(output, pil_format, **options)
+        else:
+            image.save(output, pil_format, quality=quality, **options)
+    return output.getvalue()
+
+class ImageDiskCache:
+    """Size-bounded LRU of files under ``IMAGE_CACHE_DIR``.
+
+    The index (name -> size, least recently used first) lives in memory and
+    is rebuilt from file mtimes on first use, so recency survives restarts.
+    Files are written atomically; each worker keeps its own index, and a
+    file evicted by another worker is simply treated as a miss.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    def _scan(self) -> List[tuple]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.endswith(".tmp"):
+                stat = path.stat()
+                files.append((stat.st_mtime, path.relative_to(self.root).as_posix(), stat.st_size))
+        return sorted(files)
+
+    async def load(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                for _, name, size in await asyncio.to_thread(self._scan):
+                    self.entries[name] = size
+                    self.total_bytes += size
+                self._loaded = True
+
+    def _read(self, name: str) -> bytes:
+        path = self.root / name
+        data = path.read_bytes()
+        os.utime(path)
+        return data
+
+    def _write(self, name: str, data: bytes):
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+
+    def _forget(self, name: str):
+        self.total_bytes -= self.entries.pop(name, 0)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    async def read(self, name: str) -> Optional[bytes]:
+        await self.load()
+        if name not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            data = await asyncio.to_thread(self._read, name)
+        except FileNotFoundError:
+            self._forget(name)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(name)
+        self.hits += 1
+        return data
+
+    async def write(self, name: str, data: bytes):
+        await self.load()
+        await asyncio.to_thread(self._write, name, data)
+        self._forget(name)
+        self.entries[name] = len(data)
+        self.total_bytes += len(data)
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            self._forget(oldest)
+            evicted.append(self.root / oldest)
+        if evicted:
+            self.evictions += len(evicted)
+            await asyncio.to_thread(lambda: [path.unlink(missing_ok=True) for path in evicted])
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class ProductImageService:
+    """Serves resized variants of product images from the disk cache.
+
+    Each original is fetched (or read from ``IMAGE_SOURCE_DIR``) once per
+    image version and stored under the SHA-256 of its content; variants are
+    named after that hash plus width, quality and format, so a changed image
+    never collides with a cached one. The version is the product's
+    ``updated_at`` (see ``image_version``): saving the product makes the next
+    request fetch the URL again, which picks up an image replaced at the
+    same URL. Concurrent requests for the same variant share one render,
+    and renders are bounded by ``IMAGE_MAX_CONCURRENT_RESIZES``.
+    """
+
+    def __init__(self, cache: ImageDiskCache):
+        self.cache = cache
+        # source key (image_url plus version) -> content hash; also persisted as small files under sources/
+        self.source_hashes: Dict[str, str] = {}
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        self._resize_slots: Optional[asyncio.Semaphore] = None
+        self.fetches = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+
+    @staticmethod
+    def source_key(image_url: str, version: Optional[str]) -> str:
+        # Unversioned products keep the URL alone, which matches what was recorded before versions existed
+        return f"{image_url}#{version}" if version else image_url
+
+    @staticmethod
+    def _source_name(source_key: str) -> str:
+        return f"sources/{hashlib.sha256(source_key.encode()).hexdigest()}"
+
+    @staticmethod
+    def variant_name(content_hash: str, width: int, image_format: str, quality: int) -> str:
+        return f"variants/{content_hash[:2]}/{content_hash}-{width}w-q{quality}.{image_format}"
+
+    @staticmethod
+    def etag(content_hash: str, width: int, image_format: str, quality: int) -> str:
+        return f'"{content_hash[:24]}-{width}-{quality}-{image_format}"'
+
+    async def content_hash(self, image_url: str, version: Optional[str] = None) -> Optional[str]:
+        """Hash of the original behind this version of ``image_url``, if it has been fetched before."""
+        key = self.source_key(image_url, version)
+        content_hash = self.source_hashes.get(key)
+        if content_hash is None:
+            recorded = await self.cache.read(self._source_name(key))
+            if recorded:
+                content_hash = self.source_hashes[key] = recorded.decode()
+        return content_hash
+
+    async def _fetch(self, image_url: str) -> bytes:
+        self.fetches += 1
+        if image_url.startswith(("http://", "https://")):
+            import httpx
+
+            chunks, size = [], 0
+            async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as http:
+                async with http.stream("GET", image_url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > IMAGE_MAX_SOURCE_BYTES:
+                            raise ValueError(f"Image larger than {IMAGE_MAX_SOURCE_BYTES} bytes")
+                        chunks.append(chunk)
+            return b"".join(chunks)
+        
+        source_dir = IMAGE_SOURCE_DIR.resolve()
+        path = (source_dir / image_url.lstrip("/")).resolve()
+        if source_dir not in path.parents:
+            raise ValueError(f"Image path outside {source_dir}")
+        return await asyncio.to_thread(path.read_bytes)
+
+    async def original(self, image_url: str, version: Optional[str] = None) -> tuple:
+        """(content hash, bytes) of the original, from the cache or the source."""
+        content_hash = await self.content_hash(image_url, version)
+        if content_hash is not None:
+            data = await self.cache.read(f"originals/{content_hash}")
+            if data is not None:
+                return content_hash, data
+        data = await self._fetch(image_url)
+        content_hash = hashlib.sha256(data).hexdigest()
+        key = self.source_key(image_url, version)
+        await self.cache.write(f"originals/{content_hash}", data)
+        await self.cache.write(self._source_name(key), content_hash.encode())
+        self.source_hashes[key] = content_hash
+        return content_hash, data
+
+    async def _render(self, image_url: str, version: Optional[str], width: int, image_format: str, quality: int) -> tuple:
+        content_hash, source = await self.original(image_url, version)
+        name = self.variant_name(content_hash, width, image_format, quality)
+        data = await self.cache.read(name)
+        if data is None:
+            if self._resize_slots is None:
+                self._resize_slots = asyncio.Semaphore(IMAGE_MAX_CONCURRENT_RESIZES)
+            async with self._resize_slots:
+                started = time.perf_counter()
+                data = await asyncio.to_thread(render_image_variant, source, width, image_format, quality)
+                self.render_seconds += time.perf_counter() - started
+            self.renders += 1
+            await self.cache.write(name, data)
+        return content_hash, data
+
+    async def variant(self, image_url: str, width: int, image_format: str, quality: int,
+                      version: Optional[str] = None) -> tuple:
+        """(ETag, bytes) of one variant, rendering it on a cache miss."""
+        content_hash = await self.content_hash(image_url, version)
+        if content_hash is not None:
+            data = await self.cache.read(self.variant_name(content_hash, width, image_format, quality))
+            if data is not None:
+                return self.etag(content_hash, width, image_format, quality), data
+        
+        key = (image_url, version, width, image_format, quality)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(*key))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        content_hash, data = await asyncio.shield(future)
+        return self.etag(content_hash, width, image_format, quality), data
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "sources": len(self.source_hashes),
+            "fetches": self.fetches,
+            "renders": self.renders,
+            "render_seconds": round(self.render_seconds, 3),
+            "in_flight": len(self._in_flight),
+        }
+
+product_images = ProductImageService(ImageDiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES))
+
+@api_router.get("/images/{product_id}")
+async def get_product_image(
+    product_id: str,
+    request: Request,
+    w: int = Query(480, ge=1),
+    format: str = Query("auto", pattern="^(auto|webp|jpeg|png)$"),
+    q: int = Query(80, ge=30, le=95),
+    v: Optional[str] = None,
+):
+    """A product's image resized to width ``w`` (rounded up to one of ``IMAGE_WIDTHS``).
+
+    ``format=auto`` picks WebP when the client accepts it. Pass ``v`` (any
+    value that changes with the product's image_url and updated_at) to get
+    an immutable, year-long ``Cache-Control``; without it responses are
+    cached for a day and revalidated with the ETag.
+    """
+    snapshot = await catalog_snapshot.get()
+    image = snapshot.images.get(product_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Product image not found")
+    image_url, version = image
+    width = next((allowed for allowed in IMAGE_WIDTHS if allowed >= w), IMAGE_WIDTHS[-1])
+    headers = {"Cache-Control": "public, max-age=31536000, immutable" if v else "public, max-age=86400"}
+    if format == "auto":
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+        headers["Vary"] = "Accept"
+    
+    # Conditional requests are answered from the hash alone, without touching the variant
+    content_hash = await product_images.content_hash(image_url, version)
+    if_none_match = request.headers.get("if-none-match")
+    if content_hash is not None and if_none_match:
+        etag = product_images.etag(content_hash, width, format, q)
+        if etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers={**headers, "ETag": etag})
+    
+    try:
+        etag, body = await product_images.variant(image_url, width, format, q, version)
+    except Exception as e:
+        logger.error(f"Image variant failed for product {product_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Product image unavailable")
+    return Response(content=body, media_type=IMAGE_FORMATS[format][1], headers={**headers, "ETag": etag})
+
+# ============ PRICING ============
+
+# Per-gram price by origin and multipliers by roast/grind. The defaults
+# reproduce the builder's quantity * $0.05 pricing.
+PRICE_TABLE = {
+    "origins": {"ethiopian": 0.05, "colombian": 0.05, "costa_rican": 0.05, "brazilian": 0.05},
+    "default_origin_price": 0.05,
+    "roast_levels": {"light": 1.0, "medium": 1.0, "dark": 1.0},
+    "grind_sizes": {"whole_bean": 1.0, "coarse": 1.0, "medium": 1.0, "fine": 1.0},
+}
+
+DEFAULT_SHIPPING_RATES = [
+    {"id": "1", "region": "Standard", "rate": 10.0, "description": "Personal Delivery"},
+]
+
+class PricingEngine:
+    """Custom blend pricing compiled into index maps and numpy vectors.
+
+    ``quote_blends`` prices any number of blends in one vectorized pass: the
+    component shares form an (n_blends x n_origins) matrix that is multiplied
+    by the per-gram origin price vector, then scaled by roast, grind and
+    quantity.
+    """
+
+    def __init__(self, table: dict):
+        self.origin_index = {name: i for i, name in enumerate(table["origins"])}
+        # Last column holds the price for origins missing from the table
+        self.origin_prices = np.array([*table["origins"].values(), table["default_origin_price"]], dtype=np.float64)
+        self.roast_index = {name: i for i, name in enumerate(table["roast_levels"])}
+        self.roast_multipliers = np.array([*table["roast_levels"].values(), 1.0], dtype=np.float64)
+        self.grind_index = {name: i for i, name in enumerate(table["grind_sizes"])}
+        self.grind_multipliers = np.array([*table["grind_sizes"].values(), 1.0], dtype=np.float64)
+
+    def quote_blends(self, blends: List[dict]) -> np.ndarray:
+        n = len(blends)
+        if n == 0:
+            return np.zeros(0)
+        unknown_origin = len(self.origin_prices) - 1
+        shares = np.zeros((n, len(self.origin_prices)), dtype=np.float64)
+        roasts = np.empty(n, dtype=np.intp)
+        grinds = np.empty(n, dtype=np.intp)
+        grams = np.empty(n, dtype=np.float64)
+        for row, blend in enumerate(blends):
+            components = blend.get('blend_components') or {blend.get('origin', ''): 100}
+            for origin, share in components.items():
+                shares[row, self.origin_index.get(origin, unknown_origin)] += share
+            roasts[row] = self.roast_index.get(blend.get('roast_level'), len(self.roast_multipliers) - 1)
+            grinds[row] = self.grind_index.get(blend.get('grind_size'), len(self.grind_multipliers) - 1)
+            grams[row] = blend.get('quantity', 0)
+        totals = shares.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        per_gram = (shares / totals) @ self.origin_prices
+        prices = per_gram * self.roast_multipliers[roasts] * self.grind_multipliers[grinds] * grams
+        return np.round(prices, 2)
+
+    def quote_blend(self, blend: dict) -> float:
+        return float(self.quote_blends([blend])[0])
+
+pricing_engine = PricingEngine(PRICE_TABLE)
+
+BLEND_PRICING_FIELDS = {"_id": 0, "id": 1, "name": 1, "origin": 1, "roast_level": 1, "grind_size": 1, "blend_components": 1, "quantity": 1}
+
+async def price_carts(carts: List[List[dict]], user_id: Optional[str] = None) -> List[List[CartLine]]:
+    """Price any number of carts with one ``$in`` lookup per collection.
+
+    Custom blends are private to their owner: only ``user_id``'s own blends
+    are looked up, and without a user every blend line is an unknown blend.
+    """
+    items = [item for cart in carts for item in cart]
+    product_ids = list({item['product_id'] for item in items if item.get('product_id')})
+    blend_ids = list({item['custom_blend_id'] for item in items if item.get('custom_blend_id')})
+    
+    async def lookup(collection, ids, query, projection):
+        if not ids:
+            return {}
+        cursor = collection.find({**query, "id": {"$in": ids}}, projection)
+        return {doc['id']: doc async for doc in cursor}
+    
+    products, blends = await asyncio.gather(
+        lookup(db.products, product_ids, {}, {"_id": 0, "id": 1, "name": 1, "price": 1, "available": 1}),
+        lookup(db.custom_blends, blend_ids if user_id else [], {"user_id": user_id}, BLEND_PRICING_FIELDS),
+    )
+    blend_docs = list(blends.values())
+    blend_prices = dict(zip([doc['id'] for doc in blend_docs], pricing_engine.quote_blends(blend_docs).tolist()))
+    
+    priced = []
+    for cart in carts:
+        lines = []
+        for item in cart:
+            if item.get('product_id'):
+                doc, item_type, unknown = products.get(item['product_id']), "Product", "Unknown Product"
+                price = float(doc['price']) if doc else 0.0
+            elif item.get('custom_blend_id'):
+                doc, item_type, unknown = blends.get(item['custom_blend_id']), "Custom Blend", "Unknown Blend"
+                price = blend_prices[doc['id']] if doc else 0.0
+            else:
+                doc, item_type, unknown, price = None, "Unknown", "Unknown Item", 0.0
+            quantity = item.get('quantity', 1)
+            lines.append(CartLine(
+                id=item.get('id'),
+                product_id=item.get('product_id'),
+                custom_blend_id=item.get('custom_blend_id'),
+                quantity=quantity,
+                type=item_type,
+                name=doc['name'] if doc else unknown,
+                price=price,
+                line_total=round(price * quantity, 2),
+                available=bool(doc) and doc.get('available', True),
+            ))
+        priced.append(lines)
+    return priced
+
+async def get_shipping_rates() -> List[dict]:
+    rates = await db.shipping_rates.find({}, {"_id": 0}).to_list(None)
+    return rates or DEFAULT_SHIPPING_RATES
+
+@api_router.post("/quotes", response_model=QuoteResponse)
+async def create_quotes(quote_input: QuoteRequest, current_user: Optional[User] = Depends(get_optional_user)):
+    """Batch-price blend configurations and carts in one call."""
+    blend_prices = pricing_engine.quote_blends([blend.model_dump() for blend in quote_input.blends])
+    user_id = current_user.id if current_user else None
+    carts = await price_carts([[item.model_dump() for item in cart] for cart in quote_input.carts], user_id)
+    return fast_response(QuoteResponse(
+        blends=blend_prices.tolist(),
+        carts=[CartQuote(items=lines, subtotal=round(sum(line.line_total for line in lines), 2)) for lines in carts],
+    ))
+
+# ============ CART ROUTES ============
+
+CART_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+CART_LINE_KINDS = {"product": "product_id", "blend": "custom_blend_id"}
+
+class CartOwner:
+    """Whose cart a request addresses: the signed-in user's, or the guest cart named by the cookie."""
+
+    def __init__(self, user: Optional[User], guest_id: Optional[str]):
+        self.user = user
+        self.guest_id = guest_id
+
+    @property
+    def cart_id(self) -> Optional[str]:
+        if self.user is not None:
+            return f"user:{self.user.id}"
+        return f"guest:{self.guest_id}" if self.guest_id else None
+
+    def claim(self) -> str:
+        """Cart id to write to, minting a guest id on a guest's first write."""
+        if self.user is None and not self.guest_id:
+            self.guest_id = uuid.uuid4().hex
+        return self.cart_id
+
+    def stamp(self, now: datetime) -> dict:
+        fields = {"updated_at": now}
+        if self.user is None:
+            fields["expires_at"] = now + timedelta(days=CART_GUEST_TTL_DAYS)
+        return fields
+
+async def get_cart_owner(request: Request, current_user: Optional[User] = Depends(get_optional_user)) -> CartOwner:
+    guest_id = request.cookies.get(CART_COOKIE_NAME)
+    if guest_id and not CART_ID_PATTERN.match(guest_id):
+        guest_id = None
+    return CartOwner(current_user, guest_id)
+
+def cart_line_key(item: CartItemCreate) -> tuple:
+    """(key, id field, id) of the line an item belongs to; lines are stored under ``lines.<key>``."""
+    if bool(item.product_id) == bool(item.custom_blend_id):
+        raise HTTPException(status_code=400, detail="Give exactly one of product_id or custom_blend_id")
+    kind, field = ("product", "product_id") if item.product_id else ("blend", "custom_blend_id")
+    item_id = getattr(item, field)
+    # The id becomes part of a field path, so it may not contain '.' or '$'
+    if not CART_ID_PATTERN.match(item_id):
+        raise HTTPException(status_code=400, detail=f"Invalid {field}")
+    return f"{kind}:{item_id}", field, item_id
+
+def parse_cart_item_id(item_id: str) -> str:
+    kind, _, raw_id = item_id.partition(":")
+    if kind not in CART_LINE_KINDS or not CART_ID_PATTERN.match(raw_id):
+        raise HTTPException(status_code=404, detail="Cart item not found")
+    return item_id
+
+def cart_items(doc: Optional[dict]) -> List[dict]:
+    return [{"id": key, **line} for key, line in ((doc or {}).get('lines') or {}).items()]
+
+def cart_response(owner: CartOwner, doc: Optional[dict]) -> Response:
+    items = cart_items(doc)
+    response = Response(
+        content=dumps_json({"items": items, "item_count": sum(item.get('quantity', 0) for item in items)}),
+        media_type="application/json",
+    )
+    if owner.user is None and owner.guest_id:
+        # Refreshed on every guest response, in step with the cart's expires_at
+        response.set_cookie(CART_COOKIE_NAME, owner.guest_id, max_age=int(CART_GUEST_TTL_DAYS * 86400),
+                            httponly=True, samesite=CART_COOKIE_SAMESITE, secure=CART_COOKIE_SECURE)
+    return response
+
+async def upsert_cart(cart_id: str, update: dict) -> dict:
+    try:
+        return await db.carts.find_one_and_update(
+            {"id": cart_id}, update, projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Lost a race to create the same cart; it exists now
+        return await db.carts.find_one_and_update(
+            {"id": cart_id}, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+
+def cart_add_update(lines: Dict[str, dict], now: datetime) -> dict:
+    """One update that adds each line's quantity, creating lines (and the cart) as needed."""
+    update = {"$inc": {}, "$set": {}, "$min": {}}
+    for key, line in lines.items():
+        update["$inc"][f"lines.{key}.quantity"] = line['quantity']
+        field = CART_LINE_KINDS[key.partition(":")[0]]
+        update["$set"][f"lines.{key}.{field}"] = line[field]
+        update["$min"][f"lines.{key}.created_at"] = line.get('created_at', now)
+    return update
+
+async def merge_guest_cart(request: Request, user_id: str):
+    """Fold the guest cart named by the cookie into the user's cart, on sign-in.
+
+    The guest cart is leased first so concurrent sign-ins merge it once,
+    and deleted only after its lines are in the user's cart. If the merge
+    fails, the lease runs out and the next sign-in tries again.
+    """
+    guest_id = request.cookies.get(CART_COOKIE_NAME)
+    if not guest_id or not CART_ID_PATTERN.match(guest_id):
+        return
+    now = datetime.now(timezone.utc)
+    lease_token = str(uuid.uuid4())
+    guest = await db.carts.find_one_and_update(
+        {"id": f"guest:{guest_id}", "lease_until": {"$not": {"$gt": now}}},
+        {"$set": {"lease_token": lease_token, "lease_until": now + timedelta(seconds=CART_MERGE_LEASE_SECONDS)}},
+        projection={"_id": 0, "lines": 1},
+    )
+    if guest is None:
+        return
+    if guest.get('lines'):
+        update = cart_add_update(guest['lines'], now)
+        update["$set"]["updated_at"] = now
+        update["$setOnInsert"] = {"user_id": user_id}
+        await upsert_cart(f"user:{user_id}", update)
+    await db.carts.delete_one({"id": f"guest:{guest_id}", "lease_token": lease_token})
+
+async def summarize_cart(items: List[dict], user_id: Optional[str] = None) -> CartSummary:
+    lines, rates = await asyncio.gather(price_carts([items], user_id), get_shipping_rates())
+    lines = lines[0]
+    return CartSummary(
+        items=lines,
+        item_count=sum(line.quantity for line in lines),
+        subtotal=round(sum(line.line_total for line in lines), 2),
+        shipping_rates=[ShippingRate(**rate) for rate in rates],
+    )
+
+@api_router.get("/cart", response_model=Cart)
+async def get_cart(owner: CartOwner = Depends(get_cart_owner)):
+    doc = await db.carts.find_one({"id": owner.cart_id}, {"_id": 0, "lines": 1}) if owner.cart_id else None
+    return cart_response(owner, doc)
+
+@api_router.post("/cart", response_model=Cart)
+async def add_to_cart(item_input: CartItemCreate, owner: CartOwner = Depends(get_cart_owner)):
+    """Add to a line's quantity, creating the line and the cart if needed, in one round trip."""
+    key, field, item_id = cart_line_key(item_input)
+    now = datetime.now(timezone.utc)
+    update = cart_add_update({key: {field: item_id, "quantity": item_input.quantity}}, now)
+    update["$set"].update(owner.stamp(now))
+    if owner.user is not None:
+        update["$setOnInsert"] = {"user_id": owner.user.id}
+    return cart_response(owner, await upsert_cart(owner.claim(), update))
+
+@api_router.put("/cart/{item_id}", response_model=Cart)
+async def update_cart_item(item_id: str, item_input: CartItemUpdate, owner: CartOwner = Depends(get_cart_owner)):
+    key = parse_cart_item_id(item_id)
+    now = datetime.now(timezone.utc)
+    if item_input.quantity == 0:
+        update = {"$unset": {f"lines.{key}": ""}, "$set": owner.stamp(now)}
+    else:
+        update = {"$set": {f"lines.{key}.quantity": item_input.quantity, **owner.stamp(now)}}
+    doc = await db.carts.find_one_and_update(
+        {"id": owner.cart_id, f"lines.{key}": {"$exists": True}}, update,
+        projection={"_id": 0, "lines": 1}, return_document=ReturnDocument.AFTER,
+    ) if owner.cart_id else None
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Cart item not found")
+    return cart_response(owner, doc)
+
+@api_router.delete("/cart/{item_id}", response_model=Cart)
+async def remove_cart_item(item_id: str, owner: CartOwner = Depends(get_cart_owner)):
+    key = parse_cart_item_id(item_id)
+    doc = await db.carts.find_one_and_update(
+        {"id": owner.cart_id, f"lines.{key}": {"$exists": True}},
+        {"$unset": {f"lines.{key}": ""}, "$set": owner.stamp(datetime.now(timezone.utc))},
+        projection={"_id": 0, "lines": 1}, return_document=ReturnDocument.AFTER,
+    ) if owner.cart_id else None
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Cart item not found")
+    return cart_response(owner, doc)
+
+@api_router.delete("/cart", response_model=Cart)
+async def clear_cart(owner: CartOwner = Depends(get_cart_owner)):
+    if owner.cart_id:
+        await db.carts.update_one({"id": owner.cart_id}, {"$set": {"lines": {}, **owner.stamp(datetime.now(timezone.utc))}})
+    return cart_response(owner, None)
+
+@api_router.get("/cart/summary", response_model=CartSummary)
+async def get_cart_summary(owner: CartOwner = Depends(get_cart_owner)):
+    doc = await db.carts.find_one({"id": owner.cart_id}, {"_id": 0, "lines": 1}) if owner.cart_id else None
+    return fast_response(await summarize_cart(cart_items(doc), owner.user.id if owner.user else None))
+
+@api_router.post("/cart/summary", response_model=CartSummary)
+async def quote_cart_summary(summary_input: CartSummaryRequest):
+    """Summary for a guest cart held client-side."""
+    return fast_response(await summarize_cart([item.model_dump() for item in summary_input.items]))
+
+# ============ SALES ROLLUPS ============
+
+def rollup_key(value) -> str:
+    # Rollup counters are stored as sub-document keys, which cannot contain '.' or '$'
+    return str(value or "unknown").replace(".", "_").replace("$", "_")
+
+def order_line_total(item: dict) -> float:
+    if 'line_total' in item:
+        return float(item['line_total'])
+    return float((item.get('details') or {}).get('price', 0)) * item.get('quantity', 1)
+
+class SalesRollups:
+    """Incrementally maintained sales aggregates for the admin dashboard.
+
+    Buckets live in ``sales_rollups``: one document per day and per hour
+    (revenue, paid revenue, order count), one for order statuses, one for
+    payment statuses and one for units by origin. Every product and custom
+    blend ever ordered gets its own small document (units and revenue), so
+    no document grows with the catalog or the number of users, and the
+    dashboard reads the top sellers by index. Every order write bumps the
+    affected counters with ``$inc``, so reading the dashboard never touches
+    the orders collection.
+    """
+
+    collection_name = "sales_rollups"
+
+    @property
+    def collection(self):
+        return db[self.collection_name]
+
+    @staticmethod
+    def _buckets(created_at) -> List[tuple]:
+        created_at = parse_datetime(created_at)
+        return [("day", created_at.strftime("%Y-%m-%d")), ("hour", created_at.strftime("%Y-%m-%dT%H"))]
+
+    @staticmethod
+    async def _item_origins(orders: List[dict]) -> dict:
+        items = [item for order in orders for item in order.get('items', [])]
+        product_ids = list({item['product_id'] for item in items if item.get('product_id')})
+        blend_ids = list({item['custom_blend_id'] for item in items if item.get('custom_blend_id')})
+        origins = {}
+        if product_ids:
+            async for doc in db.products.find({"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "origin": 1}):
+                origins[doc['id']] = doc.get('origin')
+        if blend_ids:
+            async for doc in db.custom_blends.find({"id": {"$in": blend_ids}}, {"_id": 0, "id": 1, "origin": 1}):
+                origins[doc['id']] = doc.get('origin')
+        return origins
+
+    @staticmethod
+    def _add(increments: dict, bucket_id: str, field: str, amount):
+        if amount:
+            counters = increments.setdefault(bucket_id, {})
+            counters[field] = counters.get(field, 0) + amount
+
+    def _order_increments(self, increments: dict, order: dict, origins: dict, sign: int = 1):
+        total = float(order.get('total_amount', 0))
+        paid = order.get('payment_status') == 'paid'
+        for kind, bucket in self._buckets(order['created_at']):
+            bucket_id = f"{kind}:{bucket}"
+            self._add(increments, bucket_id, "orders", sign)
+            self._add(increments, bucket_id, "revenue", sign * total)
+            if paid:
+                self._add(increments, bucket_id, "paid_revenue", sign * total)
+        self._add(increments, "status", f"counts.{rollup_key(order.get('status', 'pending'))}", sign)
+        self._add(increments, "payment_status", f"counts.{rollup_key(order.get('payment_status', 'pending'))}", sign)
+        for item in order.get('items', []):
+            item_id = item.get('product_id') or item.get('custom_blend_id')
+            quantity = item.get('quantity', 1)
+            item_bucket = f"{'product' if item.get('product_id') else 'blend'}:{item_id or 'unknown'}"
+            self._add(increments, item_bucket, "units", sign * quantity)
+            self._add(increments, item_bucket, "revenue", sign * order_line_total(item))
+            self._add(increments, "units", f"origins.{rollup_key(origins.get(item_id))}", sign * quantity)
+
+    @staticmethod
+    def _operations(increments: dict) -> List[UpdateOne]:
+        now = datetime.now(timezone.utc)
+        operations = []
+        for bucket_id, counters in increments.items():
+            kind, _, bucket = bucket_id.partition(":")
+            operations.append(UpdateOne(
+                {"id": bucket_id},
+                {"$inc": counters, "$set": {"updated_at": now}, "$setOnInsert": {"kind": kind, "bucket": bucket or None}},
+                upsert=True,
+            ))
+        return operations
+
+    async def _apply(self, increments: dict, collection=None):
+        operations = self._operations(increments)
+        if operations:
+            await (collection if collection is not None else self.collection).bulk_write(operations, ordered=False)
+
+    async def record_order(self, order: dict):
+        await self.record_orders([order])
+
+    async def record_orders(self, orders: List[dict]):
+        increments = {}
+        origins = await self._item_origins(orders)
+        for order in orders:
+            self._order_increments(increments, order, origins)
+        await self._apply(increments)
+
+    async def record_status_change(self, before: dict, after: dict):
+        """Move counters for an order whose status or payment status changed."""
+        increments = {}
+        for field, bucket_id in (("status", "status"), ("payment_status", "payment_status")):
+            if before.get(field) != after.get(field):
+                self._add(increments, bucket_id, f"counts.{rollup_key(before.get(field))}", -1)
+                self._add(increments, bucket_id, f"counts.{rollup_key(after.get(field))}", 1)
+        was_paid = before.get('payment_status') == 'paid'
+        is_paid = after.get('payment_status') == 'paid'
+        if was_paid != is_paid:
+            amount = float(after.get('total_amount', 0)) * (1 if is_paid else -1)
+            for kind, bucket in self._buckets(after['created_at']):
+                self._add(increments, f"{kind}:{bucket}", "paid_revenue", amount)
+        await self._apply(increments)
+
+    async def rebuild(self, batch_size: int = 1000) -> dict:
+        """Recompute every bucket from the live and archived orders and swap it in.
+
+        Counters live in memory per bucket (not per order) while the orders
+        are scanned in batches, then land in a scratch collection that is
+        renamed over the live one.
+        
+        Only safe while no orders are being written: increments that live
+        traffic makes between the scan and the rename are lost or counted
+        twice. It is therefore run offline through ``rebuild_rollups.py``
+        and not exposed as a route.
+        """
+        started = time.perf_counter()
+        increments = {}
+        orders = 0
+        batch = []
+        projection = {"_id": 0, "created_at": 1, "total_amount": 1, "status": 1, "payment_status": 1, "items": 1}
+        
+        async def flush():
+            origins = await self._item_origins(batch)
+            for order in batch:
+                self._order_increments(increments, order, origins)
+        
+        for collection in (db.orders, db.orders_archive):
+            async for order in collection.find({}, projection):
+                batch.append(order)
+                orders += 1
+                if len(batch) >= batch_size:
+                    await flush()
+                    batch = []
+        if batch:
+            await flush()
+        
+        scratch = db[f"{self.collection_name}_rebuild"]
+        await scratch.drop()
+        await self._apply(increments, scratch)
+        await scratch.create_indexes(INDEXES[self.collection_name])
+        if increments:
+            await scratch.rename(self.collection_name, dropTarget=True)
+        else:
+            await self.collection.delete_many({})
+        return {"orders": orders, "buckets": len(increments), "seconds": round(time.perf_counter() - started, 3)}
+
+    async def stats(self, days: int = 30, hours: int = 48, top: int = 10) -> dict:
+        now = datetime.now(timezone.utc)
+        day_start = (now - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        hour_start = (now - timedelta(hours=hours - 1)).strftime("%Y-%m-%dT%H")
+        projection = {"_id": 0, "bucket": 1, "orders": 1, "revenue": 1, "paid_revenue": 1}
+        collection = secondary_db()[self.collection_name]
+        
+        async def top_items(kind: str, field: str) -> List[dict]:
+            cursor = collection.find({"kind": kind}, {"_id": 0, "bucket": 1, field: 1}).sort(field, DESCENDING).limit(top)
+            return [{"key": doc['bucket'], "value": doc.get(field, 0)} async for doc in cursor]
+        
+        daily, hourly, singles, units_by_product, units_by_blend, revenue_by_product = await asyncio.gather(
+            collection.find({"kind": "day", "bucket": {"$gte": day_start}}, projection).sort("bucket", 1).to_list(None),
+            collection.find({"kind": "hour", "bucket": {"$gte": hour_start}}, projection).sort("bucket", 1).to_list(None),
+            collection.find({"id": {"$in": ["status", "payment_status", "units"]}}, {"_id": 0, "id": 1, "counts": 1, "origins": 1}).to_list(None),
+            top_items("product", "units"),
+            top_items("blend", "units"),
+            top_items("product", "revenue"),
+        )
+        singles = {doc['id']: doc for doc in singles}
+        origins = (singles.get("units") or {}).get("origins") or {}
+        ranked_origins = sorted(origins.items(), key=lambda kv: kv[1], reverse=True)[:top]
+        
+        return {
+            "daily": daily,
+            "hourly": hourly,
+            "order_status": (singles.get("status") or {}).get("counts", {}),
+            "payment_status": (singles.get("payment_status") or {}).get("counts", {}),
+            "units_by_product": units_by_product,
+            "units_by_blend": units_by_blend,
+            "units_by_origin": [{"key": key, "value": value} for key, value in ranked_origins],
+            "revenue_by_product": revenue_by_product,
+            "totals": {
+                "orders": sum(day.get("orders", 0) for day in daily),
+                "revenue": round(sum(day.get("revenue", 0) for day in daily), 2),
+                "paid_revenue": round(sum(day.get("paid_revenue", 0) for day in daily), 2),
+            },
+        }
+
+sales_rollups = SalesRollups()
+
+# ============ SUBSCRIPTION SCHEDULER ============
+
+def add_months(value: datetime, months: int) -> datetime:
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    days_in_month = (datetime(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day
+    return value.replace(year=year, month=month, day=min(value.day, days_in_month))
+
+SUBSCRIPTION_FREQUENCIES = {
+    "weekly": lambda value: value + timedelta(weeks=1),
+    "biweekly": lambda value: value + timedelta(weeks=2),
+    "monthly": lambda value: add_months(value, 1),
+    "quarterly": lambda value: add_months(value, 3),
+}
+
+SUBSCRIPTION_ORDER_NAMESPACE = uuid.UUID("6f1c2b0e-3a4d-4f7e-9b1a-2c5d8e9f0a13")
+
+class SubscriptionScheduler:
+    """Turns due subscriptions into orders in bounded batches.
+
+    Each batch is claimed with a lease: candidate ids come from the
+    ``(status, next_delivery)`` index and are stamped with a per-batch
+    ``lease_token`` by a conditional ``update_many``, so concurrent workers
+    never process the same subscription. Order ids are derived from the
+    subscription and delivery date, which makes a retried batch idempotent
+    against the unique ``orders.id`` index.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._loop = BackgroundLoop("Subscription scheduler run", self.run_once, SUBSCRIPTION_SCHEDULER_INTERVAL)
+        self.runs = 0
+        self.claimed = 0
+        self.orders_created = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.last_run: dict = {}
+
+    @property
+    def collection(self):
+        return db.subscriptions
+
+    def _due_query(self, now: datetime) -> dict:
+        return {
+            "status": "active",
+            "next_delivery": {"$lte": now},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}],
+        }
+
+    async def _claim_batch(self, now: datetime, batch_size: int) -> List[dict]:
+        candidates = await self.collection.find(self._due_query(now), {"_id": 0, "id": 1}).sort(
+            "next_delivery", ASCENDING
+        ).limit(batch_size).to_list(None)
+        if not candidates:
+            return []
+        token = f"{self.worker_id}:{uuid.uuid4().hex}"
+        await self.collection.update_many(
+            {**self._due_query(now), "id": {"$in": [doc['id'] for doc in candidates]}},
+            {"$set": {"lease_token": token, "lease_until": now + timedelta(seconds=SUBSCRIPTION_LEASE_SECONDS)}},
+        )
+        return await self.collection.find({"lease_token": token}, {"_id": 0}).to_list(None)
+
+    @staticmethod
+    async def _last_order_addresses(user_ids: List[str]) -> Dict[str, dict]:
+        """Shipping address of each user's most recent order that has one."""
+        async def last_address(user_id: str) -> Optional[dict]:
+            order = await db.orders.find_one(
+                {"user_id": user_id, "shipping_address": {"$nin": [None, {}]}},
+                {"_id": 0, "shipping_address": 1},
+                sort=[("created_at", DESCENDING), ("id", DESCENDING)],
+            )
+            return order['shipping_address'] if order else None
+        
+        addresses = await asyncio.gather(*(last_address(user_id) for user_id in user_ids))
+        return {user_id: address for user_id, address in zip(user_ids, addresses) if address}
+
+    async def _process_batch(self, subscriptions: List[dict], now: datetime) -> dict:
+        blend_ids = list({sub['custom_blend_id'] for sub in subscriptions})
+        blends = {
+            doc['id']: doc
+            async for doc in db.custom_blends.find({"id": {"$in": blend_ids}}, BLEND_PRICING_FIELDS)
+        }
+        fallback_addresses = await self._last_order_addresses(
+            list({sub['user_id'] for sub in subscriptions if not sub.get('shipping_address')})
+        )
+        blend_docs = list(blends.values())
+        prices = dict(zip([doc['id'] for doc in blend_docs], pricing_engine.quote_blends(blend_docs).tolist()))
+        shipping = (await get_shipping_rates())[0]
+        
+        orders = []
+        updates = []
+        max_lag = 0.0
+        for sub in subscriptions:
+            due = parse_datetime(sub['next_delivery'])
+            max_lag = max(max_lag, (now - due).total_seconds())
+            advance = SUBSCRIPTION_FREQUENCIES.get(sub.get('frequency'))
+            blend = blends.get(sub['custom_blend_id'])
+            shipping_address = sub.get('shipping_address') or fallback_addresses.get(sub['user_id'])
+            if blend is None or advance is None or not shipping_address:
+                self.errors += 1
+                if blend is None:
+                    reason = "Custom blend not found"
+                elif advance is None:
+                    reason = f"Unknown frequency {sub.get('frequency')}"
+                else:
+                    reason = "No shipping address on the subscription or a previous order"
+                updates.append(UpdateOne(
+                    {"id": sub['id'], "lease_token": sub['lease_token']},
+                    {"$set": {"status": "paused", "last_error": reason}, "$unset": {"lease_token": "", "lease_until": ""}},
+                ))
+                continue
+            
+            price = prices[blend['id']]
+            order = Order(
+                id=str(uuid.uuid5(SUBSCRIPTION_ORDER_NAMESPACE, f"{sub['id']}:{due.isoformat()}")),
+                user_id=sub['user_id'],
+                items=[OrderLine(custom_blend_id=blend['id'], name=blend['name'], quantity=1, price=price, line_total=price)],
+                subtotal=price,
+                shipping_cost=shipping['rate'],
+                total_amount=round(price + shipping['rate'], 2),
+                shipping_address=shipping_address,
+                subscription_id=sub['id'],
+            )
+            orders.append(orders_repo.encode(order))
+            
+            # Missed periods are skipped rather than back-filled with extra orders
+            next_delivery = advance(due)
+            while next_delivery <= now:
+                next_delivery = advance(next_delivery)
+            updates.append(UpdateOne(
+                {"id": sub['id'], "lease_token": sub['lease_token']},
+                {"$set": {"next_delivery": next_delivery, "last_order_id": order.id, "shipping_address": shipping_address},
+                 "$unset": {"lease_token": "", "lease_until": "", "last_error": ""}},
+            ))
+        
+        failed_indexes = set()
+        if orders:
+            try:
+                await db.orders.insert_many(orders, ordered=False)
+            except BulkWriteError as e:
+                write_errors = e.details.get('writeErrors', [])
+                if any(err.get('code') != 11000 for err in write_errors):
+                    raise
+                # Orders from an earlier, interrupted attempt at this batch
+                failed_indexes = {err['index'] for err in write_errors}
+                self.duplicates += len(failed_indexes)
+        inserted = [order for index, order in enumerate(orders) if index not in failed_indexes]
+        if inserted:
+            await sales_rollups.record_orders(inserted)
+        if updates:
+            await self.collection.bulk_write(updates, ordered=False)
+        return {"orders": len(inserted), "max_lag_seconds": max_lag}
+
+    async def run_once(self, now: Optional[datetime] = None, max_subscriptions: Optional[int] = None) -> dict:
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        claimed = created = 0
+        max_lag = 0.0
+        while max_subscriptions is None or claimed < max_subscriptions:
+            batch_size = SUBSCRIPTION_BATCH_SIZE
+            if max_subscriptions is not None:
+                batch_size = min(batch_size, max_subscriptions - claimed)
+            batch = await self._claim_batch(now, batch_size)
+            if not batch:
+                break
+            claimed += len(batch)
+            result = await self._process_batch(batch, now)
+            created += result["orders"]
+            max_lag = max(max_lag, result["max_lag_seconds"])
+        
+        seconds = time.perf_counter() - started
+        self.runs += 1
+        self.claimed += claimed
+        self.orders_created += created
+        self.last_run = {
+            "at": now.isoformat(),
+            "claimed": claimed,
+            "orders": created,
+            "seconds": round(seconds, 3),
+            "orders_per_second": round(created / seconds, 1) if seconds else 0.0,
+            "max_lag_seconds": round(max_lag, 1),
+        }
+        return self.last_run
+
+    async def backlog(self) -> dict:
+        now = datetime.now(timezone.utc)
+        oldest = await self.collection.find_one(
+            {"status": "active", "next_delivery": {"$lte": now}}, {"_id": 0, "next_delivery": 1}, sort=[("next_delivery", ASCENDING)]
+        )
+        due = await self.collection.count_documents({"status": "active", "next_delivery": {"$lte": now}})
+        lag = (now - parse_datetime(oldest['next_delivery'])).total_seconds() if oldest else 0.0
+        return {"due": due, "lag_seconds": round(lag, 1)}
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "runs": self.runs,
+            "claimed": self.claimed,
+            "orders_created": self.orders_created,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "last_run": self.last_run,
+        }
+
+subscription_scheduler = SubscriptionScheduler()
+
+# ============ INVENTORY ============
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids: List[str]):
+        super().__init__(f"Insufficient stock for {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+class StockLedger:
+    """Stock counts for limited products, reserved with conditional ``$inc``.
+
+    A product is stock-tracked once it has documents in ``inventory``; all
+    other products are unlimited. Its available quantity is split across
+    one or more shard documents, and a reservation decrements a shard only
+    if that shard still holds enough (``available >= quantity``), so
+    concurrent checkouts can never drive a count below zero. Giving a hot
+    product several shards spreads a drop's writes over several documents
+    instead of serializing every checkout on one.
+    
+    Each order's holds are recorded in ``stock_reservations``. They are
+    committed when the payment succeeds, released when it fails, and
+    released by the sweeper once ``expires_at`` passes.
+    """
+
+    def __init__(self):
+        self._loop = BackgroundLoop("Stock reservation sweep", self._sweep_all, STOCK_SWEEP_INTERVAL)
+        self.reserved = 0
+        self.rejected = 0
+        self.committed = 0
+        self.released = 0
+        self.expired = 0
+        self.shard_conflicts = 0
+        # Bumped when this worker sets a product's stock, so search re-reads what has sold out
+        self.version = 0
+
+    @staticmethod
+    async def shards(product_ids: List[str]) -> Dict[str, List[dict]]:
+        grouped: Dict[str, List[dict]] = {}
+        projection = {"_id": 0, "product_id": 1, "shard": 1, "available": 1}
+        async for doc in db.inventory.find({"product_id": {"$in": product_ids}}, projection):
+            grouped.setdefault(doc['product_id'], []).append(doc)
+        return grouped
+
+    async def available(self, product_ids: List[str]) -> Dict[str, int]:
+        shards = await self.shards(product_ids)
+        return {product_id: sum(shard['available'] for shard in docs) for product_id, docs in shards.items()}
+
+    @staticmethod
+    async def sold_out() -> set:
+        """Ids of stock-tracked products with nothing left to reserve."""
+        # inventory holds a few shards per tracked product, so reading it whole stays cheap
+        totals: Dict[str, int] = {}
+        async for doc in db.inventory.find({}, {"_id": 0, "product_id": 1, "available": 1}):
+            totals[doc['product_id']] = totals.get(doc['product_id'], 0) + doc['available']
+        return {product_id for product_id, available in totals.items() if available <= 0}
+
+    async def _take(self, product_id: str, shards: List[dict], quantity: int) -> Optional[List[dict]]:
+        """Decrement ``quantity`` across the product's shards; None (holding nothing) if short."""
+        # Usually one shard covers the whole line; start at a random one so buyers spread out
+        start = random.randrange(len(shards)) if shards else 0
+        for shard in shards[start:] + shards[:start]:
+            if shard['available'] < quantity:
+                continue
+            result = await db.inventory.update_one(
+                {"product_id": product_id, "shard": shard['shard'], "available": {"$gte": quantity}},
+                {"$inc": {"available": -quantity}},
+            )
+            if result.modified_count:
+                return [{"product_id": product_id, "shard": shard['shard'], "quantity": quantity}]
+            self.shard_conflicts += 1
+        
+        # Otherwise gather it from several shards, using fresh counts
+        taken, remaining = [], quantity
+        try:
+            fresh = await db.inventory.find(
+                {"product_id": product_id, "available": {"$gt": 0}}, {"_id": 0, "shard": 1, "available": 1}
+            ).sort("available", DESCENDING).to_list(None)
+            for shard in fresh:
+                part = min(shard['available'], remaining)
+                result = await db.inventory.update_one(
+                    {"product_id": product_id, "shard": shard['shard'], "available": {"$gte": part}},
+                    {"$inc": {"available": -part}},
+                )
+                if not result.modified_count:
+                    self.shard_conflicts += 1
+                    continue
+                taken.append({"product_id": product_id, "shard": shard['shard'], "quantity": part})
+                remaining -= part
+                if not remaining:
+                    return taken
+        except Exception:
+            await self._give_back(taken)
+            raise
+        await self._give_back(taken)
+        return None
+
+    @staticmethod
+    async def _give_back(parts: List[dict]):
+        if parts:
+            # Upsert in case an admin re-sharded the product in the meantime
+            await db.inventory.bulk_write([
+                UpdateOne({"product_id": part['product_id'], "shard": part['shard']},
+                          {"$inc": {"available": part['quantity']}}, upsert=True)
+                for part in parts
+            ], ordered=False)
+
+    async def reserve(self, order_id: str, quantities: Dict[str, int]) -> Optional[dict]:
+        """Hold stock for an order's tracked products, all or nothing."""
+        # A non-positive hold would add stock back instead of taking it
+        invalid = {product_id: quantity for product_id, quantity in quantities.items() if quantity < 1}
+        if invalid:
+            raise ValueError(f"Reservation quantities must be at least 1: {invalid}")
+        shards = await self.shards(list(quantities))
+        if not shards:
+            return None
+        taken = []
+        try:
+            for product_id, quantity in quantities.items():
+                if product_id not in shards:
+                    continue
+                parts = await self._take(product_id, shards[product_id], quantity)
+                if parts is None:
+                    self.rejected += 1
+                    raise InsufficientStock([product_id])
+                taken.extend(parts)
+        except Exception:
+            await self._give_back(taken)
+            raise
+        
+        now = datetime.now(timezone.utc)
+        reservation = {
+            "id": str(uuid.uuid4()),
+            "order_id": order_id,
+            "lines": taken,
+            "status": "held",
+            "expires_at": now + timedelta(seconds=STOCK_RESERVATION_TTL),
+            "created_at": now,
+        }
+        try:
+            await db.stock_reservations.insert_one(reservation)
+        except Exception:
+            await self._give_back(taken)
+            raise
+        self.reserved += 1
+        return reservation
+
+    async def release(self, order_id: str, reason: str) -> bool:
+        reservation = await db.stock_reservations.find_one_and_update(
+            {"order_id": order_id, "status": "held"},
+            {"$set": {"status": "released", "release_reason": reason, "released_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0, "lines": 1},
+        )
+        if reservation is None:
+            return False
+        await self._give_back(reservation['lines'])
+        self.released += 1
+        return True
+
+    async def commit(self, order_id: str):
+        before = await db.stock_reservations.find_one_and_update(
+            {"order_id": order_id, "status": {"$in": ["held", "released"]}},
+            {"$set": {"status": "committed", "committed_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0, "status": 1, "lines": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            return
+        self.committed += 1
+        if before['status'] != "released":
+            return
+        
+        # Paid after the hold expired: take the stock again while it lasts
+        quantities: Dict[str, int] = {}
+        for part in before['lines']:
+            quantities[part['product_id']] = quantities.get(part['product_id'], 0) + part['quantity']
+        shards = await self.shards(list(quantities))
+        taken = []
+        for product_id, quantity in quantities.items():
+            parts = await self._take(product_id, shards.get(product_id, []), quantity)
+            if parts is None:
+                logger.error(f"Order {order_id} was paid after its stock hold expired; {product_id} is oversold by {quantity}")
+            else:
+                taken.extend(parts)
+        await db.stock_reservations.update_one({"order_id": order_id}, {"$set": {"lines": taken}})
+
+    async def set_stock(self, product_id: str, stock: Optional[int], shard_count: int) -> Dict[str, int]:
+        """Set a product's available quantity, spread evenly over ``shard_count`` shards.
+
+        Each shard is compare-and-set against the count just read, so a
+        concurrent checkout makes the write retry rather than be lost in it.
+        ``stock=None`` stops tracking the product.
+        """
+        self.version += 1
+        if stock is None:
+            await db.inventory.delete_many({"product_id": product_id})
+            return {}
+        targets = [stock // shard_count + (1 if shard < stock % shard_count else 0) for shard in range(shard_count)]
+        for _ in range(10):
+            current = {doc['shard']: doc['available'] for doc in (await self.shards([product_id])).get(product_id, [])}
+            operations = []
+            for shard, target in enumerate(targets):
+                if shard in current:
+                    operations.append(UpdateOne({"product_id": product_id, "shard": shard, "available": current[shard]},
+                                                {"$set": {"available": target}}))
+                else:
+                    operations.append(UpdateOne({"product_id": product_id, "shard": shard},
+                                                {"$setOnInsert": {"available": target}}, upsert=True))
+            operations.extend(
+                DeleteOne({"product_id": product_id, "shard": shard, "available": available})
+                for shard, available in current.items() if shard >= shard_count
+            )
+            result = await db.inventory.bulk_write(operations, ordered=False)
+            if result.matched_count + result.upserted_count + result.deleted_count >= len(operations):
+                break
+        return await self.available([product_id])
+
+    async def sweep(self, now: Optional[datetime] = None) -> int:
+        """Release holds whose order was neither paid nor failed before ``expires_at``."""
+        now = now or datetime.now(timezone.utc)
+        expired = await db.stock_reservations.find(
+            {"status": "held", "expires_at": {"$lte": now}}, {"_id": 0, "order_id": 1}
+        ).sort("expires_at", ASCENDING).limit(STOCK_SWEEP_BATCH_SIZE).to_list(None)
+        released = 0
+        for reservation in expired:
+            if await self.release(reservation['order_id'], "expired"):
+                released += 1
+        self.expired += released
+        return released
+
+    async def _sweep_all(self):
+        while await self.sweep() == STOCK_SWEEP_BATCH_SIZE:
+            pass
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+
+    def stats(self) -> dict:
+        return {
+            "reserved": self.reserved,
+            "rejected": self.rejected,
+            "committed": self.committed,
+            "released": self.released,
+            "expired": self.expired,
+            "shard_conflicts": self.shard_conflicts,
+        }
+
+stock_ledger = StockLedger()
+
+@api_router.get("/inventory")
+async def get_inventory(product_id: List[str] = Query([])):
+    """Available quantity of each stock-tracked product among ``product_id``; others are unlimited."""
+    return {"stock": await stock_ledger.available(product_id[:PRODUCT_PAGE_MAX])}
+
+@api_router.get("/admin/inventory/{product_id}")
+async def get_product_inventory(product_id: str, admin_user: User = Depends(get_admin_user)):
+    shards = (await stock_ledger.shards([product_id])).get(product_id, [])
+    held = await db.stock_reservations.count_documents({"status": "held", "lines.product_id": product_id})
+    return {
+        "product_id": product_id,
+        "stock": sum(shard['available'] for shard in shards) if shards else None,
+        "shards": sorted(shards, key=lambda shard: shard['shard']),
+        "held_reservations": held,
+    }
+
+@api_router.put("/admin/inventory/{product_id}")
+async def update_product_inventory(product_id: str, inventory_input: InventoryUpdate, admin_user: User = Depends(get_admin_user)):
+    if await products_repo.collection.count_documents({"id": product_id}, limit=1) == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
+    stock = await stock_ledger.set_stock(product_id, inventory_input.stock, inventory_input.shards)
+    return {"product_id": product_id, "stock": stock.get(product_id), "shards": inventory_input.shards}
+
+# ============ ORDER ROUTES ============
+
+@api_router.post("/orders", response_model=Order)
+async def create_order(order_input: OrderCreate, current_user: Optional[User] = Depends(get_optional_user)):
+    if current_user is None and not order_input.guest_email:
+        raise HTTPException(status_code=400, detail="guest_email is required for guest checkout")
+    
+    user_id = current_user.id if current_user else None
+    (lines,), rates = await asyncio.gather(price_carts([[item.model_dump() for item in order_input.items]], user_id), get_shipping_rates())
+    if not lines:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    unavailable = [line.name for line in lines if not line.available]
+    if unavailable:
+        raise HTTPException(status_code=400, detail=f"Unavailable items: {', '.join(unavailable)}")
+    
+    rate = next((r for r in rates if r['id'] == order_input.shipping_rate_id), rates[0])
+    subtotal = round(sum(line.line_total for line in lines), 2)
+    order = Order(
+        user_id=user_id or f"guest:{order_input.guest_email}",
+        items=[OrderLine(**line.model_dump()) for line in lines],
+        subtotal=subtotal,
+        shipping_cost=rate['rate'],
+        total_amount=round(subtotal + rate['rate'], 2),
+        shipping_address=order_input.shipping_address,
+    )
+    
+    quantities: Dict[str, int] = {}
+    for line in lines:
+        if line.product_id:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+    try:
+        await stock_ledger.reserve(order.id, quantities)
+    except InsufficientStock as e:
+        names = [line.name for line in lines if line.product_id in e.product_ids]
+        raise HTTPException(status_code=409, detail=f"Not enough stock: {', '.join(names)}")
+    try:
+        await orders_repo.insert(order)
+    except Exception:
+        await stock_ledger.release(order.id, "order_failed")
+        raise
+    await sales_rollups.record_order(order.model_dump())
+    await send_email_notification(
+        f"New order {order.id}",
+        f"<p>{len(lines)} line(s), total ${order.total_amount:.2f}</p>",
+        digest=True,
+    )
+    return fast_response(order)
+
+ORDER_STATUSES = {"pending", "processing", "shipped", "delivered", "cancelled"}
+FULFILLED_ORDER_STATUSES = ["delivered", "cancelled"]
+
+async def list_orders(collection, query: dict, cursor: Optional[str], limit: Optional[int], fields: Optional[str]) -> Response:
+    """One newest-first page of orders; the next page's cursor goes in ``X-Next-Cursor``."""
+    limit = min(limit or ORDER_PAGE_SIZE, ORDER_PAGE_MAX)
+    query = {**query, **keyset_filter(cursor, descending=True)}
+    # One extra document tells us whether there is a next page
+    orders = await collection.find(query, model_projection(Order, fields)).sort(
+        [("created_at", DESCENDING), ("id", DESCENDING)]
+    ).limit(limit + 1).to_list(None)
+    headers = {}
+    if len(orders) > limit:
+        orders = orders[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(orders[-1]['created_at'], orders[-1]['id'])
+    return Response(content=dumps_json([orders_repo.decode(order) for order in orders]),
+                    media_type="application/json", headers=headers)
+
+@api_router.get("/orders", response_model=List[Order])
+async def get_orders(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    archived: bool = False,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+):
+    """The current user's orders, newest first, ``limit`` per page.
+
+    Recent orders come from ``orders``; pass ``archived=true`` to page
+    through fulfilled orders the archiver has moved to ``orders_archive``.
+    """
+    collection = db.orders_archive if archived else db.orders
+    return await list_orders(collection, {"user_id": current_user.id}, cursor, limit, fields)
+
+@api_router.get("/orders/{order_id}", response_model=Order)
+async def get_order(order_id: str, current_user: User = Depends(get_current_user)):
+    query = {"id": order_id}
+    if not current_user.is_admin:
+        query["user_id"] = current_user.id
+    order = await orders_repo.collection.find_one(query, orders_repo.projection)
+    if order is None:
+        order = await db.orders_archive.find_one(query, orders_repo.projection)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return fast_response(orders_repo.to_model(order))
+
+@api_router.get("/admin/orders", response_model=List[Order])
+async def get_all_orders(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    status: Optional[str] = None,
+    user_id: Optional[str] = None,
+    archived: bool = False,
+    fields: Optional[str] = None,
+    admin_user: User = Depends(get_admin_user),
+):
+    query = {}
+    if status is not None:
+        if status not in ORDER_STATUSES:
+            raise HTTPException(status_code=400, detail="Invalid status")
+        query["status"] = status
+    if user_id is not None:
+        query["user_id"] = user_id
+    # Reporting reads, so they go to a secondary; shoppers' own orders are read from the primary
+    source = secondary_db()
+    collection = source.orders_archive if archived else source.orders
+    return await list_orders(collection, query, cursor, limit, fields)
+
+class OrderArchiver:
+    """Moves fulfilled orders older than ``ORDER_ARCHIVE_AFTER_DAYS`` to ``orders_archive``.
+
+    Keeping ``orders`` down to recent and open orders keeps its indexes
+    small and hot. Each batch is copied before it is deleted, and the delete
+    repeats the status/age filter: an order whose status changed in between
+    stays live and its archive copy is removed again. A batch interrupted
+    after the copy is simply copied again, the unique id index absorbing
+    the duplicates.
+    """
+
+    def __init__(self):
+        self._loop = BackgroundLoop("Order archive run", self.run_once, ORDER_ARCHIVE_INTERVAL)
+        self.runs = 0
+        self.archived = 0
+        self.duplicates = 0
+        self.kept_live = 0
+        self.last_run: dict = {}
+
+    @staticmethod
+    def _archivable(cutoff: datetime) -> dict:
+        return {"status": {"$in": FULFILLED_ORDER_STATUSES}, "created_at": {"$lt": cutoff}}
+
+    async def _archive_batch(self, cutoff: datetime, batch_size: int) -> tuple:
+        """(orders selected, orders moved) for one batch."""
+        query = self._archivable(cutoff)
+        orders = await db.orders.find(query, {"_id": 0}).sort(
+            [("created_at", ASCENDING), ("id", ASCENDING)]
+        ).limit(batch_size).to_list(None)
+        if not orders:
+            return 0, 0
+        archived_at = datetime.now(timezone.utc)
+        try:
+            await db.orders_archive.insert_many([{**order, "archived_at": archived_at} for order in orders], ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            if any(err.get('code') != 11000 for err in write_errors):
+                raise
+            self.duplicates += len(write_errors)
+        
+        ids = [order['id'] for order in orders]
+        result = await db.orders.delete_many({**query, "id": {"$in": ids}})
+        if result.deleted_count < len(ids):
+            live = await db.orders.distinct("id", {"id": {"$in": ids}})
+            await db.orders_archive.delete_many({"id": {"$in": live}})
+            self.kept_live += len(live)
+        return len(orders), result.deleted_count
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(days=ORDER_ARCHIVE_AFTER_DAYS)
+        started = time.perf_counter()
+        archived = 0
+        while True:
+            # Orders kept live no longer match the filter, so a full batch means more may remain
+            selected, moved = await self._archive_batch(cutoff, ORDER_ARCHIVE_BATCH_SIZE)
+            archived += moved
+            if selected < ORDER_ARCHIVE_BATCH_SIZE:
+                break
+        self.runs += 1
+        self.archived += archived
+        self.last_run = {
+            "at": now.isoformat(),
+            "cutoff": cutoff.isoformat(),
+            "archived": archived,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        return self.last_run
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+
+    def stats(self) -> dict:
+        return {
+            "after_days": ORDER_ARCHIVE_AFTER_DAYS,
+            "runs": self.runs,
+            "archived": self.archived,
+            "duplicates": self.duplicates,
+            "kept_live": self.kept_live,
+            "last_run": self.last_run,
+        }
+
+order_archiver = OrderArchiver()
+
+@api_router.patch("/admin/orders/{order_id}", response_model=Order)
+async def update_order_status(order_id: str, status: str, admin_user: User = Depends(get_admin_user)):
+    if status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    before = await db.orders.find_one_and_update(
+        {"id": order_id},
+        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    after = {**before, "status": status}
+    await sales_rollups.record_status_change(before, after)
+    return fast_response(orders_repo.to_model(after))
+
+@api_router.get("/admin/stats")
+async def get_sales_stats(
+    days: int = Query(30, ge=1, le=366),
+    hours: int = Query(48, ge=1, le=24 * 14),
+    top: int = Query(10, ge=1, le=100),
+    admin_user: User = Depends(get_admin_user),
+):
+    return fast_response(await sales_rollups.stats(days=days, hours=hours, top=top))
+
+@api_router.get("/admin/subscriptions/scheduler")
+async def get_scheduler_stats(admin_user: User = Depends(get_admin_user)):
+    return {**subscription_scheduler.stats(), "backlog": await subscription_scheduler.backlog()}
+
+@api_router.post("/admin/subscriptions/scheduler/run")
+async def run_scheduler(admin_user: User = Depends(get_admin_user)):
+    return await subscription_scheduler.run_once()
+
+@api_router.get("/admin/orders/archiver")
+async def get_order_archiver_stats(admin_user: User = Depends(get_admin_user)):
+    return order_archiver.stats()
+
+@api_router.post("/admin/orders/archiver/run")
+async def run_order_archiver(admin_user: User = Depends(get_admin_user)):
+    return await order_archiver.run_once()
+
+# ============ CATALOG IMPORT / EXPORT ============
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+# A quoted CSV field may span lines, but no further than this
+IMPORT_MAX_RECORD_LINES = int(os.environ.get('IMPORT_MAX_RECORD_LINES', '50'))
+IMPORT_MAX_RECORD_CHARS = int(os.environ.get('IMPORT_MAX_RECORD_CHARS', str(64 * 1024)))
+PRODUCT_EXPORT_FIELDS = list(Product.model_fields)
+
+async def iter_request_lines(request: Request):
+    """Yield decoded lines from the request body as it arrives."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+class CsvRecordSplitter:
+    """Joins CSV lines into records, keeping reading while quotes are unbalanced.
+
+    A record may span at most ``IMPORT_MAX_RECORD_LINES`` lines and
+    ``IMPORT_MAX_RECORD_CHARS`` characters. Past that, or at the end of the
+    body, its first line is reported as an unterminated quoted field and
+    the lines after it are read again as records of their own, so one
+    stray quote costs one row instead of the rest of the upload.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.lines: List[str] = []
+        self.quotes = 0
+        self.chars = 0
+
+    def _give_up(self, queue: deque) -> ValueError:
+        queue.extendleft(reversed(self.lines[1:]))
+        self._reset()
+        return ValueError("Unterminated quoted field")
+
+    def feed(self, line: str):
+        """Yield the records (value lists or errors) completed by ``line``."""
+        queue = deque([line])
+        while queue:
+            line = queue.popleft()
+            self.lines.append(line)
+            self.quotes += line.count('"')
+            self.chars += len(line)
+            if self.quotes % 2 == 0:
+                values = next(csv.reader(io.StringIO("\n".join(self.lines))))
+                self._reset()
+                yield values
+            elif len(self.lines) >= IMPORT_MAX_RECORD_LINES or self.chars >= IMPORT_MAX_RECORD_CHARS:
+                yield self._give_up(queue)
+
+    def close(self):
+        """Yield what is left once the body has ended."""
+        while self.lines:
+            queue = deque()
+            yield self._give_up(queue)
+            for line in queue:
+                yield from self.feed(line)
+
+async def iter_import_rows(request: Request, fmt: str):
+    """Yield (row_number, dict | error) pairs without buffering the whole body."""
+    header = None
+    splitter = CsvRecordSplitter()
+    row_number = 0
+    
+    def csv_row(values):
+        nonlocal header, row_number
+        if isinstance(values, ValueError):
+            row_number += 1
+            return row_number, values
+        if header is None:
+            header = [value.strip() for value in values]
+            return None
+        if not any(values):
+            return None
+        row_number += 1
+        if len(values) != len(header):
+            return row_number, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+        return row_number, {key: value for key, value in zip(header, values) if value != ""}
+    
+    async for line in iter_request_lines(request):
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                yield row_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, ValueError(f"Invalid JSON: {e.msg}")
+            continue
+        
+        for values in splitter.feed(line):
+            row = csv_row(values)
+            if row is not None:
+                yield row
+    for values in splitter.close():
+        row = csv_row(values)
+        if row is not None:
+            yield row
+
+async def write_import_batch(operations: List[UpdateOne]) -> dict:
+    started = time.perf_counter()
+    result = await db.products.bulk_write(operations, ordered=False)
+    return {
+        "rows": len(operations),
+        "upserted": result.upserted_count,
+        "modified": result.modified_count,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+@api_router.post("/admin/products/import")
+async def import_products(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(csv|ndjson)$"),
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=10000),
+    admin_user: User = Depends(get_admin_user),
+):
+    """Stream a CSV or NDJSON catalog in and upsert it by product id in bounded batches."""
+    started = time.perf_counter()
+    batches = []
+    errors = []
+    error_count = 0
+    operations = []
+    rows = 0
+    
+    async for row_number, row in iter_import_rows(request, format):
+        rows += 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            product = ProductImportRow(**row)
+        except (ValueError, TypeError) as e:
+            error_count += 1
+            if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                detail = e.errors(include_url=False, include_input=False) if isinstance(e, ValidationError) else str(e)
+                errors.append({"row": row_number, "error": detail})
+            continue
+        
+        fields = {**product.model_dump(exclude={"id"}), "updated_at": datetime.now(timezone.utc)}
+        product_id = product.id or str(uuid.uuid4())
+        operations.append(UpdateOne(
+            {"id": product_id},
+            {"$set": fields, "$setOnInsert": {"id": product_id, "created_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        ))
+        if len(operations) >= batch_size:
+            batches.append(await write_import_batch(operations))
+            operations = []
+    if operations:
+        batches.append(await write_import_batch(operations))
+    
+    if batches:
+        await cache_bus.publish("products")
+    return {
+        "rows": rows,
+        "imported": sum(batch["rows"] for batch in batches),
+        "upserted": sum(batch["upserted"] for batch in batches),
+        "modified": sum(batch["modified"] for batch in batches),
+        "error_count": error_count,
+        "errors": errors,
+        "batches": batches,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+@api_router.get("/admin/products/export")
+async def export_products(
+    format: str = Query("ndjson", pattern="^(csv|ndjson)$"),
+    admin_user: User = Depends(get_admin_user),
+):
+    """Stream the whole catalog out as CSV or NDJSON, straight from the cursor."""
+    cursor = secondary_db().products.find({}, model_projection(Product, None)).sort([("created_at", 1), ("id", 1)])
+    
+    async def stream_ndjson():
+        async for product in cursor:
+            yield dumps_json(product) + b"\n"
+    
+    async def stream_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=PRODUCT_EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        async for product in cursor:
+            for field in ('created_at', 'updated_at'):
+                if isinstance(product.get(field), datetime):
+                    product[field] = product[field].isoformat()
+            writer.writerow(product)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if format == "csv":
+        return StreamingResponse(stream_csv(), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=products.csv"})
+    return StreamingResponse(stream_ndjson(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": "attachment; filename=products.ndjson"})
+
+# ============ PAYMENTS ============
+
+TERMINAL_PAYMENT_STATUSES = {"paid", "expired", "failed", "canceled"}
+
+_stripe_checkout = None
+
+def stripe_checkout_module():
+    """The Stripe SDK is heavy and only checkout needs it, so it is imported on first use."""
+    global _stripe_checkout
+    if _stripe_checkout is None:
+        from emergentintegrations.payments.stripe import checkout
+        if STRIPE_API_BASE:
+            import stripe
+            stripe.api_base = STRIPE_API_BASE
+        _stripe_checkout = checkout
+    return _stripe_checkout
+
+def get_stripe_checkout(request: Request):
+    webhook_url = f"{str(request.base_url).rstrip('/')}/api/webhook/stripe"
+    return stripe_checkout_module().StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+
+class PaymentStatusService:
+    """Serves checkout status from a local cache or the DB.
+
+    Stripe webhooks push status changes through ``apply``. Polls only reach
+    out to Stripe when the stored status is still open and has not been
+    refreshed for ``PAYMENT_STATUS_STALE_SECONDS``; those calls are
+    coalesced per session and capped at ``STRIPE_MAX_CONCURRENT_CALLS``.
+    """
+
+    def __init__(self):
+        self.cache = TTLCache(10000, PAYMENT_STATUS_CACHE_TTL)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.webhooks = 0
+        self.stripe_calls = 0
+        self.stripe_skipped = 0
+        self.served = {"cache": 0, "db": 0, "stripe": 0}
+
+    async def apply(self, session_id: str, status: str, payment_status: str, source: str) -> Optional[dict]:
+        """Write a status to the transaction and its order in one step.
+
+        A terminal payment status is final: a stale poll that read "unpaid"
+        before the "paid" webhook landed must not overwrite it. Such a
+        write changes nothing and has no side effects.
+        
+        Repeating the status the transaction already holds still goes
+        through to the order, so a retried webhook or poll finishes an
+        earlier attempt that failed after the transaction was written.
+        Stock commits and releases are idempotent, and rollups and email
+        only follow the order's own open-to-terminal change.
+        """
+        now = datetime.now(timezone.utc)
+        still_open = {"$nin": list(TERMINAL_PAYMENT_STATUSES)}
+        open_or_same = {"$nin": list(TERMINAL_PAYMENT_STATUSES - {payment_status})}
+        
+        async def write(session=None):
+            transaction = await db.payment_transactions.find_one_and_update(
+                {"session_id": session_id, "payment_status": open_or_same},
+                {"$set": {"payment_status": payment_status, "status": status, "updated_at": now, "status_source": source}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if transaction is None:
+                return None, None
+            before = await db.orders.find_one_and_update(
+                {"id": transaction['order_id'], "payment_status": still_open},
+                {"$set": {"payment_status": payment_status, "updated_at": now}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.BEFORE,
+                session=session,
+            )
+            return transaction, before
+        
+        if PAYMENT_USE_TRANSACTIONS:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    transaction, before = await write(session)
+        else:
+            transaction, before = await write()
+        if transaction is None:
+            # Unknown session, or already settled otherwise: serve what is stored
+            transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+            if transaction is None:
+                return None
+            result = self._status(transaction)
+            self.cache.set(session_id, result)
+            return result
+        
+        if payment_status == "paid":
+            await stock_ledger.commit(transaction['order_id'])
+        elif status == "expired" or payment_status in TERMINAL_PAYMENT_STATUSES:
+            await stock_ledger.release(transaction['order_id'], "payment_failed")
+        
+        if before is not None and before.get('payment_status') != payment_status:
+            await sales_rollups.record_status_change(before, {**before, "payment_status": payment_status})
+            if payment_status == "paid":
+                await send_email_notification(
+                    f"Payment received for order {before['id']}",
+                    f"<p>${before.get('total_amount', 0):.2f} paid via {transaction.get('payment_method', 'stripe')}</p>",
+                    digest=True,
+                )
+        result = self._status(transaction)
+        # Drop the stale status other workers may be serving, then cache ours
+        await cache_bus.publish("payments", session_id)
+        self.cache.set(session_id, result)
+        return result
+
+    @staticmethod
+    def _status(transaction: dict) -> dict:
+        return {
+            "session_id": transaction['session_id'],
+            "status": transaction.get('status', 'open'),
+            "payment_status": transaction.get('payment_status', 'pending'),
+            "amount_total": transaction.get('amount'),
+            "currency": transaction.get('currency'),
+            "updated_at": parse_datetime(transaction.get('updated_at') or transaction.get('created_at')),
+        }
+
+    async def _refresh_from_stripe(self, request: Request, session_id: str) -> Optional[dict]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(STRIPE_MAX_CONCURRENT_CALLS)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=STRIPE_CALL_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            self.stripe_skipped += 1
+            return None
+        try:
+            self.stripe_calls += 1
+            checkout_status = await get_stripe_checkout(request).get_checkout_status(session_id)
+        finally:
+            self._semaphore.release()
+        return await self.apply(session_id, checkout_status.status, checkout_status.payment_status, "poll")
+
+    async def get(self, request: Request, session_id: str) -> CheckoutStatus:
+        cached = self.cache.get(session_id)
+        if cached is not None:
+            self.served["cache"] += 1
+            return CheckoutStatus(**cached, source="cache")
+        
+        transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+        if transaction is None:
+            raise HTTPException(status_code=404, detail="Checkout session not found")
+        current = self._status(transaction)
+        age = (datetime.now(timezone.utc) - current['updated_at']).total_seconds()
+        if current['payment_status'] in TERMINAL_PAYMENT_STATUSES or age < PAYMENT_STATUS_STALE_SECONDS:
+            self.cache.set(session_id, current)
+            self.served["db"] += 1
+            return CheckoutStatus(**current, source="db")
+        
+        # Stale and still open: one Stripe call per session, however many pollers
+        future = self._in_flight.get(session_id)
+        if future is None:
+            future = asyncio.ensure_future(self._refresh_from_stripe(request, session_id))
+            self._in_flight[session_id] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(session_id, None))
+        try:
+            refreshed = await asyncio.shield(future)
+        except Exception as e:
+            logger.error(f"Stripe status check failed for {session_id}: {str(e)}")
+            refreshed = None
+        if refreshed is None:
+            self.served["db"] += 1
+            return CheckoutStatus(**current, source="db")
+        self.served["stripe"] += 1
+        return CheckoutStatus(**refreshed, source="stripe")
+
+    def stats(self) -> dict:
+        return {
+            "webhooks": self.webhooks,
+            "stripe_calls": self.stripe_calls,
+            "stripe_skipped": self.stripe_skipped,
+            "served": dict(self.served),
+            "cache": self.cache.stats(),
+        }
+
+payment_status_service = PaymentStatusService()
+
+def drop_payment_status(session_id: Optional[str]):
+    if session_id is None:
+        payment_status_service.cache.clear()
+    else:
+        payment_status_service.cache.pop(session_id)
+
+cache_bus.subscribe("payments", drop_payment_status)
+
+@api_router.post("/checkout/session")
+async def create_checkout_session(checkout_input: CheckoutRequest, request: Request):
+    order = await db.orders.find_one({"id": checkout_input.order_id}, {"_id": 0})
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order.get('payment_status') == "paid":
+        raise HTTPException(status_code=400, detail="Order is already paid")
+    
+    origin_url = checkout_input.origin_url.rstrip('/')
+    checkout_request = stripe_checkout_module().CheckoutSessionRequest(
+        amount=float(order['total_amount']),
+        currency="usd",
+        success_url=f"{origin_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}",
+        cancel_url=f"{origin_url}/checkout/cancel",
+        metadata={"order_id": order['id'], "user_id": order['user_id']},
+    )
+    session = await get_stripe_checkout(request).create_checkout_session(checkout_request)
+    
+    transaction = PaymentTransaction(
+        user_id=order['user_id'],
+        order_id=order['id'],
+        session_id=session.session_id,
+        amount=float(order['total_amount']),
+        currency="usd",
+        payment_method=checkout_input.payment_method,
+        metadata=checkout_request.metadata,
+    )
+    await payment_transactions_repo.insert(transaction, status="open")
+    await db.orders.update_one(
+        {"id": order['id']},
+        {"$set": {"session_id": session.session_id, "payment_method": checkout_input.payment_method}},
+    )
+    return {"url": session.url, "session_id": session.session_id}
+
+@api_router.get("/checkout/status/{session_id}", response_model=CheckoutStatus)
+async def get_checkout_status(session_id: str, request: Request):
+    return fast_response(await payment_status_service.get(request, session_id))
+
+@api_router.post("/webhook/stripe")
+async def stripe_webhook(request: Request):
+    body = await request.body()
+    try:
+        event = await get_stripe_checkout(request).handle_webhook(body, request.headers.get("Stripe-Signature"))
+    except Exception as e:
+        logger.error(f"Rejected Stripe webhook: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
+    payment_status_service.webhooks += 1
+    status = "complete" if event.payment_status == "paid" else getattr(event, "status", None) or "open"
+    if event.event_type == "checkout.session.expired":
+        status = "expired"
+    await payment_status_service.apply(event.session_id, status, event.payment_status, "webhook")
+    return {"received": True}
+
+# ============ ADMIN ROUTES ============
+
+@api_router.get("/admin/runtime-stats")
+async def get_runtime_stats(admin_user: User = Depends(get_admin_user)):
+    return {
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "password_pool": password_pool.stats(),
+        "auth_rate_limits": {"ip": auth_ip_limiter.stats(), "email": auth_email_limiter.stats()},
+        "catalog": catalog_snapshot.stats(),
+        "search": catalog_search.stats(),
+        "images": product_images.stats(),
+        "email_outbox": email_outbox.stats(),
+        "cache_bus": cache_bus.stats(),
+        "payments": payment_status_service.stats(),
+        "order_archiver": order_archiver.stats(),
+        "stock": stock_ledger.stats(),
+        "read_routing": read_routing.stats(),
+    }
+
+@api_router.get("/admin/settings", response_model=AdminSettings)
+async def get_settings(admin_user: User = Depends(get_admin_user)):
+    return fast_response(AdminSettings(**await get_admin_settings()))
+
+@api_router.put("/admin/settings", response_model=AdminSettings)
+async def update_settings(settings_input: AdminSettingsUpdate, admin_user: User = Depends(get_admin_user)):
+    changes = settings_input.model_dump(exclude_none=True)
+    changes['updated_at'] = datetime.now(timezone.utc)
+    settings_data = await db.admin_settings.find_one_and_update(
+        {"id": "admin_settings"},
+        {"$set": changes},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    await invalidate_admin_settings()
+    # Pooled connections may be authenticated with the old credentials
+    await asyncio.to_thread(smtp_pool.close_all)
+    return fast_response(AdminSettings(**settings_data))
+
+@api_router.get("/admin/query-audit")
+async def get_query_audit(admin_user: User = Depends(get_admin_user)):
+    if QUERY_PLAN_AUDIT not in ('true', 'strict'):
+        raise HTTPException(status_code=404, detail="Query plan audit is disabled")
+    violations = await query_auditor.audit(client)
+    return {"ok": not violations, "queries": len(query_auditor.commands), "violations": violations}
+
+# ============ HEALTH ============
+
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "ok", "uptime_seconds": round(time.time() - startup_state["started_at"], 1)}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Ready once startup has finished and Mongo answers a ping within MONGO_READY_TIMEOUT."""
+    if client is None or startup_state["ready_at"] is None:
+        raise HTTPException(status_code=503, detail="Starting up")
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=MONGO_READY_TIMEOUT)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Mongo unavailable: {str(e)}")
+    return {
+        "status": "ready",
+        "startup_seconds": round(startup_state["ready_at"] - startup_state["started_at"], 3),
+        "warmup_ms": startup_state["warmup_ms"],
+    }
+
+# ============ METRICS ============
+
+class MetricsMiddleware:
+    """Per-route latency histograms, in-flight requests and Mongo round trips per request."""
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths: Optional[dict] = None
+        self.in_flight_count = 0
+        self.latency = metrics.histogram(
+            "http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+        self.in_flight = metrics.gauge("http_requests_in_flight", "Requests currently being served")
+        self.round_trips = metrics.histogram(
+            "http_request_mongo_commands", "Mongo commands issued per request", ("method", "route"), ROUND_TRIP_BUCKETS)
+        self.mongo_commands = metrics.counter(
+            "mongo_commands_total", "Mongo commands issued while serving requests", ("route", "command", "collection"))
+        self.mongo_seconds = metrics.counter(
+            "mongo_command_seconds_total", "Mongo time spent while serving requests", ("route", "command", "collection"))
+
+    def route_for(self, scope) -> str:
+        # Label by route template rather than raw path to keep cardinality bounded
+        if self.route_paths is None:
+            self.route_paths = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        trace = RequestTrace()
+        token = request_trace.set(trace)
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        self.in_flight_count += 1
+        self.in_flight.set(value=self.in_flight_count)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_trace.reset(token)
+            self.in_flight_count -= 1
+            self.in_flight.set(value=self.in_flight_count)
+            self.record(scope, status, elapsed, trace)
+
+    def record(self, scope, status: int, elapsed: float, trace: RequestTrace):
+        method = scope["method"]
+        route = self.route_for(scope)
+        self.latency.observe(method, route, f"{status // 100}xx", value=elapsed)
+        self.round_trips.observe(method, route, value=len(trace.commands))
+        breakdown = trace.breakdown()
+        for (command, collection), (count, seconds) in breakdown.items():
+            self.mongo_commands.inc(route, command, collection, amount=count)
+            self.mongo_seconds.inc(route, command, collection, amount=seconds)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            queries = ", ".join(
+                f"{command} {collection} x{count} {seconds * 1000:.1f}ms"
+                for (command, collection), (count, seconds) in sorted(breakdown.items(), key=lambda item: -item[1][1])
+            )
+            logger.warning(
+                f"Slow request {method} {route} -> {status} in {elapsed * 1000:.0f}ms, "
+                f"{len(trace.commands)} Mongo commands: {queries or 'none'}"
+            )
+
+@api_router.get("/metrics")
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus text exposition of the request and Mongo metrics."""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Continue with rest of routes...
+
+app.include_router(api_router)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
-# Continue with rest of routes...
\ No newline at end of file
+app.add_middleware(
+    CORSMiddleware,
+    allow_credentials=True,
+    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
+)
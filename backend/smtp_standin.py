@@ -0,0 +1,112 @@
+"""Local stand-in SMTP server for exercising the email outbox.
+
+Speaks just enough SMTP (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, NOOP,
+RSET, QUIT) for smtplib, accepts any credentials and prints or stores every
+message it receives. It does not advertise STARTTLS, so run the app with
+SMTP_ALLOW_PLAINTEXT=true to let the outbox talk to it in plain text.
+Point the admin settings at it:
+
+    python smtp_standin.py --port 2525 [--fail-every 3] [--delay 0.5]
+
+then set smtp_host=localhost, smtp_port=2525 and any username/password.
+"""
+import argparse
+import asyncio
+import base64
+
+
+class StandInSMTPServer:
+    def __init__(self, fail_every=0, delay=0.0, quiet=False):
+        self.fail_every = fail_every
+        self.delay = delay
+        self.quiet = quiet
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self._received = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+
+        async def reply(line):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 standin ESMTP ready")
+        mail_from, rcpt_to = None, []
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                verb = line.split(" ", 1)[0].upper()
+                if verb in ("EHLO", "HELO"):
+                    writer.write(b"250-standin\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                    await writer.drain()
+                elif verb == "AUTH":
+                    parts = line.split()
+                    if parts[1].upper() == "LOGIN":
+                        await reply("334 " + base64.b64encode(b"Username:").decode())
+                        await reader.readline()
+                        await reply("334 " + base64.b64encode(b"Password:").decode())
+                        await reader.readline()
+                    elif len(parts) < 3:
+                        await reply("334 ")
+                        await reader.readline()
+                    self.logins += 1
+                    await reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, rcpt_to = line[10:].strip(), []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt_to.append(line[8:].strip())
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        data_line = (await reader.readline()).decode(errors="replace")
+                        if data_line in (".\r\n", ".\n", ""):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith("..") else data_line)
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    self._received += 1
+                    if self.fail_every and self._received % self.fail_every == 0:
+                        await reply("451 4.3.0 Simulated temporary failure")
+                        continue
+                    self.messages.append({"from": mail_from, "to": rcpt_to, "data": "".join(lines)})
+                    if not self.quiet:
+                        print(f"📧 message #{len(self.messages)} from {mail_from} to {', '.join(rcpt_to)}")
+                    await reply("250 OK: queued")
+                elif verb in ("NOOP", "RSET"):
+                    await reply("250 OK")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=2525):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def main(args):
+    standin = StandInSMTPServer(fail_every=args.fail_every, delay=args.delay)
+    server = await standin.start(args.host, args.port)
+    print(f"Stand-in SMTP server listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in SMTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--fail-every", type=int, default=0, help="reject every Nth message with a 451")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to stall before accepting DATA")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,171 @@
+"""Local stand-in for the Stripe Checkout API, for offline load tests.
+
+Implements the handful of endpoints the checkout flow touches
+(``POST /v1/checkout/sessions`` and ``GET /v1/checkout/sessions/{id}``) and
+can push signed ``checkout.session.completed`` / ``.expired`` webhooks to the
+app, so the webhook-driven status path can be exercised without network
+access. Start it, then run the API with ``STRIPE_API_BASE`` pointing at it
+and the webhook signing secret configured to the same value:
+
+    python stripe_standin.py --port 12111 --webhook-url http://localhost:8001/api/webhook/stripe \
+        --auto-complete-after 2 --latency 0.15
+
+Control endpoints for tests: ``POST /_standin/sessions/{id}/complete``,
+``POST /_standin/sessions/{id}/expire`` and ``GET /_standin/stats`` (which
+counts the status reads the app made, i.e. its outbound Stripe calls).
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+
+class StripeStandIn:
+    def __init__(self, webhook_url=None, webhook_secret="whsec_standin", latency=0.0, auto_complete_after=None):
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.latency = latency
+        self.auto_complete_after = auto_complete_after
+        self.sessions = {}
+        self.counters = {"sessions_created": 0, "status_reads": 0, "webhooks_sent": 0, "webhooks_failed": 0}
+
+    @staticmethod
+    def _parse_form(form):
+        """Turn Stripe's bracketed form keys (``metadata[order_id]``) into nested dicts."""
+        parsed = {}
+        for key, value in form.multi_items():
+            parts = key.replace("]", "").split("[")
+            target = parsed
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        return parsed
+
+    def create_session(self, params):
+        line_items = params.get("line_items", {})
+        amount_total = 0
+        for item in line_items.values():
+            unit_amount = int(item.get("price_data", {}).get("unit_amount", 0))
+            amount_total += unit_amount * int(item.get("quantity", 1))
+        if not line_items:
+            amount_total = int(params.get("amount", 0))
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "url": f"https://checkout.stripe.test/pay/{session_id}",
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": amount_total,
+            "currency": params.get("currency") or next(
+                (item.get("price_data", {}).get("currency") for item in line_items.values()), "usd"),
+            "metadata": params.get("metadata", {}),
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "created": int(time.time()),
+        }
+        self.sessions[session_id] = session
+        self.counters["sessions_created"] += 1
+        if self.auto_complete_after is not None:
+            asyncio.get_running_loop().call_later(
+                self.auto_complete_after, lambda: asyncio.ensure_future(self.complete(session_id)))
+        return session
+
+    def _sign(self, payload: bytes) -> str:
+        timestamp = int(time.time())
+        signed = f"{timestamp}.".encode() + payload
+        signature = hmac.new(self.webhook_secret.encode(), signed, hashlib.sha256).hexdigest()
+        return f"t={timestamp},v1={signature}"
+
+    async def send_webhook(self, event_type, session):
+        if not self.webhook_url:
+            return
+        payload = json.dumps({
+            "id": f"evt_{uuid.uuid4().hex}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": session},
+        }).encode()
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                response = await client.post(self.webhook_url, content=payload, headers={
+                    "Content-Type": "application/json",
+                    "Stripe-Signature": self._sign(payload),
+                })
+            ok = response.status_code < 300
+        except httpx.HTTPError:
+            ok = False
+        self.counters["webhooks_sent" if ok else "webhooks_failed"] += 1
+
+    async def complete(self, session_id):
+        session = self.sessions[session_id]
+        if session["status"] == "open":
+            session.update(status="complete", payment_status="paid")
+            await self.send_webhook("checkout.session.completed", session)
+        return session
+
+    async def expire(self, session_id):
+        session = self.sessions[session_id]
+        if session["status"] == "open":
+            session.update(status="expired")
+            await self.send_webhook("checkout.session.expired", session)
+        return session
+
+    def build_app(self):
+        app = FastAPI(title="Stripe stand-in")
+
+        async def simulated_latency():
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+        def lookup(session_id):
+            if session_id not in self.sessions:
+                raise HTTPException(status_code=404, detail={"error": {"message": f"No such checkout.session: {session_id}"}})
+            return session_id
+
+        @app.post("/v1/checkout/sessions")
+        async def create_session(request: Request):
+            await simulated_latency()
+            return self.create_session(self._parse_form(await request.form()))
+
+        @app.get("/v1/checkout/sessions/{session_id}")
+        async def retrieve_session(session_id: str):
+            await simulated_latency()
+            self.counters["status_reads"] += 1
+            return self.sessions[lookup(session_id)]
+
+        @app.post("/_standin/sessions/{session_id}/complete")
+        async def complete_session(session_id: str):
+            return await self.complete(lookup(session_id))
+
+        @app.post("/_standin/sessions/{session_id}/expire")
+        async def expire_session(session_id: str):
+            return await self.expire(lookup(session_id))
+
+        @app.get("/_standin/stats")
+        async def stats():
+            return {**self.counters, "sessions": len(self.sessions)}
+
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Stripe Checkout stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--webhook-url", help="where to POST signed webhook events")
+    parser.add_argument("--webhook-secret", default="whsec_standin")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--auto-complete-after", type=float, help="mark sessions paid N seconds after creation")
+    args = parser.parse_args()
+
+    standin = StripeStandIn(args.webhook_url, args.webhook_secret, args.latency, args.auto_complete_after)
+    uvicorn.run(standin.build_app(), host=args.host, port=args.port)
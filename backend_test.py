@@ -186,8 +186,10 @@ class CoffeeAPITester:
             data=cart_data
         )
         
-        if success and 'id' in response:
-            self.cart_item_id = response['id']
+        # The cart comes back whole; each line's id is its key, e.g. "blend:<id>"
+        line_id = f"blend:{self.blend_id}"
+        if success and any(item.get('id') == line_id for item in response.get('items', [])):
+            self.cart_item_id = line_id
             return True
         return False
 
@@ -326,6 +328,7 @@ class CoffeeAPITester:
     def test_remove_cart_item(self):
         """Test removing item from cart"""
         if not hasattr(self, 'cart_item_id'):
+            self.log_test("Remove Cart Item", False, "No cart line to remove; Add to Cart did not return one")
             return False
             
         success, response = self.run_test(
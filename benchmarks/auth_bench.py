@@ -0,0 +1,127 @@
+"""Login throughput benchmark.
+
+Hammers /api/auth/login with concurrent clients while a second group of
+clients keeps requesting /api/products, then reports login throughput and
+the latency percentiles of the unrelated endpoint. Run it against a local
+server before and after changing the password pool settings (start it with
+AUTH_RATE_LIMIT_ENABLED=false, since every login comes from one address):
+
+    python benchmarks/auth_bench.py --base-url http://localhost:8001 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class AuthBenchmark:
+    def __init__(self, base_url, login_clients, browse_clients, duration):
+        self.api_url = f"{base_url}/api"
+        self.login_clients = login_clients
+        self.browse_clients = browse_clients
+        self.duration = duration
+        self.email = f"bench_{uuid.uuid4().hex[:8]}@example.com"
+        self.password = "BenchPass123!"
+        self.login_latencies = []
+        self.login_errors = 0
+        self.browse_latencies = []
+        self.browse_errors = 0
+
+    async def setup(self, client):
+        response = await client.post(f"{self.api_url}/auth/register", json={
+            "email": self.email,
+            "password": self.password,
+            "name": "Bench User",
+        })
+        response.raise_for_status()
+
+    async def login_worker(self, client, deadline):
+        payload = {"email": self.email, "password": self.password}
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{self.api_url}/auth/login", json=payload)
+                if response.status_code != 200:
+                    self.login_errors += 1
+                    continue
+            except httpx.HTTPError:
+                self.login_errors += 1
+                continue
+            self.login_latencies.append(time.perf_counter() - started)
+
+    async def browse_worker(self, client, deadline):
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get(f"{self.api_url}/products")
+                if response.status_code != 200:
+                    self.browse_errors += 1
+                    continue
+            except httpx.HTTPError:
+                self.browse_errors += 1
+                continue
+            self.browse_latencies.append(time.perf_counter() - started)
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.login_clients + self.browse_clients + 1)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            await self.setup(client)
+            deadline = time.monotonic() + self.duration
+            workers = [self.login_worker(client, deadline) for _ in range(self.login_clients)]
+            workers += [self.browse_worker(client, deadline) for _ in range(self.browse_clients)]
+            await asyncio.gather(*workers)
+        return self.report()
+
+    def report(self):
+        def summary(samples, errors):
+            return {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput_rps": len(samples) / self.duration,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+
+        return {
+            "duration_seconds": self.duration,
+            "login_clients": self.login_clients,
+            "browse_clients": self.browse_clients,
+            "login": summary(self.login_latencies, self.login_errors),
+            "products": summary(self.browse_latencies, self.browse_errors),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--login-clients", type=int, default=32)
+    parser.add_argument("--browse-clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15.0)
+    args = parser.parse_args()
+
+    bench = AuthBenchmark(args.base_url, args.login_clients, args.browse_clients, args.duration)
+    results = asyncio.run(bench.run())
+
+    print(f"🔐 login:    {results['login']['throughput_rps']:.1f} req/s, "
+          f"p99 {results['login']['p99_ms']:.1f} ms, {results['login']['errors']} errors")
+    print(f"☕ products: {results['products']['throughput_rps']:.1f} req/s, "
+          f"p99 {results['products']['p99_ms']:.1f} ms, {results['products']['errors']} errors")
+    print(json.dumps(results, indent=2))
+    return 0 if results["login"]["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Burst simulation for auth rate limiting and password-work admission control.
+
+Boots ``server.app`` in process (see load_bench.py) and replays three abuse
+patterns against the auth routes while shoppers keep browsing /api/products:
+
+* ``stuffing``: one client address trying many different emails
+* ``targeted``: many addresses hammering a single account
+* ``storm``: a sign-up storm from many addresses and emails that the
+  per-key limits let through, so the password pool must shed it
+
+For each it reports the status mix, the ``Retry-After`` values handed out
+and the p99 latency of the unrelated product requests, then checks the
+expected outcome (429s for the first two, fast 503s rather than an
+unbounded queue for the storm) and exits non-zero if one does not hold.
+The limiter and pool rules themselves are covered by
+``tests/test_auth_limits.py``; this measures what a burst costs everyone
+else.
+
+    python benchmarks/auth_burst_bench.py --in-memory
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+from load_bench import boot_server, percentile
+
+PASSWORD = "BurstPass123!"
+
+
+class BurstBenchmark:
+    def __init__(self, server, attempts):
+        self.server = server
+        self.attempts = attempts
+        self.email = f"victim_{uuid.uuid4().hex[:8]}@example.com"
+
+    async def login(self, client, email, ip):
+        started = time.perf_counter()
+        response = await client.post("/api/auth/login", json={"email": email, "password": PASSWORD},
+                                     headers={"X-Forwarded-For": ip})
+        return response.status_code, response.headers.get("Retry-After"), time.perf_counter() - started
+
+    async def register(self, client, email, ip):
+        started = time.perf_counter()
+        response = await client.post("/api/auth/register", json={"email": email, "password": PASSWORD, "name": "Storm"},
+                                     headers={"X-Forwarded-For": ip})
+        return response.status_code, response.headers.get("Retry-After"), time.perf_counter() - started
+
+    async def browse(self, client, stop, latencies):
+        while not stop.is_set():
+            started = time.perf_counter()
+            await client.get("/api/products", params={"limit": 24})
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+
+    async def scenario(self, client, name, calls):
+        stop = asyncio.Event()
+        latencies = []
+        browsers = [asyncio.create_task(self.browse(client, stop, latencies)) for _ in range(4)]
+        started = time.perf_counter()
+        results = await asyncio.gather(*calls)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*browsers)
+        statuses = Counter(status for status, _, _ in results)
+        retry_after = sorted({int(value) for _, value, _ in results if value})
+        rejected = [seconds for status, _, seconds in results if status in (429, 503)]
+        return {
+            "scenario": name,
+            "attempts": len(results),
+            "seconds": round(elapsed, 2),
+            "statuses": dict(sorted(statuses.items())),
+            "retry_after": [retry_after[0], retry_after[-1]] if retry_after else None,
+            "rejection_p99_ms": round(percentile(rejected, 99) * 1000, 1),
+            "products_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        }
+
+    async def run(self):
+        server = self.server
+        app = server.app
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                         timeout=120) as client:
+                response = await client.post("/api/auth/register", headers={"X-Forwarded-For": "10.0.0.1"},
+                                             json={"email": self.email, "password": PASSWORD, "name": "Victim"})
+                response.raise_for_status()
+
+                stuffing = await self.scenario(client, "stuffing", [
+                    self.login(client, f"user{i}@example.com", "203.0.113.7") for i in range(self.attempts)
+                ])
+                targeted = await self.scenario(client, "targeted", [
+                    self.login(client, self.email, f"198.51.100.{i % 250}") for i in range(self.attempts)
+                ])
+                storm = await self.scenario(client, "storm", [
+                    self.register(client, f"storm_{i}_{uuid.uuid4().hex[:6]}@example.com", f"10.{i // 250}.{i % 250}.9")
+                    for i in range(self.attempts * 4)
+                ])
+        return [stuffing, targeted, storm]
+
+    def check(self, results):
+        stuffing, targeted, storm = results
+        checks = {
+            "stuffing is limited per address": stuffing["statuses"].get(429, 0) >= self.attempts - self.server.AUTH_IP_BURST,
+            "targeted account is limited per email": targeted["statuses"].get(429, 0) >= self.attempts - self.server.AUTH_EMAIL_BURST,
+            "storm is shed with 503": storm["statuses"].get(503, 0) > 0,
+            "every rejection carries Retry-After": all(r["retry_after"] for r in results if set(r["statuses"]) & {429, 503}),
+        }
+        return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="defaults to $MONGO_URL or mongodb://localhost:27017")
+    parser.add_argument("--db-name", default=f"auth_burst_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of a mongod")
+    parser.add_argument("--attempts", type=int, default=200, help="requests per scenario (x4 for the storm)")
+    args = parser.parse_args()
+
+    # A small pool and queue so the storm overflows it quickly
+    os.environ.setdefault("AUTH_RATE_LIMIT_ENABLED", "true")
+    # Client addresses are simulated with X-Forwarded-For, as if set by one trusted proxy
+    os.environ.setdefault("TRUSTED_PROXY_HOPS", "1")
+    os.environ.setdefault("PASSWORD_POOL_WORKERS", "2")
+    os.environ.setdefault("PASSWORD_MAX_QUEUE", "16")
+    os.environ.setdefault("PASSWORD_QUEUE_TIMEOUT", "1")
+    server = boot_server(args)
+    bench = BurstBenchmark(server, args.attempts)
+    try:
+        results = asyncio.run(bench.run())
+    finally:
+        if not args.in_memory:
+            from pymongo import MongoClient
+            MongoClient(os.environ["MONGO_URL"]).drop_database(args.db_name)
+
+    for result in results:
+        print(f"{result['scenario']:<10}{result['attempts']:>6} attempts in {result['seconds']:>6}s  "
+              f"statuses {result['statuses']}  Retry-After {result['retry_after']}  "
+              f"rejections p99 {result['rejection_p99_ms']} ms  products p99 {result['products_p99_ms']} ms")
+    checks = bench.check(results)
+    for name, ok in checks.items():
+        print(f"{'✅' if ok else '❌'} {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Cross-process cache invalidation latency.
+
+Starts several API worker processes against one local mongod, lets each of
+them cache the product catalog, then updates a product through one worker
+and measures how long every other worker keeps serving the old catalog
+(polling ``/api/products`` with ``If-None-Match``). With the invalidation
+bus the delay is bounded by ``CACHE_BUS_POLL_INTERVAL``; run with
+``CACHE_BUS_ENABLED=false`` to see the workers never converge.
+
+    python benchmarks/cache_bus_bench.py --workers 3 --updates 20 --poll-interval 0.5
+
+Needs a real mongod (``--mongo-url``/``MONGO_URL``): the workers are
+separate processes and must share the database.
+
+``--in-memory`` instead runs two buses in this process against
+mongomock-motor, standing in for two workers. It checks that a write on
+one is applied by the other within the poll interval, that keys are
+replayed in order, that a bus skips its own events, and that a bus that
+fell further behind than the history flushes the namespace:
+
+    python benchmarks/cache_bus_bench.py --in-memory --poll-interval 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from pymongo import MongoClient
+
+from load_bench import percentile
+from startup_bench import BACKEND_DIR, CHILD, free_port
+
+PASSWORD = "BusBench123!"
+
+
+def start_workers(count, env):
+    workers = []
+    for _ in range(count):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-c", CHILD.format(backend=str(BACKEND_DIR)), str(port)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+        )
+        workers.append((process, f"http://127.0.0.1:{port}/api"))
+    deadline = time.time() + 60
+    for process, base_url in workers:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"worker exited with status {process.returncode}")
+            try:
+                if httpx.get(f"{base_url}/health/ready", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"{base_url} did not become ready")
+            time.sleep(0.05)
+    return workers
+
+
+def seed(mongo_url, db_name, products):
+    from passlib.context import CryptContext
+
+    database = MongoClient(mongo_url, tz_aware=True)[db_name]
+    email = f"bus_admin_{uuid.uuid4().hex[:8]}@example.com"
+    database.users.insert_one({
+        "id": str(uuid.uuid4()), "email": email, "name": "Bus Admin", "is_admin": True,
+        "password_hash": CryptContext(schemes=["bcrypt"]).hash(PASSWORD),
+        "created_at": datetime.now(timezone.utc),
+    })
+    product_ids = [str(uuid.uuid4()) for _ in range(products)]
+    database.products.insert_many([
+        {"id": product_id, "name": f"Bus Roast #{i}", "description": "Cherry and cocoa.", "origin": "colombian",
+         "price": 15.0, "image_url": f"https://images.example.com/{i}.jpg", "available": True,
+         "created_at": datetime.now(timezone.utc)}
+        for i, product_id in enumerate(product_ids)
+    ])
+    return email, product_ids
+
+
+def measure_update(workers, writer, token, product_id, price, timeout):
+    etags = {}
+    for _, base_url in workers:
+        etags[base_url] = httpx.get(f"{base_url}/products").headers["ETag"]
+    response = httpx.put(f"{workers[writer][1]}/products/{product_id}", headers={"Authorization": f"Bearer {token}"}, json={
+        "name": "Bus Roast", "description": "Cherry and cocoa.", "origin": "colombian",
+        "price": price, "image_url": "https://images.example.com/bus.jpg", "available": True,
+    })
+    response.raise_for_status()
+    written = time.perf_counter()
+
+    delays = {}
+    pending = {base_url for index, (_, base_url) in enumerate(workers) if index != writer}
+    while pending and time.perf_counter() - written < timeout:
+        for base_url in list(pending):
+            response = httpx.get(f"{base_url}/products", headers={"If-None-Match": etags[base_url]})
+            if response.status_code == 200:
+                delays[base_url] = time.perf_counter() - written
+                pending.discard(base_url)
+        time.sleep(0.01)
+    return delays, len(pending)
+
+
+async def wait_until(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.002)
+    return True
+
+
+async def in_process_check(server, poll_interval, updates, history):
+    """Two buses sharing one in-memory database, as two workers would."""
+    writer = server.CacheInvalidationBus(history, poll_interval)
+    reader = server.CacheInvalidationBus(history, poll_interval)
+    seen = {"writer": [], "reader": []}
+    writer.subscribe("products", seen["writer"].append)
+    reader.subscribe("products", seen["reader"].append)
+    await writer.start()
+    await reader.start()
+    try:
+        # A write on one worker reaches the other within the poll interval
+        delays, missed = [], 0
+        for update in range(updates):
+            key = f"product-{update}"
+            await writer.publish("products", key)
+            written = time.perf_counter()
+            if await wait_until(lambda: key in seen["reader"], poll_interval * 3):
+                delays.append(time.perf_counter() - written)
+            else:
+                missed += 1
+
+        # A burst between polls is replayed in publish order
+        burst = [f"burst-{i}" for i in range(5)]
+        start = len(seen["reader"])
+        for key in burst:
+            await writer.publish("products", key)
+        await wait_until(lambda: len(seen["reader"]) >= start + len(burst), poll_interval * 3)
+        replayed = seen["reader"][start:start + len(burst)]
+
+        # The reader's own write comes back to it on the next poll; it must not apply it twice
+        await reader.publish("products", "own-write")
+        await asyncio.sleep(poll_interval * 2.5)
+        own_applied = seen["reader"].count("own-write")
+        writer_applied = seen["writer"].count("own-write")
+
+        # A reader that missed more than the history drops the whole namespace
+        await reader.stop()
+        for i in range(history + 5):
+            await writer.publish("products", f"overflow-{i}")
+        flushes = reader.flushes
+        await reader.poll_once()
+        flushed = reader.flushes == flushes + 1 and seen["reader"][-1] is None
+    finally:
+        await writer.stop()
+        await reader.stop()
+
+    results = {
+        "updates": updates,
+        "poll_interval": poll_interval,
+        "p50_ms": round(percentile(delays, 50) * 1000, 1),
+        "max_ms": round(max(delays, default=0.0) * 1000, 1),
+        "never_invalidated": missed,
+    }
+    checks = {
+        "every write applied by the other bus within the poll interval":
+            not missed and max(delays, default=0.0) <= poll_interval * 1.5,
+        "a burst is replayed in publish order": replayed == burst,
+        "a bus skips its own events": own_applied == 1 and writer_applied == 1,
+        "falling behind the history flushes the namespace": flushed,
+    }
+    return results, checks
+
+
+def run_in_memory(args):
+    from load_bench import boot_server
+
+    args.db_name = f"cache_bus_{uuid.uuid4().hex[:8]}"
+    server = boot_server(args)
+    results, checks = asyncio.run(in_process_check(server, args.poll_interval, args.updates, args.history))
+    print(f"🔁 {results['updates']} in-process invalidations: p50 {results['p50_ms']} ms, max {results['max_ms']} ms "
+          f"(poll interval {args.poll_interval}s); {results['never_invalidated']} never arrived")
+    for name, ok in checks.items():
+        print(f"{'✅' if ok else '❌'} {name}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({**results, "checks": checks}, f, indent=2)
+    return 0 if all(checks.values()) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--updates", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="CACHE_BUS_POLL_INTERVAL for the workers")
+    parser.add_argument("--timeout", type=float, default=10.0, help="give up on a worker after this many seconds")
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    parser.add_argument("--in-memory", action="store_true", help="two buses in this process against mongomock-motor")
+    parser.add_argument("--history", type=int, default=20, help="bus history length for --in-memory")
+    args = parser.parse_args()
+    if args.in_memory:
+        return run_in_memory(args)
+
+    db_name = f"cache_bus_{uuid.uuid4().hex[:8]}"
+    env = dict(os.environ, MONGO_URL=args.mongo_url, DB_NAME=db_name,
+               CACHE_BUS_POLL_INTERVAL=str(args.poll_interval))
+    env.setdefault("EMAIL_OUTBOX_ENABLED", "false")
+    env.setdefault("SUBSCRIPTION_SCHEDULER_ENABLED", "false")
+    env.setdefault("AUTH_RATE_LIMIT_ENABLED", "false")
+
+    email, product_ids = seed(args.mongo_url, db_name, args.products)
+    workers = start_workers(args.workers, env)
+    try:
+        token = httpx.post(f"{workers[0][1]}/auth/login", json={"email": email, "password": PASSWORD}).json()["token"]
+        delays, stale = [], 0
+        for update in range(args.updates):
+            worker_delays, never = measure_update(
+                workers, update % len(workers), token, product_ids[update % len(product_ids)], 15.0 + update, args.timeout)
+            delays.extend(worker_delays.values())
+            stale += never
+    finally:
+        for process, _ in workers:
+            process.terminate()
+        for process, _ in workers:
+            process.wait(timeout=10)
+        MongoClient(args.mongo_url).drop_database(db_name)
+
+    results = {
+        "workers": args.workers,
+        "updates": args.updates,
+        "poll_interval": args.poll_interval,
+        "observations": len(delays),
+        "never_invalidated": stale,
+        "p50_ms": round(percentile(delays, 50) * 1000, 1),
+        "p95_ms": round(percentile(delays, 95) * 1000, 1),
+        "max_ms": round(max(delays, default=0.0) * 1000, 1),
+    }
+    print(f"🔁 {results['observations']} cross-worker invalidations: p50 {results['p50_ms']} ms, "
+          f"p95 {results['p95_ms']} ms, max {results['max_ms']} ms "
+          f"(poll interval {args.poll_interval}s); {stale} never converged within {args.timeout}s")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if not stale else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
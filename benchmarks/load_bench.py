@@ -0,0 +1,289 @@
+"""In-process load benchmark for the storefront API.
+
+Boots ``server.app`` inside this process (lifespan included) and drives it
+through httpx's ASGI transport with many concurrent simulated shoppers, so
+no uvicorn, network or remote preview URL is involved. Each shopper runs a
+weighted mix of journeys: browse and search the catalog, register/login, price a
+custom blend, fill and summarize a cart and place an order. Throughput and
+p50/p95/p99 latency are reported per route, and ``--json`` saves the
+results; pass a previous results file as ``--baseline`` to print the p95
+change per route.
+
+Against a local mongod:
+
+    python benchmarks/load_bench.py --mongo-url mongodb://localhost:27017 --clients 64 --duration 30
+
+or fully in memory (needs ``mongomock-motor``; latencies then reflect the
+app's own CPU cost rather than real database round trips):
+
+    python benchmarks/load_bench.py --in-memory --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# name -> relative weight of each shopper journey
+DEFAULT_MIX = {"browse": 40, "page": 15, "search": 10, "blend": 10, "cart": 10, "login": 5, "register": 2, "checkout": 8}
+ORIGINS = ["ethiopian", "colombian", "costa_rican", "brazilian"]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (value or "").split(",")):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown journey {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def boot_server(args):
+    """Import server.py with benchmark-friendly settings and pick the database."""
+    os.environ["MONGO_URL"] = args.mongo_url or os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("EMAIL_OUTBOX_ENABLED", "false")
+    os.environ.setdefault("SUBSCRIPTION_SCHEDULER_ENABLED", "false")
+    # every simulated shopper shares one client address; auth_burst_bench.py covers the limiter
+    os.environ.setdefault("AUTH_RATE_LIMIT_ENABLED", "false")
+    import server
+
+    if args.in_memory:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--in-memory needs mongomock-motor: pip install mongomock-motor")
+        # mongomock has no replica set to route reads to
+        server.MONGO_SECONDARY_READ_PREFERENCE = "primary"
+        server.client = AsyncMongoMockClient(tz_aware=True)
+        server.db = server.client[args.db_name]
+    return server
+
+
+class LoadBenchmark:
+    def __init__(self, server, clients, duration, mix, products, users, seed):
+        self.server = server
+        self.clients = clients
+        self.duration = duration
+        self.mix = mix
+        self.product_count = products
+        self.user_count = users
+        self.random = random.Random(seed)
+        self.password = "BenchPass123!"
+        self.users = []
+        self.product_ids = []
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def seed(self, client):
+        self.product_ids = [str(uuid.uuid4()) for _ in range(self.product_count)]
+        products = [
+            self.server.Product(
+                id=product_id,
+                name=f"Bench Roast #{i}",
+                description="Stone fruit, cocoa nib and a long caramel finish.",
+                origin=ORIGINS[i % len(ORIGINS)],
+                price=12.0 + i % 9,
+                image_url=f"https://images.example.com/products/{i}.jpg",
+                available=True,
+            )
+            for i, product_id in enumerate(self.product_ids)
+        ]
+        await self.server.db.products.insert_many([self.server.products_repo.encode(product) for product in products])
+        self.server.catalog_snapshot.invalidate()
+
+        for _ in range(self.user_count):
+            email = f"bench_{uuid.uuid4().hex[:10]}@example.com"
+            response = await client.post("/api/auth/register", json={
+                "email": email, "password": self.password, "name": "Bench Shopper",
+            })
+            response.raise_for_status()
+            self.users.append({"email": email, "token": response.json()["token"]})
+
+    async def call(self, client, label, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors[label] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append(elapsed)
+        return response
+
+    def cart_items(self):
+        return [
+            {"product_id": product_id, "quantity": self.random.randint(1, 3)}
+            for product_id in self.random.sample(self.product_ids, k=min(3, len(self.product_ids)))
+        ]
+
+    def blend(self):
+        first, second = self.random.sample(ORIGINS, 2)
+        share = self.random.choice([50, 60, 70])
+        return {
+            "origin": first,
+            "roast_level": self.random.choice(["light", "medium", "dark"]),
+            "grind_size": self.random.choice(["whole_bean", "coarse", "medium", "fine"]),
+            "blend_components": {first: share, second: 100 - share},
+            "quantity": self.random.choice([250, 500, 1000]),
+        }
+
+    async def journey(self, client, name):
+        user = self.random.choice(self.users)
+        auth = {"Authorization": f"Bearer {user['token']}"}
+        if name == "browse":
+            await self.call(client, "GET /products", "GET", "/api/products")
+        elif name == "page":
+            response = await self.call(client, "GET /products?limit", "GET", "/api/products", params={"limit": 24})
+            if response is not None and response.headers.get("X-Next-Cursor"):
+                await self.call(client, "GET /products?limit", "GET", "/api/products",
+                                params={"limit": 24, "cursor": response.headers["X-Next-Cursor"]})
+        elif name == "search":
+            await self.call(client, "GET /products/search", "GET", "/api/products/search", params={
+                "q": self.random.choice(["roast", "caramel", "bench", "cocoa"]),
+                "origin": self.random.sample(ORIGINS, k=self.random.randint(0, 2)),
+                "sort": self.random.choice(["relevance", "price_asc", "name"]),
+            })
+        elif name == "blend":
+            await self.call(client, "POST /quotes", "POST", "/api/quotes", json={"blends": [self.blend()]})
+        elif name == "cart":
+            await self.call(client, "POST /cart", "POST", "/api/cart", headers=auth,
+                            json={"product_id": self.random.choice(self.product_ids), "quantity": 1})
+            await self.call(client, "GET /cart/summary", "GET", "/api/cart/summary", headers=auth)
+            if self.random.random() < 0.2:
+                await self.call(client, "DELETE /cart", "DELETE", "/api/cart", headers=auth)
+        elif name == "login":
+            await self.call(client, "POST /auth/login", "POST", "/api/auth/login",
+                            json={"email": user["email"], "password": self.password})
+        elif name == "register":
+            await self.call(client, "POST /auth/register", "POST", "/api/auth/register", json={
+                "email": f"bench_{uuid.uuid4().hex[:10]}@example.com", "password": self.password, "name": "New Shopper",
+            })
+        elif name == "checkout":
+            await self.call(client, "GET /auth/me", "GET", "/api/auth/me", headers=auth)
+            await self.call(client, "POST /orders", "POST", "/api/orders", headers=auth, json={
+                "items": self.cart_items(),
+                "shipping_address": {"street": "1 Bench St", "city": "Portland", "zip": "97201"},
+            })
+            await self.call(client, "GET /orders", "GET", "/api/orders", headers=auth, params={"limit": 20})
+
+    async def shopper(self, client, deadline):
+        names, weights = zip(*((name, weight) for name, weight in self.mix.items() if weight > 0))
+        while time.monotonic() < deadline:
+            await self.journey(client, self.random.choices(names, weights)[0])
+
+    async def run(self):
+        app = self.server.app
+        async with app.router.lifespan_context(app):
+            limits = httpx.Limits(max_connections=None)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                         timeout=60, limits=limits) as client:
+                await self.seed(client)
+                started = time.monotonic()
+                deadline = started + self.duration
+                await asyncio.gather(*(self.shopper(client, deadline) for _ in range(self.clients)))
+                elapsed = time.monotonic() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        routes = {}
+        for label in sorted(set(self.latencies) | set(self.errors)):
+            samples = self.latencies[label]
+            routes[label] = {
+                "requests": len(samples),
+                "errors": self.errors[label],
+                "throughput_rps": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "max_ms": max(samples, default=0.0) * 1000,
+            }
+        total = sum(route["requests"] for route in routes.values())
+        return {
+            "clients": self.clients,
+            "duration_seconds": elapsed,
+            "mix": self.mix,
+            "products": self.product_count,
+            "total_requests": total,
+            "total_errors": sum(route["errors"] for route in routes.values()),
+            "throughput_rps": total / elapsed,
+            "routes": routes,
+        }
+
+
+def print_report(results, baseline=None):
+    header = f"{'route':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+    if baseline:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    for label, route in results["routes"].items():
+        line = (f"{label:<24}{route['throughput_rps']:>9.1f}{route['p50_ms']:>9.1f}"
+                f"{route['p95_ms']:>9.1f}{route['p99_ms']:>9.1f}{route['errors']:>8}")
+        before = (baseline or {}).get("routes", {}).get(label)
+        if before and before["p95_ms"]:
+            line += f"{(route['p95_ms'] / before['p95_ms'] - 1) * 100:>+12.1f}%"
+        print(line)
+    print(f"☕ {results['total_requests']} requests, {results['throughput_rps']:.1f} req/s, "
+          f"{results['total_errors']} errors, {results['clients']} clients")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="defaults to $MONGO_URL or mongodb://localhost:27017")
+    parser.add_argument("--db-name", default=f"load_bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of a mongod")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help="override journey weights, e.g. browse=80,checkout=20,register=0")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--keep-db", action="store_true", help="do not drop the benchmark database afterwards")
+    args = parser.parse_args()
+
+    server = boot_server(args)
+    bench = LoadBenchmark(server, args.clients, args.duration, args.mix, args.products, args.users, args.seed)
+    try:
+        results = asyncio.run(bench.run())
+    finally:
+        if not args.in_memory and not args.keep_db:
+            from pymongo import MongoClient
+            MongoClient(os.environ["MONGO_URL"]).drop_database(args.db_name)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if results["total_requests"] and not results["total_errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
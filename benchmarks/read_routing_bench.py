@@ -0,0 +1,171 @@
+"""Check where reads are served on a replica set.
+
+Boots ``server.app`` in process (see load_bench.py) against a replica set
+and runs two phases, counting every read the driver sends by member role
+(see ``MongoReadRouting`` in server.py):
+
+* ``reporting``: catalog pages, the catalog export, admin order listing
+  and sales stats, which should be served by secondaries
+* ``shopper``: login, cart, placing an order and reading it straight
+  back, which must all be served by the primary
+
+It also counts orders that could not be read back right after being
+placed. It exits non-zero if any check fails.
+
+Start a local three-node replica set first, e.g.:
+
+    for i in 0 1 2; do mkdir -p /tmp/rs/$i
+      mongod --replSet rs0 --port 2701$i --dbpath /tmp/rs/$i --fork --logpath /tmp/rs/$i.log; done
+    mongosh --port 27010 --eval 'rs.initiate({_id: "rs0", members: [
+      {_id: 0, host: "localhost:27010"}, {_id: 1, host: "localhost:27011"}, {_id: 2, host: "localhost:27012"}]})'
+
+    python benchmarks/read_routing_bench.py \\
+        --mongo-url "mongodb://localhost:27010,localhost:27011,localhost:27012/?replicaSet=rs0"
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+from load_bench import ORIGINS, boot_server
+
+PASSWORD = "RoutingPass123!"
+
+
+class ReadRoutingBenchmark:
+    def __init__(self, server, rounds):
+        self.server = server
+        self.rounds = rounds
+        self.product_ids = []
+        self.unreadable_orders = 0
+
+    def snapshot(self):
+        with self.server.read_routing.reads._lock:
+            return Counter(self.server.read_routing.reads.values)
+
+    async def phase(self, name, work):
+        before = self.snapshot()
+        await work()
+        reads = self.snapshot()
+        reads.subtract(before)
+        served = Counter()
+        for (collection, mode, served_by), count in reads.items():
+            if count > 0:
+                served[served_by] += count
+        return {"phase": name, "served_by": dict(served),
+                "by_collection": {"/".join(labels): count for labels, count in sorted(reads.items()) if count > 0}}
+
+    async def register(self, client, name):
+        response = await client.post("/api/auth/register", json={
+            "email": f"routing_{uuid.uuid4().hex[:10]}@example.com", "password": PASSWORD, "name": name,
+        })
+        response.raise_for_status()
+        return response.json()
+
+    async def seed(self, client):
+        server = self.server
+        self.product_ids = [str(uuid.uuid4()) for _ in range(50)]
+        await server.db.products.insert_many([
+            server.products_repo.encode(server.Product(
+                id=product_id, name=f"Routing Roast #{i}", description="Plum and cocoa.",
+                origin=ORIGINS[i % len(ORIGINS)], price=14.0, image_url=f"https://images.example.com/{i}.jpg", available=True,
+            ))
+            for i, product_id in enumerate(self.product_ids)
+        ])
+        server.catalog_snapshot.invalidate()
+        admin = await self.register(client, "Routing Admin")
+        await server.db.users.update_one({"id": admin["user"]["id"]}, {"$set": {"is_admin": True}})
+        await server.invalidate_user(admin["user"]["id"])
+        shopper = await self.register(client, "Routing Shopper")
+        return {"Authorization": f"Bearer {admin['token']}"}, shopper
+
+    async def wait_for_secondary(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while "secondary" not in self.server.read_routing.members.values():
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"no secondary discovered; members: {self.server.read_routing.stats()['members']}")
+            await asyncio.sleep(0.1)
+
+    async def reporting(self, client, admin):
+        for _ in range(self.rounds):
+            (await client.get("/api/products", params={"limit": 24})).raise_for_status()
+            (await client.get("/api/admin/orders", headers=admin)).raise_for_status()
+            (await client.get("/api/admin/stats", headers=admin)).raise_for_status()
+        (await client.get("/api/admin/products/export", headers=admin)).raise_for_status()
+
+    async def shopper(self, client, shopper):
+        auth = {"Authorization": f"Bearer {shopper['token']}"}
+        for i in range(self.rounds):
+            (await client.post("/api/auth/login", json={"email": shopper["user"]["email"], "password": PASSWORD})).raise_for_status()
+            (await client.post("/api/cart", headers=auth, json={"product_id": self.product_ids[i % len(self.product_ids)]})).raise_for_status()
+            (await client.get("/api/cart/summary", headers=auth)).raise_for_status()
+            response = await client.post("/api/orders", headers=auth, json={
+                "items": [{"product_id": self.product_ids[i % len(self.product_ids)], "quantity": 1}],
+                "shipping_address": {"street": "1 Replica Way", "city": "Portland", "zip": "97201"},
+            })
+            response.raise_for_status()
+            # Read-your-own-write: the order must be visible immediately
+            if (await client.get(f"/api/orders/{response.json()['id']}", headers=auth)).status_code != 200:
+                self.unreadable_orders += 1
+            (await client.get("/api/orders", headers=auth)).raise_for_status()
+
+    async def run(self):
+        app = self.server.app
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                         timeout=60) as client:
+                admin, shopper = await self.seed(client)
+                await self.wait_for_secondary()
+                reporting = await self.phase("reporting", lambda: self.reporting(client, admin))
+                shopping = await self.phase("shopper", lambda: self.shopper(client, shopper))
+        return [reporting, shopping]
+
+    def check(self, results):
+        reporting, shopping = results
+        secondary_collections = {key.split("/")[0] for key in reporting["by_collection"] if key.endswith("/secondary")}
+        return {
+            "catalog reads served by a secondary": "products" in secondary_collections,
+            "admin order listing served by a secondary": "orders" in secondary_collections,
+            "sales stats served by a secondary": "sales_rollups" in secondary_collections,
+            "no shopper read served by a secondary": not shopping["served_by"].get("secondary"),
+            "every order readable right after it was placed": self.unreadable_orders == 0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="replica set URL; defaults to $MONGO_URL")
+    parser.add_argument("--db-name", default=f"read_routing_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--max-staleness", type=int, default=90, help="MONGO_MAX_STALENESS_SECONDS for the app")
+    args = parser.parse_args()
+    args.in_memory = False
+
+    os.environ["METRICS_ENABLED"] = "true"
+    os.environ.setdefault("MONGO_SECONDARY_READ_PREFERENCE", "secondaryPreferred")
+    os.environ["MONGO_MAX_STALENESS_SECONDS"] = str(args.max_staleness)
+    server = boot_server(args)
+    bench = ReadRoutingBenchmark(server, args.rounds)
+    try:
+        results = asyncio.run(bench.run())
+    finally:
+        from pymongo import MongoClient
+        MongoClient(os.environ["MONGO_URL"]).drop_database(args.db_name)
+
+    for result in results:
+        print(f"{result['phase']:<10} served by {result['served_by']}")
+        for key, count in result["by_collection"].items():
+            print(f"    {key:<48}{count:>6}")
+    checks = bench.check(results)
+    for name, ok in checks.items():
+        print(f"{'✅' if ok else '❌'} {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Startup-time benchmark: process start to first request served.
+
+Launches the API in a fresh interpreter under uvicorn several times and
+measures, from the moment the process is spawned, how long it takes until
+``server`` is imported, until ``/api/health/live`` answers (the lifespan,
+including Mongo warmup, has finished) and until ``/api/health/ready``
+answers. It also breaks the import down with ``python -X importtime`` and
+lists the most expensive top-level imports.
+
+    python benchmarks/startup_bench.py --runs 5 --json startup.json
+
+Uses ``MONGO_URL``/``DB_NAME`` from the environment (default: a local
+mongod); ``--in-memory`` swaps in mongomock-motor so only the app's own
+start-up cost is measured.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+CHILD = """
+import os, sys, time
+sys.path.insert(0, {backend!r})
+import server
+print(f"imported {{time.time()}}", flush=True)
+if os.environ.get("STARTUP_BENCH_IN_MEMORY"):
+    from mongomock_motor import AsyncMongoMockClient
+    server.MONGO_SECONDARY_READ_PREFERENCE = "primary"
+    server.client = AsyncMongoMockClient(tz_aware=True)
+    server.db = server.client[os.environ["DB_NAME"]]
+import uvicorn
+uvicorn.run(server.app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline, process):
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.time()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    return None
+
+
+def measure_once(env, timeout):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}/api"
+    started = time.time()
+    process = subprocess.Popen(
+        [sys.executable, "-c", CHILD.format(backend=str(BACKEND_DIR)), str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        imported_line = process.stdout.readline()
+        imported = float(imported_line.split()[1]) if imported_line.startswith("imported") else None
+        deadline = started + timeout
+        live = wait_for(f"{base_url}/health/live", deadline, process)
+        ready = wait_for(f"{base_url}/health/ready", deadline, process) if live else None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def since_start(moment):
+        return round((moment - started) * 1000, 1) if moment else None
+
+    return {"import_ms": since_start(imported), "first_request_ms": since_start(live), "ready_ms": since_start(ready)}
+
+
+def import_profile(env, top):
+    """Cumulative import time of each module loaded directly while executing server.py."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # importtime indents nested imports by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            rows.append((name.strip(), int(cumulative) / 1000))
+    rows.sort(key=lambda row: -row[1])
+    return [{"module": module, "cumulative_ms": round(ms, 1)} for module, ms in rows[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each server")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of a mongod")
+    parser.add_argument("--top", type=int, default=12, help="how many imports to list")
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "startup_bench")
+    env.setdefault("EMAIL_OUTBOX_ENABLED", "false")
+    env.setdefault("SUBSCRIPTION_SCHEDULER_ENABLED", "false")
+    if args.in_memory:
+        env["STARTUP_BENCH_IN_MEMORY"] = "1"
+
+    runs = [measure_once(env, args.timeout) for _ in range(args.runs)]
+    summary = {}
+    for phase in ("import_ms", "first_request_ms", "ready_ms"):
+        values = [run[phase] for run in runs if run[phase] is not None]
+        summary[phase] = {
+            "median": round(statistics.median(values), 1) if values else None,
+            "min": min(values, default=None),
+            "max": max(values, default=None),
+        }
+    results = {"runs": runs, "summary": summary, "imports": import_profile(env, args.top)}
+
+    for phase, stats in summary.items():
+        print(f"{phase:<18} median {stats['median']} ms (min {stats['min']}, max {stats['max']})")
+    print("slowest imports:")
+    for row in results["imports"]:
+        print(f"  {row['module']:<40}{row['cumulative_ms']:>8.1f} ms")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if summary["first_request_ms"]["median"] is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Product-drop simulation: concurrent checkouts against limited stock.
+
+Boots ``server.app`` in process (see load_bench.py), puts a limited product
+on sale with ``--stock`` units spread over N counter shards and fires
+``--orders`` guest checkouts at it, ``--concurrency`` at a time, each for
+1-3 units. For every shard count in ``--shards`` it reports throughput,
+latency and how many orders won or were turned away with 409. It then
+checks the books:
+
+* no oversell: units in accepted orders never exceed the stock
+* no lost units: stock left + units held equals the starting stock
+* no shard below zero
+* paying for half the orders commits their holds, and sweeping the
+  expired rest returns exactly their units
+
+and exits non-zero if any check fails.
+
+    python benchmarks/stock_bench.py --mongo-url mongodb://localhost:27017 --stock 500 --orders 5000 --shards 1,8
+
+With ``--in-memory`` (mongomock-motor) every database call completes
+without yielding, so the bookkeeping is checked but not real write
+contention; use a mongod to see the effect of sharding.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from load_bench import boot_server, percentile
+
+
+class StockBenchmark:
+    def __init__(self, server, stock, orders, concurrency, seed):
+        self.server = server
+        self.stock = stock
+        self.orders = orders
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+
+    async def drop(self, client, shards):
+        server = self.server
+        product = server.Product(name=f"Limited Roast x{shards}", description="Numbered bags, one harvest.",
+                                 origin="ethiopian", price=30.0, image_url="https://images.example.com/limited.jpg")
+        await server.products_repo.insert(product)
+        await server.stock_ledger.set_stock(product.id, self.stock, shards)
+
+        slots = asyncio.Semaphore(self.concurrency)
+        latencies, statuses, accepted = [], Counter(), {}
+
+        async def checkout(i):
+            quantity = self.random.randint(1, 3)
+            async with slots:
+                started = time.perf_counter()
+                response = await client.post("/api/orders", json={
+                    "items": [{"product_id": product.id, "quantity": quantity}],
+                    "shipping_address": {"street": "1 Drop St", "city": "Portland", "zip": "97201"},
+                    "guest_email": f"buyer{i}@example.com",
+                })
+                latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                accepted[response.json()["id"]] = quantity
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout(i) for i in range(self.orders)))
+        elapsed = time.perf_counter() - started
+        return product.id, accepted, {
+            "shards": shards,
+            "orders": self.orders,
+            "seconds": round(elapsed, 2),
+            "orders_per_second": round(self.orders / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "statuses": dict(sorted(statuses.items())),
+            "units_sold": sum(accepted.values()),
+        }
+
+    async def audit(self, product_id, accepted):
+        server, db = self.server, self.server.db
+        shards = (await server.stock_ledger.shards([product_id]))[product_id]
+        left = sum(shard["available"] for shard in shards)
+        held = 0
+        async for reservation in db.stock_reservations.find({"lines.product_id": product_id, "status": "held"}):
+            held += sum(line["quantity"] for line in reservation["lines"] if line["product_id"] == product_id)
+        sold = sum(accepted.values())
+
+        # Pay for half the orders, then let the rest expire
+        paid = list(accepted)[::2]
+        for order_id in paid:
+            await server.stock_ledger.commit(order_id)
+        await server.stock_ledger.sweep(datetime.now(timezone.utc) + timedelta(seconds=server.STOCK_RESERVATION_TTL + 1))
+        after = (await server.stock_ledger.available([product_id]))[product_id]
+        paid_units = sum(accepted[order_id] for order_id in paid)
+        return {
+            "no oversell": sold <= self.stock,
+            "no lost units": left + held == self.stock and held == sold,
+            "no shard below zero": all(shard["available"] >= 0 for shard in shards),
+            "expired holds returned": after == self.stock - paid_units,
+        }
+
+    async def run(self, shard_counts):
+        app = self.server.app
+        results = []
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                         timeout=120, limits=httpx.Limits(max_connections=None)) as client:
+                for shards in shard_counts:
+                    product_id, accepted, result = await self.drop(client, shards)
+                    result["checks"] = await self.audit(product_id, accepted)
+                    results.append(result)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="defaults to $MONGO_URL or mongodb://localhost:27017")
+    parser.add_argument("--db-name", default=f"stock_bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of a mongod")
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--shards", default="1,8", help="comma-separated shard counts to compare")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # The sweep is driven explicitly by the audit
+    os.environ.setdefault("STOCK_SWEEPER_ENABLED", "false")
+    server = boot_server(args)
+    bench = StockBenchmark(server, args.stock, args.orders, args.concurrency, args.seed)
+    try:
+        results = asyncio.run(bench.run([int(count) for count in args.shards.split(",")]))
+    finally:
+        if not args.in_memory:
+            from pymongo import MongoClient
+            MongoClient(os.environ["MONGO_URL"]).drop_database(args.db_name)
+
+    ok = True
+    for result in results:
+        print(f"{result['shards']:>3} shard(s): {result['orders']} orders in {result['seconds']}s "
+              f"({result['orders_per_second']}/s), p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+              f"statuses {result['statuses']}, {result['units_sold']}/{args.stock} units sold")
+        for name, passed in result["checks"].items():
+            print(f"    {'✅' if passed else '❌'} {name}")
+            ok = ok and passed
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,9 @@ import '@/App.css';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Send the guest cart cookie with API calls
+axios.defaults.withCredentials = true;
+
 export const AuthContext = React.createContext(null);
 
 function App() {
@@ -78,7 +81,7 @@ function App() {
             <Route path="/" element={<Home />} />
             <Route path="/products" element={<Products />} />
             <Route path="/custom-builder" element={<CustomBuilder />} />
-            <Route path="/cart" element={user ? <Cart /> : <Navigate to="/login" />} />
+            <Route path="/cart" element={<Cart />} />
             <Route path="/checkout" element={user ? <Checkout /> : <Navigate to="/login" />} />
             <Route path="/checkout/success" element={<CheckoutSuccess />} />
             <Route path="/checkout/cancel" element={<CheckoutCancel />} />
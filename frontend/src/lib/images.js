@@ -0,0 +1,34 @@
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
+export const IMAGE_WIDTHS = [320, 480, 640, 960];
+
+// Changes whenever the product's image_url or updated_at does, so the resized variants can be cached as immutable
+function imageVersion(product) {
+  const source = `${product.image_url || ''}|${product.updated_at || ''}`;
+  let hash = 5381;
+  for (let i = 0; i < source.length; i += 1) {
+    hash = ((hash << 5) + hash + source.charCodeAt(i)) | 0;
+  }
+  return (hash >>> 0).toString(36);
+}
+
+export function productImageUrl(product, width) {
+  return `${API}/images/${product.id}?w=${width}&v=${imageVersion(product)}`;
+}
+
+// <img> props for a resized product image; falls back to the original if the resizer fails
+export function productImageProps(product, sizes) {
+  return {
+    src: productImageUrl(product, 480),
+    srcSet: IMAGE_WIDTHS.map((width) => `${productImageUrl(product, width)} ${width}w`).join(', '),
+    sizes,
+    loading: 'lazy',
+    decoding: 'async',
+    onError: (event) => {
+      if (event.currentTarget.src !== product.image_url) {
+        event.currentTarget.srcset = '';
+        event.currentTarget.src = product.image_url;
+      }
+    },
+  };
+}
@@ -0,0 +1,22 @@
+import axios from 'axios';
+
+export const ORDERS_PAGE_SIZE = 20;
+
+export const FIRST_ORDERS_PAGE = { cursor: null, archived: false, done: false };
+
+// Fetch one newest-first page of orders. Recent orders are paged by cursor;
+// once they run out, paging continues through the archived (older, fulfilled) ones.
+export async function fetchOrdersPage(url, page = FIRST_ORDERS_PAGE) {
+  const response = await axios.get(url, {
+    params: {
+      limit: ORDERS_PAGE_SIZE,
+      cursor: page.cursor || undefined,
+      archived: page.archived || undefined,
+    },
+  });
+  const nextCursor = response.headers['x-next-cursor'];
+  const next = nextCursor
+    ? { cursor: nextCursor, archived: page.archived, done: false }
+    : { cursor: null, archived: true, done: page.archived };
+  return { orders: response.data, next };
+}
@@ -8,6 +8,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { AuthContext } from '@/App';
 import { toast } from 'sonner';
+import { fetchOrdersPage } from '@/lib/orders';
 import { Settings } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -16,7 +17,9 @@ const API = `${BACKEND_URL}/api`;
 const AdminDashboard = () => {
   const { user } = useContext(AuthContext);
   const [orders, setOrders] = useState([]);
+  const [ordersPage, setOrdersPage] = useState(null);
   const [shippingRates, setShippingRates] = useState([]);
+  const [stats, setStats] = useState(null);
   const [newRate, setNewRate] = useState({ region: '', rate: '', description: '' });
   const [loading, setLoading] = useState(true);
 
@@ -24,15 +27,29 @@ const AdminDashboard = () => {
     fetchData();
   }, []);
 
+  const loadMoreOrders = async () => {
+    try {
+      const { orders: more, next } = await fetchOrdersPage(`${API}/admin/orders`, ordersPage);
+      setOrders((current) => [...current, ...more]);
+      setOrdersPage(next);
+    } catch (error) {
+      console.error('Error loading orders:', error);
+      toast.error('Failed to load more orders');
+    }
+  };
+
   const fetchData = async () => {
     try {
-      const [ordersRes, ratesRes] = await Promise.all([
-        axios.get(`${API}/admin/orders`),
+      const [ordersRes, ratesRes, statsRes] = await Promise.all([
+        fetchOrdersPage(`${API}/admin/orders`),
         axios.get(`${API}/shipping/rates`),
+        axios.get(`${API}/admin/stats`).catch(() => ({ data: null })),
       ]);
 
-      setOrders(ordersRes.data);
+      setOrders(ordersRes.orders);
+      setOrdersPage(ordersRes.next);
       setShippingRates(ratesRes.data);
+      setStats(statsRes.data);
     } catch (error) {
       console.error('Error fetching admin data:', error);
       toast.error('Failed to load admin data');
@@ -43,9 +60,10 @@ const AdminDashboard = () => {
 
   const updateOrderStatus = async (orderId, status) => {
     try {
-      await axios.patch(`${API}/admin/orders/${orderId}?status=${status}`);
+      const { data: updated } = await axios.patch(`${API}/admin/orders/${orderId}?status=${status}`);
       toast.success('Order status updated');
-      fetchData();
+      // The order list is read from a secondary that may not have the update yet
+      setOrders((current) => current.map((order) => (order.id === updated.id ? updated : order)));
     } catch (error) {
       console.error('Error updating order:', error);
       toast.error('Failed to update order');
@@ -90,6 +108,25 @@ const AdminDashboard = () => {
             <h1 className="text-4xl font-display font-bold text-polo-green">Admin Dashboard</h1>
           </div>
 
+          {stats && (
+            <div data-testid="admin-stats" className="grid md:grid-cols-3 gap-4 mb-8">
+              <Card className="p-6 border-polo-green/20">
+                <p className="text-sm text-[var(--text-secondary)] mb-1">Revenue (30 days)</p>
+                <p className="text-2xl font-display font-bold text-aged-brass">${stats.totals.revenue.toFixed(2)}</p>
+              </Card>
+              <Card className="p-6 border-polo-green/20">
+                <p className="text-sm text-[var(--text-secondary)] mb-1">Orders (30 days)</p>
+                <p className="text-2xl font-display font-bold text-polo-green">{stats.totals.orders}</p>
+              </Card>
+              <Card className="p-6 border-polo-green/20">
+                <p className="text-sm text-[var(--text-secondary)] mb-1">Orders by status</p>
+                <p className="text-sm text-polo-green">
+                  {Object.entries(stats.order_status).map(([status, count]) => `${status}: ${count}`).join(' | ')}
+                </p>
+              </Card>
+            </div>
+          )}
+
           <Tabs defaultValue="orders" className="w-full">
             <TabsList className="grid w-full grid-cols-2 mb-8">
               <TabsTrigger value="orders" data-testid="admin-tab-orders">Manage Orders</TabsTrigger>
@@ -132,6 +169,13 @@ const AdminDashboard = () => {
                     </div>
                   </Card>
                 ))}
+                {ordersPage && !ordersPage.done && (
+                  <div className="text-center">
+                    <Button data-testid="admin-load-more-orders" variant="outline" onClick={loadMoreOrders}>
+                      Load more orders
+                    </Button>
+                  </div>
+                )}
               </div>
             </TabsContent>
 
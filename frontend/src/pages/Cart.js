@@ -15,8 +15,6 @@ const Cart = () => {
   const { user } = useContext(AuthContext);
   const navigate = useNavigate();
   const [cartItems, setCartItems] = useState([]);
-  const [products, setProducts] = useState([]);
-  const [customBlends, setCustomBlends] = useState([]);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -25,15 +23,9 @@ const Cart = () => {
 
   const fetchCart = async () => {
     try {
-      const [cartRes, productsRes, blendsRes] = await Promise.all([
-        axios.get(`${API}/cart`),
-        axios.get(`${API}/products`).catch(() => ({ data: [] })),
-        axios.get(`${API}/custom-blends`).catch(() => ({ data: [] })),
-      ]);
-
-      setCartItems(cartRes.data);
-      setProducts(productsRes.data);
-      setCustomBlends(blendsRes.data);
+      // Line items arrive already joined with product/blend names and prices
+      const summaryRes = await axios.get(`${API}/cart/summary`);
+      setCartItems(summaryRes.data.items);
     } catch (error) {
       console.error('Error fetching cart:', error);
       toast.error('Failed to load cart');
@@ -53,26 +45,10 @@ const Cart = () => {
     }
   };
 
-  const getItemDetails = (item) => {
-    if (item.product_id) {
-      const product = products.find((p) => p.id === item.product_id);
-      return product
-        ? { name: product.name, price: product.price, type: 'Product' }
-        : { name: 'Unknown Product', price: 0, type: 'Product' };
-    } else if (item.custom_blend_id) {
-      const blend = customBlends.find((b) => b.id === item.custom_blend_id);
-      return blend
-        ? { name: blend.name, price: blend.price, type: 'Custom Blend' }
-        : { name: 'Unknown Blend', price: 0, type: 'Custom Blend' };
-    }
-    return { name: 'Unknown Item', price: 0, type: 'Unknown' };
-  };
+  const getItemDetails = (item) => ({ name: item.name, price: item.price, type: item.type });
 
   const calculateTotal = () => {
-    return cartItems.reduce((total, item) => {
-      const details = getItemDetails(item);
-      return total + details.price * item.quantity;
-    }, 0);
+    return cartItems.reduce((total, item) => total + item.line_total, 0);
   };
 
   const handleCheckout = async () => {
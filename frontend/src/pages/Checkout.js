@@ -17,8 +17,7 @@ const Checkout = () => {
   const { user } = useContext(AuthContext);
   const navigate = useNavigate();
   const [cartItems, setCartItems] = useState([]);
-  const [products, setProducts] = useState([]);
-  const [customBlends, setCustomBlends] = useState([]);
+  const [subtotal, setSubtotal] = useState(0);
   const [shippingRates, setShippingRates] = useState([]);
   const [loading, setLoading] = useState(true);
   const [processing, setProcessing] = useState(false);
@@ -40,32 +39,18 @@ const Checkout = () => {
 
   const fetchData = async () => {
     try {
-      let cartData = [];
-      
-      // Try to get cart from localStorage for guests
-      if (!user) {
-        const savedCart = localStorage.getItem('guestCart');
-        if (savedCart) {
-          cartData = JSON.parse(savedCart);
-        }
-      } else {
-        const cartRes = await axios.get(`${API}/cart`);
-        cartData = cartRes.data;
-      }
+      // One summary call returns priced line items, subtotal and shipping rates
+      // (guests' carts are found through the cart cookie)
+      const summaryRes = await axios.get(`${API}/cart/summary`);
 
-      const [productsRes, blendsRes, shippingRes] = await Promise.all([
-        axios.get(`${API}/products`).catch(() => ({ data: [] })),
-        user ? axios.get(`${API}/custom-blends`).catch(() => ({ data: [] })) : Promise.resolve({ data: [] }),
-        axios.get(`${API}/shipping/rates`).catch(() => ({ data: [{ id: '1', region: 'Standard', rate: 10.0, description: 'Personal Delivery' }] })),
-      ]);
+      const rates = summaryRes.data.shipping_rates.length > 0
+        ? summaryRes.data.shipping_rates
+        : [{ id: '1', region: 'Standard', rate: 10.0, description: 'Personal Delivery' }];
 
-      setCartItems(cartData);
-      setProducts(productsRes.data);
-      setCustomBlends(blendsRes.data);
-      setShippingRates(shippingRes.data);
-      if (shippingRes.data.length > 0) {
-        setSelectedShipping(shippingRes.data[0].id);
-      }
+      setCartItems(summaryRes.data.items);
+      setSubtotal(summaryRes.data.subtotal);
+      setShippingRates(rates);
+      setSelectedShipping(rates[0].id);
     } catch (error) {
       console.error('Error fetching data:', error);
       toast.error('Failed to load checkout data');
@@ -74,23 +59,9 @@ const Checkout = () => {
     }
   };
 
-  const getItemDetails = (item) => {
-    if (item.product_id) {
-      const product = products.find((p) => p.id === item.product_id);
-      return product ? { name: product.name, price: product.price } : { name: 'Unknown', price: 0 };
-    } else if (item.custom_blend_id) {
-      const blend = customBlends.find((b) => b.id === item.custom_blend_id);
-      return blend ? { name: blend.name, price: blend.price } : { name: 'Unknown', price: 0 };
-    }
-    return { name: 'Unknown', price: 0 };
-  };
+  const getItemDetails = (item) => ({ name: item.name, price: item.price });
 
-  const calculateSubtotal = () => {
-    return cartItems.reduce((total, item) => {
-      const details = getItemDetails(item);
-      return total + details.price * item.quantity;
-    }, 0);
-  };
+  const calculateSubtotal = () => subtotal;
 
   const getShippingCost = () => {
     const rate = shippingRates.find((r) => r.id === selectedShipping);
@@ -116,15 +87,18 @@ const Checkout = () => {
 
     try {
       // Create order
+      // The server re-prices every line, so only ids and quantities are sent
       const orderItems = cartItems.map((item) => ({
-        ...item,
-        details: getItemDetails(item),
+        product_id: item.product_id,
+        custom_blend_id: item.custom_blend_id,
+        quantity: item.quantity,
       }));
 
       const orderPayload = {
         items: orderItems,
         total_amount: calculateTotal(),
         shipping_address: shippingAddress,
+        shipping_rate_id: selectedShipping,
       };
 
       if (isGuest) {
@@ -140,16 +114,16 @@ const Checkout = () => {
         origin_url: originUrl,
       });
 
-      // Clear guest cart if applicable
-      if (isGuest) {
-        localStorage.removeItem('guestCart');
-      }
-
       // Redirect to Stripe
       window.location.href = checkoutResponse.data.url;
     } catch (error) {
       console.error('Checkout error:', error);
-      toast.error('Checkout failed. Please try again.');
+      if (error.response?.status === 409) {
+        // A limited product sold out while this cart was open
+        toast.error(error.response.data.detail);
+      } else {
+        toast.error('Checkout failed. Please try again.');
+      }
       setProcessing(false);
     }
   };
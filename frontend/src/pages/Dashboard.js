@@ -6,6 +6,7 @@ import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { AuthContext } from '@/App';
 import { toast } from 'sonner';
+import { fetchOrdersPage } from '@/lib/orders';
 import { Package, RefreshCw, User as UserIcon } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -14,6 +15,7 @@ const API = `${BACKEND_URL}/api`;
 const Dashboard = () => {
   const { user } = useContext(AuthContext);
   const [orders, setOrders] = useState([]);
+  const [ordersPage, setOrdersPage] = useState(null);
   const [subscriptions, setSubscriptions] = useState([]);
   const [customBlends, setCustomBlends] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -22,15 +24,27 @@ const Dashboard = () => {
     fetchData();
   }, []);
 
+  const loadMoreOrders = async () => {
+    try {
+      const { orders: more, next } = await fetchOrdersPage(`${API}/orders`, ordersPage);
+      setOrders((current) => [...current, ...more]);
+      setOrdersPage(next);
+    } catch (error) {
+      console.error('Error loading orders:', error);
+      toast.error('Failed to load more orders');
+    }
+  };
+
   const fetchData = async () => {
     try {
       const [ordersRes, subsRes, blendsRes] = await Promise.all([
-        axios.get(`${API}/orders`),
+        fetchOrdersPage(`${API}/orders`),
         axios.get(`${API}/subscriptions`),
         axios.get(`${API}/custom-blends`),
       ]);
 
-      setOrders(ordersRes.data);
+      setOrders(ordersRes.orders);
+      setOrdersPage(ordersRes.next);
       setSubscriptions(subsRes.data);
       setCustomBlends(blendsRes.data);
     } catch (error) {
@@ -125,6 +139,13 @@ const Dashboard = () => {
                     </Card>
                   ))
                 )}
+                {ordersPage && !ordersPage.done && (
+                  <div className="text-center">
+                    <Button data-testid="load-more-orders" variant="outline" onClick={loadMoreOrders}>
+                      Load more orders
+                    </Button>
+                  </div>
+                )}
               </div>
             </TabsContent>
 
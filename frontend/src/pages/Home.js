@@ -12,7 +12,7 @@ const Home = () => {
         <div 
           className="absolute inset-0 z-0"
           style={{
-            backgroundImage: 'url(https://images.unsplash.com/photo-1735910626330-25ce60e05e84?crop=entropy&cs=srgb&fm=jpg&q=85)',
+            backgroundImage: 'url(https://images.unsplash.com/photo-1735910626330-25ce60e05e84?crop=entropy&cs=srgb&fm=jpg&q=80&w=1920)',
             backgroundSize: 'cover',
             backgroundPosition: 'center',
           }}
@@ -69,17 +69,17 @@ const Home = () => {
               {
                 title: 'Select Your Origin',
                 description: 'Choose from premium beans sourced from the finest coffee regions worldwide.',
-                image: 'https://images.unsplash.com/photo-1573898086906-1f9232b65467?crop=entropy&cs=srgb&fm=jpg&q=85',
+                image: 'https://images.unsplash.com/photo-1573898086906-1f9232b65467?crop=entropy&cs=srgb&fm=jpg&q=80&w=800',
               },
               {
                 title: 'Perfect Your Roast',
                 description: 'Light, medium, or dark - customize the roast level to match your taste preferences.',
-                image: 'https://images.unsplash.com/photo-1769437082791-8c9af44d7c28?crop=entropy&cs=srgb&fm=jpg&q=85',
+                image: 'https://images.unsplash.com/photo-1769437082791-8c9af44d7c28?crop=entropy&cs=srgb&fm=jpg&q=80&w=800',
               },
               {
                 title: 'Craft Your Blend',
                 description: 'Mix different beans to create a unique flavor profile that\'s entirely your own.',
-                image: 'https://images.unsplash.com/photo-1670899603742-726393a354fc?crop=entropy&cs=srgb&fm=jpg&q=85',
+                image: 'https://images.unsplash.com/photo-1670899603742-726393a354fc?crop=entropy&cs=srgb&fm=jpg&q=80&w=800',
               },
             ].map((feature, index) => (
               <motion.div
@@ -93,6 +93,8 @@ const Home = () => {
                   <img
                     src={feature.image}
                     alt={feature.title}
+                    loading="lazy"
+                    decoding="async"
                     className="w-full h-full object-cover group-hover:scale-110 transition-all duration-500"
                   />
                   <div className="absolute inset-0 bg-gradient-to-t from-polo-green/60 to-transparent opacity-0 group-hover:opacity-100 transition-all duration-300"></div>
@@ -109,7 +111,7 @@ const Home = () => {
       <section
         className="relative py-32 px-6 bg-polo-green text-center"
         style={{
-          backgroundImage: 'url(https://images.unsplash.com/photo-1687825807239-f880c177aea4?crop=entropy&cs=srgb&fm=jpg&q=85)',
+          backgroundImage: 'url(https://images.unsplash.com/photo-1687825807239-f880c177aea4?crop=entropy&cs=srgb&fm=jpg&q=80&w=1920)',
           backgroundSize: 'cover',
           backgroundPosition: 'center',
           backgroundBlendMode: 'overlay',
@@ -1,27 +1,71 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { motion } from 'framer-motion';
-import { ShoppingCart } from 'lucide-react';
+import { ShoppingCart, Search } from 'lucide-react';
 import { Button } from '@/components/ui/button';
-import { AuthContext } from '@/App';
+import { Input } from '@/components/ui/input';
 import { toast } from 'sonner';
+import { productImageProps } from '@/lib/images';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const PAGE_SIZE = 24;
+const SORT_OPTIONS = [
+  { value: 'relevance', label: 'Best match' },
+  { value: 'price_asc', label: 'Price: low to high' },
+  { value: 'price_desc', label: 'Price: high to low' },
+  { value: 'name', label: 'Name' },
+  { value: 'newest', label: 'Newest' },
+];
 
 const Products = () => {
-  const { user } = useContext(AuthContext);
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [query, setQuery] = useState('');
+  const [origins, setOrigins] = useState([]);
+  const [inStockOnly, setInStockOnly] = useState(false);
+  const [sort, setSort] = useState('relevance');
+  const [facets, setFacets] = useState({ origin: {}, available: {} });
+  const [total, setTotal] = useState(0);
+  const [stock, setStock] = useState({});
 
   useEffect(() => {
-    fetchProducts();
-  }, []);
+    // Debounce typing; filter and sort changes go through the same path
+    const timer = setTimeout(() => fetchProducts(0), 250);
+    return () => clearTimeout(timer);
+  }, [query, origins, inStockOnly, sort]);
 
-  const fetchProducts = async () => {
+  // Only limited products have stock counts; the rest are never sold out
+  const fetchStock = async (items) => {
+    if (!items.length) return;
     try {
-      const response = await axios.get(`${API}/products`);
-      setProducts(response.data);
+      const response = await axios.get(`${API}/inventory`, {
+        params: { product_id: items.map((item) => item.id) },
+        paramsSerializer: { indexes: null },
+      });
+      setStock((current) => ({ ...current, ...response.data.stock }));
+    } catch (error) {
+      console.error('Error fetching stock:', error);
+    }
+  };
+
+  const fetchProducts = async (offset) => {
+    try {
+      const response = await axios.get(`${API}/products/search`, {
+        params: {
+          q: query || undefined,
+          origin: origins,
+          available: inStockOnly ? true : undefined,
+          sort,
+          limit: PAGE_SIZE,
+          offset,
+        },
+        paramsSerializer: { indexes: null },
+      });
+      setProducts((current) => (offset ? [...current, ...response.data.items] : response.data.items));
+      setFacets(response.data.facets);
+      setTotal(response.data.total);
+      fetchStock(response.data.items);
     } catch (error) {
       console.error('Error fetching products:', error);
       // Add sample products for demo
@@ -59,13 +103,15 @@ const Products = () => {
     }
   };
 
-  const addToCart = async (product) => {
-    if (!user) {
-      toast.error('Please login to add items to cart');
-      return;
-    }
+  const toggleOrigin = (origin) => {
+    setOrigins((current) =>
+      current.includes(origin) ? current.filter((o) => o !== origin) : [...current, origin]
+    );
+  };
 
+  const addToCart = async (product) => {
     try {
+      // Guests get a cookie-backed cart that is merged into theirs on login
       await axios.post(`${API}/cart`, {
         product_id: product.id,
         quantity: 1,
@@ -77,7 +123,7 @@ const Products = () => {
     }
   };
 
-  if (loading) {
+  if (loading && !products.length) {
     return (
       <div className="min-h-screen flex items-center justify-center">
         <div className="text-polo-green text-xl font-display">Loading products...</div>
@@ -102,6 +148,61 @@ const Products = () => {
           </p>
         </motion.div>
 
+        <div className="flex flex-col md:flex-row gap-4 mb-6">
+          <div className="relative flex-1">
+            <Search className="absolute left-3 top-1/2 -translate-y-1/2 w-4 h-4 text-[var(--text-secondary)]" />
+            <Input
+              data-testid="product-search-input"
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+              placeholder="Search by name or tasting notes"
+              className="pl-9"
+            />
+          </div>
+          <select
+            data-testid="product-sort-select"
+            value={sort}
+            onChange={(e) => setSort(e.target.value)}
+            className="border border-gray-200 rounded-sm px-3 py-2 bg-white text-polo-green"
+          >
+            {SORT_OPTIONS.map((option) => (
+              <option key={option.value} value={option.value}>
+                {option.label}
+              </option>
+            ))}
+          </select>
+        </div>
+
+        <div className="flex flex-wrap items-center gap-2 mb-10">
+          {Object.entries(facets.origin).map(([origin, count]) => (
+            <button
+              key={origin}
+              data-testid={`origin-facet-${origin}`}
+              onClick={() => toggleOrigin(origin)}
+              className={`px-3 py-1 rounded-sm text-sm border transition-all duration-300 ${
+                origins.includes(origin)
+                  ? 'bg-polo-green text-bg-light border-polo-green'
+                  : 'bg-white text-polo-green border-gray-200 hover:border-aged-brass'
+              }`}
+            >
+              {origin} ({count})
+            </button>
+          ))}
+          <label className="flex items-center gap-2 ml-auto text-sm text-[var(--text-secondary)]">
+            <input
+              type="checkbox"
+              data-testid="in-stock-filter"
+              checked={inStockOnly}
+              onChange={(e) => setInStockOnly(e.target.checked)}
+            />
+            In stock only ({facets.available.true || 0})
+          </label>
+        </div>
+
+        {!products.length && (
+          <p className="text-center text-[var(--text-secondary)] py-16">No coffees match your search.</p>
+        )}
+
         <div className="grid md:grid-cols-2 lg:grid-cols-3 gap-8">
           {products.map((product, index) => (
             <motion.div
@@ -109,12 +210,12 @@ const Products = () => {
               data-testid={`product-card-${product.id}`}
               initial={{ opacity: 0, y: 30 }}
               animate={{ opacity: 1, y: 0 }}
-              transition={{ duration: 0.6, delay: index * 0.1 }}
+              transition={{ duration: 0.6, delay: (index % PAGE_SIZE) * 0.05 }}
               className="group bg-white border border-gray-200 rounded-sm overflow-hidden hover:border-aged-brass transition-all duration-300"
             >
               <div className="relative h-64 overflow-hidden">
                 <img
-                  src={product.image_url}
+                  {...productImageProps(product, '(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw')}
                   alt={product.name}
                   className="w-full h-full object-cover group-hover:scale-110 transition-all duration-500"
                 />
@@ -131,14 +232,21 @@ const Products = () => {
                   {product.description}
                 </p>
                 <div className="flex items-center justify-between">
-                  <span className="text-2xl font-display font-bold text-aged-brass">
-                    ${product.price.toFixed(2)}
-                  </span>
+                  <div>
+                    <span className="text-2xl font-display font-bold text-aged-brass">
+                      ${product.price.toFixed(2)}
+                    </span>
+                    {stock[product.id] !== undefined && stock[product.id] <= 10 && (
+                      <p data-testid={`stock-${product.id}`} className="text-sm text-[var(--text-secondary)]">
+                        {stock[product.id] === 0 ? 'Sold out' : `Only ${stock[product.id]} left`}
+                      </p>
+                    )}
+                  </div>
                   <Button
                     data-testid={`add-to-cart-${product.id}`}
                     onClick={() => addToCart(product)}
                     className="bg-polo-green text-bg-light hover:bg-polo-green/90"
-                    disabled={!product.available}
+                    disabled={!product.available || stock[product.id] === 0}
                   >
                     <ShoppingCart className="w-4 h-4 mr-2" />
                     Add to Cart
@@ -148,6 +256,18 @@ const Products = () => {
             </motion.div>
           ))}
         </div>
+
+        {products.length < total && (
+          <div className="text-center mt-12">
+            <Button
+              data-testid="load-more-products"
+              onClick={() => fetchProducts(products.length)}
+              className="bg-polo-green text-bg-light hover:bg-polo-green/90"
+            >
+              Show more
+            </Button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -0,0 +1,66 @@
+"""Run ``backend/server.py`` against an in-memory database (mongomock-motor)."""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "tests")
+os.environ.setdefault("EMAIL_OUTBOX_ENABLED", "false")
+os.environ.setdefault("SUBSCRIPTION_SCHEDULER_ENABLED", "false")
+os.environ.setdefault("STOCK_SWEEPER_ENABLED", "false")
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database swapped in for ``server.db``."""
+    client = mongomock_motor.AsyncMongoMockClient(tz_aware=True)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client[f"test_{uuid.uuid4().hex[:8]}"])
+    # mongomock has no replica set to route reads to
+    monkeypatch.setattr(server, "MONGO_SECONDARY_READ_PREFERENCE", "primary")
+    return server.db
+
+
+@pytest.fixture
+async def api(db):
+    """An HTTP client for ``server.app``, served in process."""
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def interleaved_writes(monkeypatch):
+    """Make every in-memory write yield to the event loop first.
+
+    mongomock-motor completes each call without yielding, so concurrent
+    tasks would otherwise run one after another. Yielding before each write
+    lets them read the same counts and then race to write, as they would
+    against a real mongod.
+    """
+    collection = mongomock_motor.AsyncMongoMockCollection
+    for name in ("update_one", "update_many", "find_one_and_update", "bulk_write", "insert_one"):
+        write = getattr(collection, name)
+
+        def make_yielding(write):
+            async def yielding(self, *args, **kwargs):
+                await asyncio.sleep(0)
+                return await write(self, *args, **kwargs)
+            return yielding
+
+        monkeypatch.setattr(collection, name, make_yielding(write))
@@ -0,0 +1,123 @@
+"""Auth bursts: per-IP and per-email token buckets (429) and password-work shedding (503)."""
+import asyncio
+import threading
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Small, fresh buckets: 3 attempts per IP and 2 per email, refilling at 60 a minute."""
+    monkeypatch.setattr(server, "AUTH_RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(server, "auth_ip_limiter", server.TokenBucketLimiter("ip", 60, 3))
+    monkeypatch.setattr(server, "auth_email_limiter", server.TokenBucketLimiter("email", 60, 2))
+
+
+async def login(api, email, forwarded_for=None):
+    headers = {"X-Forwarded-For": forwarded_for} if forwarded_for else {}
+    return await api.post("/api/auth/login", json={"email": email, "password": "BurstPass123!"}, headers=headers)
+
+
+def test_bucket_spends_its_burst_then_refills(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    limiter = server.TokenBucketLimiter("ip", rate_per_minute=60, burst=3)
+
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == pytest.approx(1.0)
+    # Other keys have buckets of their own
+    assert limiter.acquire("b") == 0
+
+    clock.now += 1.5
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    clock.now += 60
+    # Refill stops at the burst size
+    assert [limiter.acquire("a") for _ in range(4)][-1] == pytest.approx(1.0)
+    assert (limiter.allowed, limiter.limited) == (8, 3)
+
+
+def test_bucket_evicts_the_least_recent_key():
+    limiter = server.TokenBucketLimiter("ip", rate_per_minute=60, burst=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.acquire(key)
+    assert list(limiter._buckets) == ["b", "c"]
+
+
+async def test_ip_burst_gets_429_with_retry_after(api, limits):
+    statuses = [(await login(api, f"stuffing-{i}@example.com")).status_code for i in range(3)]
+    assert statuses == [401, 401, 401]
+
+    response = await login(api, "stuffing-4@example.com")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+async def test_forged_forwarded_for_does_not_reset_the_ip_bucket(api, limits, monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXY_HOPS", 0)
+    statuses = [(await login(api, f"stuffing-{i}@example.com", f"203.0.113.{i}")).status_code for i in range(6)]
+    assert statuses.count(429) == 3
+
+
+async def test_email_bucket_limits_one_account_across_addresses(api, limits, monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXY_HOPS", 1)
+    statuses = [(await login(api, "Victim@example.com", f"198.51.100.{i}")).status_code for i in range(3)]
+    assert statuses == [401, 401, 429]
+
+    # The email key is case-insensitive, and other accounts are unaffected
+    assert (await login(api, "victim@example.com", "198.51.100.9")).status_code == 429
+    assert (await login(api, "someone@example.com", "198.51.100.10")).status_code == 401
+
+
+async def test_full_password_queue_sheds_with_503(api, monkeypatch):
+    pool = server.PasswordHasherPool("thread", workers=1, max_concurrency=1, max_queue=1, queue_timeout=5)
+    monkeypatch.setattr(server, "password_pool", pool)
+    monkeypatch.setattr(server, "AUTH_RATE_LIMIT_ENABLED", False)
+    release = threading.Event()
+    busy = []
+    try:
+        # One call holds the only worker and one waits: the queue is full
+        for state in ("in_flight", "waiting"):
+            busy.append(asyncio.ensure_future(pool.run(release.wait)))
+            while getattr(pool, state) < 1:
+                await asyncio.sleep(0.001)
+
+        response = await api.post("/api/auth/register", json={
+            "email": "storm@example.com", "password": "BurstPass123!", "name": "Storm",
+        })
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert pool.shed == 1
+    finally:
+        release.set()
+        await asyncio.gather(*busy)
+        pool.shutdown()
+    assert pool.completed == 2
+
+
+async def test_password_queue_timeout_sheds():
+    pool = server.PasswordHasherPool("thread", workers=1, max_concurrency=1, max_queue=10, queue_timeout=0.05)
+    release = threading.Event()
+    holder = asyncio.ensure_future(pool.run(release.wait))
+    try:
+        while pool.in_flight < 1:
+            await asyncio.sleep(0.001)
+        with pytest.raises(server.PasswordPoolBusy) as busy:
+            await pool.run(release.wait)
+        assert busy.value.reason == "queue_timeout"
+    finally:
+        release.set()
+        await holder
+        pool.shutdown()
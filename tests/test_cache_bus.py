@@ -0,0 +1,105 @@
+"""Cross-worker cache invalidation (``CacheInvalidationBus``) over one shared database."""
+import asyncio
+import time
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+POLL_INTERVAL = 0.05
+# Scheduling slack on top of one poll interval
+SLACK = 0.1
+
+
+class Worker:
+    """Another worker process: its own bus, user cache and catalog snapshot."""
+
+    def __init__(self):
+        self.bus = server.CacheInvalidationBus(server.CACHE_BUS_HISTORY, POLL_INTERVAL)
+        self.user_cache = server.TTLCache(100, 60)
+        self.catalog = server.CatalogSnapshot()
+        self.bus.subscribe("users", lambda user_id: self.user_cache.clear() if user_id is None else self.user_cache.pop(user_id))
+        self.bus.subscribe("products", lambda _: self.catalog.invalidate())
+
+
+@pytest.fixture
+async def other_worker(db):
+    worker = Worker()
+    await worker.bus.start()
+    yield worker
+    await worker.bus.stop()
+
+
+async def seconds_until(condition, timeout=POLL_INTERVAL * 20):
+    started = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - started > timeout:
+            pytest.fail(f"not invalidated within {timeout}s")
+        await asyncio.sleep(0.002)
+    return time.perf_counter() - started
+
+
+async def admin_headers(api, db):
+    response = await api.post("/api/auth/register", json={
+        "email": "admin@example.com", "password": "AdminPass123!", "name": "Admin",
+    })
+    admin = response.json()
+    await db.users.update_one({"id": admin['user']['id']}, {"$set": {"is_admin": True}})
+    await server.invalidate_user(admin['user']['id'])
+    return {"Authorization": f"Bearer {admin['token']}"}
+
+
+async def test_product_write_reaches_the_other_worker_within_a_poll(api, db, other_worker):
+    headers = await admin_headers(api, db)
+    product = {"name": "Kenya AA", "description": "Blackcurrant.", "origin": "Kenya", "price": 18.0,
+               "image_url": "https://images.example.com/kenya.jpg"}
+    product_id = (await api.post("/api/products", json=product, headers=headers)).json()['id']
+    await seconds_until(lambda: other_worker.catalog.version > 0)
+    assert [p['name'] for p in (await other_worker.catalog.get()).products] == ["Kenya AA"]
+    version = other_worker.catalog.version
+
+    response = await api.put(f"/api/products/{product_id}", json={**product, "name": "Kenya AA Top Lot"}, headers=headers)
+    assert response.status_code == 200
+
+    assert await seconds_until(lambda: other_worker.catalog.version > version) <= POLL_INTERVAL + SLACK
+    assert [p['name'] for p in (await other_worker.catalog.get()).products] == ["Kenya AA Top Lot"]
+
+
+async def test_user_write_drops_only_that_user_in_the_other_worker(db, other_worker):
+    other_worker.user_cache.set("user-1", "cached")
+    other_worker.user_cache.set("user-2", "cached")
+
+    await server.invalidate_user("user-1")
+
+    assert await seconds_until(lambda: other_worker.user_cache.get("user-1") is None) <= POLL_INTERVAL + SLACK
+    assert other_worker.user_cache.get("user-2") == "cached"
+
+
+async def test_burst_is_replayed_in_order_and_own_events_once(db, other_worker):
+    seen = []
+    other_worker.bus.subscribe("products", seen.append)
+
+    for key in ("a", "b", "c"):
+        await server.cache_bus.publish("products", key)
+    await other_worker.bus.publish("products", "own")
+    await seconds_until(lambda: len(seen) >= 4)
+    # Its own write was applied when published, and is skipped when polled back
+    await asyncio.sleep(POLL_INTERVAL * 3)
+
+    assert [key for key in seen if key != "own"] == ["a", "b", "c"]
+    assert seen.count("own") == 1
+
+
+async def test_falling_behind_the_history_flushes_the_namespace(db, other_worker):
+    await other_worker.bus.stop()
+    other_worker.user_cache.set("user-1", "cached")
+    publisher = server.CacheInvalidationBus(history=5, poll_interval=POLL_INTERVAL)
+
+    for i in range(6):
+        await publisher.publish("users", f"user-{i + 10}")
+    await other_worker.bus.poll_once()
+
+    assert other_worker.bus.flushes == 1
+    assert other_worker.user_cache.get("user-1") is None
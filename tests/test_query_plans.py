@@ -0,0 +1,105 @@
+"""Strict query plan audit: the main routes run without a COLLSCAN.
+
+``explain`` needs a real mongod, so these tests use ``MONGO_URL`` and skip
+when no server answers there.
+"""
+import os
+import uuid
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+ORIGINS = ["ethiopian", "colombian"]
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    """A scratch database on a real mongod, with every command recorded by a fresh auditor."""
+    auditor = server.QueryPlanAuditor()
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True, serverSelectionTimeoutMS=2000,
+                                event_listeners=[auditor])
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f"No mongod at MONGO_URL: {e}")
+    database = client[f"plan_audit_{uuid.uuid4().hex[:8]}"]
+    monkeypatch.setattr(server, "QUERY_PLAN_AUDIT", "strict")
+    monkeypatch.setattr(server, "query_auditor", auditor)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", database)
+    await server.ensure_indexes()
+    # Only the requests below are audited, not index creation
+    auditor.commands.clear()
+    yield database
+    await client.drop_database(database.name)
+    client.close()
+
+
+async def register(api, email):
+    response = await api.post("/api/auth/register", json={
+        "email": email, "password": "ShopperPass123!", "name": "Shopper",
+    })
+    body = response.json()
+    return body['user']['id'], {"Authorization": f"Bearer {body['token']}"}
+
+
+async def test_main_routes_run_without_a_collscan(api, db):
+    admin_id, admin = await register(api, "admin@example.com")
+    await db.users.update_one({"id": admin_id}, {"$set": {"is_admin": True}})
+    await server.invalidate_user(admin_id)
+    _, shopper = await register(api, "shopper@example.com")
+
+    product_ids = []
+    for i, origin in enumerate(ORIGINS):
+        response = await api.post("/api/products", headers=admin, json={
+            "name": f"{origin.title()} Lot {i}", "description": "Caramel and cocoa.", "origin": origin,
+            "price": 15.0 + i, "image_url": f"https://images.example.com/{origin}.jpg",
+        })
+        product_ids.append(response.json()['id'])
+    await api.put(f"/api/products/{product_ids[0]}", headers=admin, json={
+        "name": "Ethiopian Lot 0", "description": "Jasmine.", "origin": "ethiopian", "price": 16.0,
+        "image_url": "https://images.example.com/ethiopian.jpg",
+    })
+    await api.put(f"/api/admin/inventory/{product_ids[0]}", headers=admin, json={"stock": 50, "shards": 2})
+
+    requests = [
+        ("POST", "/api/auth/login", {"json": {"email": "shopper@example.com", "password": "ShopperPass123!"}}),
+        ("GET", "/api/auth/me", {"headers": shopper}),
+        ("GET", "/api/products", {}),
+        ("GET", "/api/products", {"params": {"limit": 1}}),
+        ("GET", "/api/products/search", {"params": {"q": "cocoa", "origin": ORIGINS[:1], "available": "true"}}),
+        ("POST", "/api/quotes", {"json": {"blends": [{
+            "origin": "ethiopian", "roast_level": "medium", "grind_size": "whole_bean",
+            "blend_components": {"ethiopian": 60, "colombian": 40}, "quantity": 500,
+        }]}}),
+        ("POST", "/api/cart", {"headers": shopper, "json": {"product_id": product_ids[1], "quantity": 2}}),
+        ("GET", "/api/cart", {"headers": shopper}),
+        ("GET", "/api/cart/summary", {"headers": shopper}),
+        ("POST", "/api/orders", {"headers": shopper, "json": {
+            "items": [{"product_id": product_id, "quantity": 1} for product_id in product_ids],
+            "shipping_address": {"street": "1 Audit St", "city": "Portland", "zip": "97201"},
+        }}),
+        ("GET", "/api/orders", {"headers": shopper, "params": {"limit": 20}}),
+        ("DELETE", "/api/cart", {"headers": shopper}),
+        ("GET", "/api/inventory", {"params": {"product_id": product_ids}}),
+        ("GET", f"/api/admin/inventory/{product_ids[0]}", {"headers": admin}),
+        ("GET", "/api/admin/orders", {"headers": admin}),
+        ("GET", "/api/admin/stats", {"headers": admin}),
+    ]
+    for method, path, kwargs in requests:
+        response = await api.request(method, path, **kwargs)
+        assert response.status_code < 400, (method, path, response.text)
+
+    response = await api.get("/api/admin/query-audit", headers=admin)
+
+    assert response.status_code == 200
+    audit = response.json()
+    assert audit['queries'] > 0
+    assert audit['violations'] == []
+    assert audit['ok']
@@ -0,0 +1,55 @@
+"""Product search counts sold-out stock-tracked products as out of stock."""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def admin_headers(api, db):
+    response = await api.post("/api/auth/register", json={
+        "email": "admin@example.com", "password": "AdminPass123!", "name": "Admin",
+    })
+    admin = response.json()
+    await db.users.update_one({"id": admin['user']['id']}, {"$set": {"is_admin": True}})
+    await server.invalidate_user(admin['user']['id'])
+    return {"Authorization": f"Bearer {admin['token']}"}
+
+
+async def add_product(api, headers, name):
+    product = {"name": name, "description": "Single origin.", "origin": "Kenya", "price": 18.0,
+               "image_url": "https://images.example.com/kenya.jpg"}
+    return (await api.post("/api/products", json=product, headers=headers)).json()['id']
+
+
+async def search(api, **params):
+    return (await api.get("/api/products/search", params=params)).json()
+
+
+async def test_setting_stock_to_zero_moves_the_product_out_of_stock(api, db):
+    headers = await admin_headers(api, db)
+    sold_out = await add_product(api, headers, "Kenya AA")
+    await add_product(api, headers, "Kenya AB")
+    await api.put(f"/api/admin/inventory/{sold_out}", json={"stock": 2}, headers=headers)
+    assert (await search(api))['facets']['available'] == {"true": 2, "false": 0}
+
+    await api.put(f"/api/admin/inventory/{sold_out}", json={"stock": 0}, headers=headers)
+
+    result = await search(api)
+    assert result['facets']['available'] == {"true": 1, "false": 1}
+    assert {item['name']: item['available'] for item in result['items']} == {"Kenya AA": False, "Kenya AB": True}
+    assert [item['name'] for item in (await search(api, available="true"))['items']] == ["Kenya AB"]
+    assert [item['name'] for item in (await search(api, available="false"))['items']] == ["Kenya AA"]
+
+
+async def test_checkouts_that_sell_out_show_up_after_the_stock_ttl(api, db, monkeypatch):
+    headers = await admin_headers(api, db)
+    product_id = await add_product(api, headers, "Kenya AA")
+    await api.put(f"/api/admin/inventory/{product_id}", json={"stock": 3, "shards": 2}, headers=headers)
+    assert (await search(api, available="true"))['total'] == 1
+
+    await server.stock_ledger.reserve("order-1", {product_id: 3})
+    monkeypatch.setattr(server, "SEARCH_STOCK_TTL", 0)
+
+    assert (await search(api, available="true"))['total'] == 0
+    assert (await search(api))['facets']['available'] == {"true": 0, "false": 1}
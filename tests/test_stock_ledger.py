@@ -0,0 +1,88 @@
+"""Concurrent reservations against sharded stock (``StockLedger``)."""
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+STOCK = 50
+
+
+async def shard_counts(product_id):
+    return [shard['available'] for shard in (await server.stock_ledger.shards([product_id])).get(product_id, [])]
+
+
+async def checkout_rush(ledger, product_id, orders, seed=7):
+    """Fire ``orders`` reservations of 1-3 units at once; the accepted ones."""
+    rng = random.Random(seed)
+    quantities = [rng.randint(1, 3) for _ in range(orders)]
+
+    async def checkout(i):
+        try:
+            return await ledger.reserve(f"order-{i}", {product_id: quantities[i]})
+        except server.InsufficientStock:
+            return None
+
+    return [reservation for reservation in await asyncio.gather(*(checkout(i) for i in range(orders))) if reservation]
+
+
+@pytest.mark.parametrize("shards", [1, 4])
+async def test_concurrent_reservations_never_oversell(db, interleaved_writes, shards):
+    ledger = server.StockLedger()
+    await ledger.set_stock("drop", STOCK, shards)
+
+    accepted = await checkout_rush(ledger, "drop", 120)
+
+    held = sum(part['quantity'] for reservation in accepted for part in reservation['lines'])
+    assert held <= STOCK
+    assert held + (await ledger.available(["drop"]))["drop"] == STOCK
+    assert all(count >= 0 for count in await shard_counts("drop"))
+    assert ledger.rejected == 120 - len(accepted)
+    # The rush really contended for the same shards
+    assert ledger.shard_conflicts > 0
+
+
+async def test_release_and_sweep_restore_the_counters(db, interleaved_writes):
+    ledger = server.StockLedger()
+    await ledger.set_stock("drop", STOCK, 4)
+    accepted = await checkout_rush(ledger, "drop", 60)
+    paid, failed, abandoned = accepted[0::3], accepted[1::3], accepted[2::3]
+
+    await asyncio.gather(*(ledger.commit(reservation['order_id']) for reservation in paid))
+    await asyncio.gather(*(ledger.release(reservation['order_id'], "payment_failed") for reservation in failed))
+    expired = await ledger.sweep(now=datetime.now(timezone.utc) + timedelta(seconds=server.STOCK_RESERVATION_TTL + 1))
+
+    def units(reservations):
+        return sum(part['quantity'] for reservation in reservations for part in reservation['lines'])
+
+    assert expired == len(abandoned)
+    assert (await ledger.available(["drop"]))["drop"] == STOCK - units(paid)
+    # Releasing twice gives nothing back twice
+    assert not await ledger.release(failed[0]['order_id'], "payment_failed")
+    assert (await ledger.available(["drop"]))["drop"] == STOCK - units(paid)
+
+
+async def test_a_short_line_gives_back_the_whole_order(db):
+    ledger = server.StockLedger()
+    await ledger.set_stock("beans", 10, 2)
+    await ledger.set_stock("mugs", 1, 1)
+
+    with pytest.raises(server.InsufficientStock) as short:
+        await ledger.reserve("order-1", {"beans": 4, "mugs": 2})
+
+    assert short.value.product_ids == ["mugs"]
+    assert await ledger.available(["beans", "mugs"]) == {"beans": 10, "mugs": 1}
+    assert await db.stock_reservations.count_documents({}) == 0
+
+
+async def test_non_positive_quantities_are_rejected(db):
+    ledger = server.StockLedger()
+    await ledger.set_stock("beans", 10, 1)
+
+    with pytest.raises(ValueError):
+        await ledger.reserve("order-1", {"beans": 0})
+    assert (await ledger.available(["beans"]))["beans"] == 10